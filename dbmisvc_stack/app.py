@@ -1,11 +1,22 @@
+import hashlib
+import json
 import os
+import shutil
+import tempfile
 import threading
-from docker import errors as docker_errors
+import time
+import uuid
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 import re
+import shlex
 import subprocess
 import yaml
 import select
 from logging import DEBUG, INFO
+from urllib.parse import urlparse
+
+from dbmisvc_stack.subtree import SubtreeSplit
 
 import logging
 
@@ -41,7 +52,61 @@ class LogPipe(threading.Thread):
         os.close(self.fdWrite)
 
 
+# The outcome of a single hook run
+HookResult = namedtuple("HookResult", ["step", "app", "exit_code", "duration", "timed_out"])
+
+# The outcome of running an app's tests in its container
+AppTestResult = namedtuple("AppTestResult", ["app", "exit_code", "duration", "cancelled"])
+
+
+class HookError(Exception):
+    """Raised when a hook fails and the stack is configured to abort on failure."""
+
+    def __init__(self, step, results):
+        self.step = step
+        self.results = results
+        super(HookError, self).__init__(
+            "Hook '{}' failed for: {}".format(step, ", ".join(result.app for result in results))
+        )
+
+
 class Stack:
+
+    # The default number of seconds a hook may run before it is killed
+    HOOK_TIMEOUT = 600
+
+    # The default number of hooks that may run at once
+    HOOK_CONCURRENCY = 4
+
+    # Exit code recorded for a hook that was killed for running too long
+    HOOK_TIMEOUT_EXIT_CODE = 124
+
+    # Where database snapshots are dumped to in MySQL containers
+    SNAPSHOT_DIRECTORY = "/var/lib/stack-snapshots"
+
+    # Connections kept open to Docker, enough for the most apps, hooks or
+    # packages handled at once
+    DOCKER_POOL_SIZE = 16
+
+    # The oldest git that fetches and reads subtrees as the stack does,
+    # for 'git fetch --no-write-fetch-head'
+    GIT_MINIMUM_VERSION = (2, 29)
+
+    # The version of the installed git, once checked
+    _git_version = None
+
+    # Results of all hooks run during the current command
+    hook_results = []
+    _hook_results_lock = threading.Lock()
+
+    # The Docker client shared by the whole process
+    _docker_client = None
+    _docker_client_lock = threading.Lock()
+
+    # Requests made to Docker during the current command: endpoint -> [count, seconds]
+    docker_timings = {}
+    _docker_timings_lock = threading.Lock()
+
     @staticmethod
     def check_stack(cwd):
         """
@@ -69,10 +134,48 @@ class Stack:
         return valid
 
     @staticmethod
-    def get_config(property):
+    def get_git_version():
+        """
+        Returns the version of the installed git
+        :return: The major and minor version, or None if git could not be run
+        :rtype: tuple
+        """
+        if Stack._git_version is None:
+            try:
+                output = subprocess.run(["git", "--version"], stdout=subprocess.PIPE, universal_newlines=True).stdout
+                match = re.search(r"(\d+)\.(\d+)", output)
+                Stack._git_version = (int(match.group(1)), int(match.group(2))) if match else ()
+
+            except OSError:
+                Stack._git_version = ()
+
+        return Stack._git_version or None
+
+    @staticmethod
+    def check_git_version():
+        """
+        Checks that the installed git is recent enough for the stack's git commands
+        :return: Whether it is
+        :rtype: bool
+        """
+        version = Stack.get_git_version()
+        if version is None or version < Stack.GIT_MINIMUM_VERSION:
+            logger.critical(
+                "ERROR: git {} or later is required, found {}".format(
+                    ".".join(map(str, Stack.GIT_MINIMUM_VERSION)),
+                    ".".join(map(str, version)) if version else "none",
+                )
+            )
+            return False
+
+        return True
+
+    @staticmethod
+    def get_config(property, required=True):
         """
         Get a configuration property for the stack, defined in {PROJECT_ROOT}/stack.yml
         :param property: The key of the property to retrieve.
+        :param required: Whether a missing property should be logged as an error
         :return:
         """
 
@@ -90,10 +193,14 @@ class Stack:
 
                     return value
 
-                else:
+                elif required:
                     logger.error("Stack property '{}' does not exist!".format(property))
                     return None
 
+                else:
+                    logger.debug("(stack) Optional property '{}' is not set".format(property))
+                    return None
+
         else:
             logger.error("Stack configuration file does not exist!")
             return None
@@ -123,14 +230,56 @@ class Stack:
             return None
 
     @staticmethod
-    def hook(step, app="stack", arguments=None):
+    def get_hooks_config(property, default=None):
         """
-        Check for a script for the given hook and runs it.
+        Get a property of the optional 'hooks' section of the stack config.
+        :param property: The key of the property to retrieve.
+        :param default: The value to return if the property is not set
+        :return: The value of the property
+        """
+        hooks_dict = Stack.get_config("hooks", required=False) or {}
+
+        return hooks_dict.get(property, default)
+
+    @staticmethod
+    def get_hook_timeout(step):
+        """
+        Returns the number of seconds the hook for the given step may run
+        before it is killed. Per-hook values under 'hooks.timeouts' take
+        precedence over 'hooks.timeout'.
+        :param step: The name of the hook
+        :return: The timeout in seconds
+        :rtype: int
+        """
+        timeouts = Stack.get_hooks_config("timeouts") or {}
+        if timeouts.get(step) is not None:
+            return int(timeouts[step])
+
+        return int(Stack.get_hooks_config("timeout", Stack.HOOK_TIMEOUT))
+
+    @staticmethod
+    def get_hook_concurrency(jobs=None):
+        """
+        Returns the number of hooks that may be run at once.
+        :param jobs: An explicit value, usually passed on the command line
+        :return: The concurrency limit
+        :rtype: int
+        """
+        if jobs is None:
+            jobs = Stack.get_hooks_config("concurrency", Stack.HOOK_CONCURRENCY)
+
+        return max(1, int(jobs))
+
+    @staticmethod
+    def _run_hook(step, app="stack", arguments=None):
+        """
+        Runs the script for the given hook, if any, and records its result.
         :param step: The name of the event, and the name of the hook script
         :param app: The app, if any, the event is for.
         :param arguments: Any additional arguments related to the event to
          be passed to the hook
-        :return: None
+        :return: The result of the hook, or None if no hook exists
+        :rtype: HookResult
         """
 
         # Get the path to the hooks directory.
@@ -139,35 +288,241 @@ class Stack:
 
         # Check it.
         logger.debug("(stack) Looking for hook: {}".format(script_file))
-        if os.path.exists(script_file):
+        if not os.path.exists(script_file):
+            logger.debug("(stack) No script exists for hook '{}'".format(step))
+            return None
+
+        # Build the command
+        command = ["python", script_file]
 
-            # Build the command
-            command = ["python", script_file]
+        # Add the app, if any.
+        if app is not None:
+            command.append(app)
 
-            # Add the app, if any.
-            if app is not None:
-                command.append(app)
+        if arguments is not None:
+            command.extend(arguments)
 
-            if arguments is not None:
-                command.extend(arguments)
+        # Call the file.
+        timeout = Stack.get_hook_timeout(step)
+        logger.debug("(stack) Running hook: {} (timeout: {}s)".format(command, timeout))
+        start = time.monotonic()
+        try:
+            exit_code = Stack.run(command, timeout=timeout)
+            timed_out = False
 
-            # Call the file.
-            logger.debug("(stack) Running hook: {}".format(command))
-            Stack.run(command)
+        except subprocess.TimeoutExpired:
+            logger.error("({}) Hook '{}' timed out after {}s".format(app, step, timeout))
+            exit_code = Stack.HOOK_TIMEOUT_EXIT_CODE
+            timed_out = True
 
-        else:
-            logger.debug("(stack) No script exists for hook '{}'".format(step))
+        result = HookResult(step, app, exit_code, time.monotonic() - start, timed_out)
+        with Stack._hook_results_lock:
+            Stack.hook_results.append(result)
+
+        if exit_code != 0:
+            logger.error("({}) Hook '{}' failed with exit code: {}".format(app, step, exit_code))
+
+        return result
+
+    @staticmethod
+    def _check_hook_results(step, results):
+        """
+        Raises a HookError for any failed hook results if the stack is
+        configured to abort on hook failures.
+        :param step: The name of the hook
+        :param results: The results to check
+        :type results: list
+        """
+        failed = [result for result in results if result is not None and result.exit_code != 0]
+        if failed and Stack.get_hooks_config("abort-on-failure", False):
+            raise HookError(step, failed)
+
+    @staticmethod
+    def hook(step, app="stack", arguments=None):
+        """
+        Check for a script for the given hook and runs it.
+        :param step: The name of the event, and the name of the hook script
+        :param app: The app, if any, the event is for.
+        :param arguments: Any additional arguments related to the event to
+         be passed to the hook
+        :return: The exit code of the hook, 0 if no hook exists
+        :rtype: int
+        :raises HookError: If the hook fails and 'hooks.abort-on-failure' is set
+        """
+        result = Stack._run_hook(step, app, arguments)
+        Stack._check_hook_results(step, [result])
+
+        return result.exit_code if result is not None else 0
+
+    @staticmethod
+    def hooks(step, apps, jobs=None):
+        """
+        Runs the hook for the given step for several apps concurrently.
+        :param step: The name of the event, and the name of the hook script
+        :param apps: A dict of app to the list of arguments for its hook
+        :type apps: dict
+        :param jobs: The number of hooks to run at once, defaults to 'hooks.concurrency'
+        :type jobs: int
+        :return: A dict of app to the exit code of its hook, 0 if no hook exists
+        :rtype: dict
+        :raises HookError: If any hook fails and 'hooks.abort-on-failure' is set
+        """
+        if not apps:
+            return {}
+
+        # Run them all before checking for failures
+        jobs = Stack.get_hook_concurrency(jobs)
+        logger.debug("(stack) Running '{}' hooks for {} app(s), {} at a time".format(step, len(apps), jobs))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            futures = {app: executor.submit(Stack._run_hook, step, app, arguments) for app, arguments in apps.items()}
+            results = {app: future.result() for app, future in futures.items()}
+
+        Stack._check_hook_results(step, results.values())
+
+        return {app: result.exit_code if result is not None else 0 for app, result in results.items()}
+
+    @staticmethod
+    def report_hooks():
+        """
+        Logs the duration and exit code of every hook run during the current command.
+        """
+        if not Stack.hook_results:
+            return
+
+        logger.info("(stack) Hook summary:")
+        for result in Stack.hook_results:
+            logger.info(
+                "    ({}) {}: {:.2f}s, exit code {}{}".format(
+                    result.app,
+                    result.step,
+                    result.duration,
+                    result.exit_code,
+                    " (timed out)" if result.timed_out else "",
+                )
+            )
 
     @staticmethod
     def get_stack_root():
         return os.getcwd()
 
+    @staticmethod
+    def get_docker_client():
+        """
+        Returns the Docker client shared by the whole process, creating it on
+        first use. The API version is pinned so it is not negotiated with
+        Docker each time the stack runs: it is taken from DOCKER_API_VERSION,
+        'docker-api-version' in stack.yml or the version negotiated before.
+        :rtype: docker.DockerClient
+        """
+
+        # The Docker SDK is only imported when needed as importing it is slow
+        import docker
+
+        with Stack._docker_client_lock:
+            if Stack._docker_client is not None:
+                return Stack._docker_client
+
+            # Remember negotiated versions by daemon
+            host = os.environ.get("DOCKER_HOST", "default")
+            versions_path = Stack.get_state_path("docker.json")
+            try:
+                with open(versions_path, "r") as f:
+                    versions = json.load(f)
+
+            except (IOError, ValueError):
+                versions = {}
+
+            version = (
+                os.environ.get("DOCKER_API_VERSION")
+                or Stack.get_config("docker-api-version", required=False)
+                or versions.get(host)
+            )
+            client = docker.from_env(version=version or "auto", max_pool_size=Stack.DOCKER_POOL_SIZE)
+            if not version:
+                versions[host] = client.api.api_version
+                with open(versions_path + ".tmp", "w") as f:
+                    json.dump(versions, f, indent=2, sort_keys=True)
+
+                os.replace(versions_path + ".tmp", versions_path)
+                logger.debug("(stack) Negotiated Docker API version {}".format(client.api.api_version))
+
+            # Time every request
+            client.api.hooks["response"].append(Stack._record_docker_timing)
+
+            Stack._docker_client = client
+            return client
+
+    @staticmethod
+    def _record_docker_timing(response, *args, **kwargs):
+        """Counts a request made to Docker and how long it took to respond."""
+        path = re.sub(r"^/v[0-9.]+", "", urlparse(response.request.url).path)
+
+        # Group requests by endpoint rather than by object
+        path = re.sub(
+            r"/(containers|exec|images|networks|volumes)/(?!json$|create$|prune$)[^/]+",
+            r"/\1/{id}",
+            path,
+        )
+        endpoint = "{} {}".format(response.request.method, path)
+        with Stack._docker_timings_lock:
+            timing = Stack.docker_timings.setdefault(endpoint, [0, 0.0])
+            timing[0] += 1
+            timing[1] += response.elapsed.total_seconds()
+
+    @staticmethod
+    def report_docker():
+        """
+        Logs how many requests were made to each Docker endpoint during the
+        current command, and how long they took.
+        """
+        if not Stack.docker_timings:
+            return
+
+        logger.debug("(stack) Docker requests:")
+        for endpoint, (count, seconds) in sorted(Stack.docker_timings.items(), key=lambda item: -item[1][1]):
+            logger.debug("    {}: {} request(s), {:.3f}s".format(endpoint, count, seconds))
+
+    @staticmethod
+    def get_state_path(*paths):
+        """
+        Returns a path within the stack's local state directory, '.stack' in the
+        stack root, for caches and records that must not be committed. Parent
+        directories are created as needed, and the state directory ignores its
+        own contents so git never picks them up.
+        :param paths: The path components within the state directory
+        :return: The absolute path
+        :rtype: str
+        """
+        directory = os.path.join(Stack.get_stack_root(), ".stack")
+        path = os.path.join(directory, *paths)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        ignore = os.path.join(directory, ".gitignore")
+        if not os.path.exists(ignore):
+            with open(ignore, "w") as f:
+                f.write("*\n")
+
+        return path
+
     @staticmethod
     def run(args, **kwargs):
         """
         Runs subprocess.call and sends stdout and stderr to stdout and stderr
+        :return: The exit code of the process
+        :rtype: int
+        """
+        return subprocess.call(args, **kwargs)
+
+    @staticmethod
+    def run_output(args, **kwargs):
+        """
+        Runs the command and captures its stdout, stderr is sent to stderr
+        :return: The exit code of the process and its stripped output
+        :rtype: int, str
         """
-        subprocess.call(args, **kwargs)
+        process = subprocess.run(args, stdout=subprocess.PIPE, universal_newlines=True, **kwargs)
+
+        return process.returncode, process.stdout.strip()
 
     @staticmethod
     def run_redirect(args, **kwargs):
@@ -230,8 +585,8 @@ class Stack:
     @staticmethod
     def _recreate_postgres_database(docker_client, container, database):
         """
-        Creates commands to recreate a database within a Postgres container and
-        executes them.
+        Closes connections to a database within a Postgres container, then
+        drops and recreates it, all in a single psql exec.
 
         :param docker_client: The current Docker client
         :type docker_client: docker.client
@@ -242,7 +597,35 @@ class Stack:
         :returns: Whether the operation succeeded or not
         :rtype: bool
         """
-        raise NotImplementedError("Postgres support has not been implemented")
+        return Stack._recreate_postgres_databases(docker_client, container, [database])
+
+    @staticmethod
+    def _recreate_postgres_databases(docker_client, container, databases):
+        """
+        Closes connections to databases within a Postgres container, then
+        drops and recreates them, all in a single psql exec.
+
+        :param docker_client: The current Docker client
+        :type docker_client: docker.client
+        :param container: The name of the container running the Postgres database
+        :type container: str
+        :param databases: The names of the databases to recreate
+        :type databases: list
+        :returns: Whether the operation succeeded or not
+        :rtype: bool
+        """
+        statements = [Stack._postgres_terminate(*databases)]
+        for database in databases:
+            statements.append('DROP DATABASE IF EXISTS "{}"'.format(database))
+            statements.append('CREATE DATABASE "{}"'.format(database))
+
+        success, output = Stack._exec_database(
+            docker_client, container, Stack._postgres_commands(container, *statements)
+        )
+        if success:
+            logger.debug("({}) Recreate databases: {}".format(container, output))
+
+        return success
 
     @staticmethod
     def _recreate_mariadb_database(docker_client, container, database):
@@ -259,13 +642,18 @@ class Stack:
         :returns: Whether the operation succeeded or not
         :rtype: bool
         """
-        return App._recreate_mysql_database(docker_client, container, database)
+        return Stack._recreate_mysql_database(docker_client, container, database)
+
+    @staticmethod
+    def _recreate_mariadb_databases(docker_client, container, databases):
+        """Recreates databases within a MariaDB container. This just proxies to MySQL method."""
+        return Stack._recreate_mysql_databases(docker_client, container, databases)
 
     @staticmethod
     def _recreate_mysql_database(docker_client, container, database):
         """
-        Creates commands to recreate a database within a MySQL container and
-        executes them.
+        Drops and recreates a database within a MySQL container and flushes
+        privileges, all in a single mysql exec.
 
         :param docker_client: The current Docker client
         :type docker_client: docker.client
@@ -276,49 +664,267 @@ class Stack:
         :returns: Whether the operation succeeded or not
         :rtype: bool
         """
-        # Connect.
-        username = "root"
-        password = App.get_config(container, "environment").get("MYSQL_ROOT_PASSWORD")
+        return Stack._recreate_mysql_databases(docker_client, container, [database])
 
-        # Build the command to drop database and run it
-        command = "mysqladmin -u{} -p{} -f drop {}".format(username, password, database)
-        exit_code, output = App.run_command(docker_client, container, command)
+    @staticmethod
+    def _recreate_mysql_databases(docker_client, container, databases):
+        """
+        Drops and recreates databases within a MySQL container and flushes
+        privileges, all in a single mysql exec.
 
-        # Check result
-        if exit_code:
-            logger.error("({}) Purge operation to drop database failed: {} - {}".format(container, exit_code, output))
-            return False
-        else:
-            logger.debug("({}) Drop database: {} - {}".format(container, exit_code, output))
+        :param docker_client: The current Docker client
+        :type docker_client: docker.client
+        :param container: The name of the container running the MySQL database
+        :type container: str
+        :param databases: The names of the databases to recreate
+        :type databases: list
+        :returns: Whether the operation succeeded or not
+        :rtype: bool
+        """
+        statements = "".join(
+            "DROP DATABASE IF EXISTS `{0}`; CREATE DATABASE `{0}`; ".format(database) for database in databases
+        )
+        success, output = Stack._exec_database(
+            docker_client,
+            container,
+            ["mysql", "-uroot", "-e", statements + "FLUSH PRIVILEGES;"],
+            environment=Stack._mysql_environment(container),
+        )
+        if success:
+            logger.debug("({}) Recreate databases: {}".format(container, output))
+
+        return success
+
+    @staticmethod
+    def get_snapshot_name(database):
+        """
+        Returns the name of the database or file holding a database's snapshot
+        :param database: The name of the database
+        :type database: str
+        :rtype: str
+        """
+        return "{}__stack_snapshot".format(database)
 
-        # Build the command to create empty database and run it
-        command = "mysqladmin -u{} -p{} create {}".format(username, password, database)
-        exit_code, output = App.run_command(docker_client, container, command)
+    @staticmethod
+    def _exec_database(docker_client, container, command, environment=None):
+        """
+        Runs a command in the database container and logs its output if it fails
+        :return: Whether the command succeeded, and its output
+        :rtype: bool, str
+        """
+        db_container = App.get_container(docker_client, container)
+        if db_container is None:
+            logger.error("({}) Database container could not be found".format(container))
+            return False, ""
 
-        # Check result
+        exit_code, output = db_container.exec_run(command, environment=environment)
+        output = output.decode("utf-8", "replace").strip()
         if exit_code:
-            logger.error("({}) Purge operation to create database failed: {} - {}".format(container, exit_code, output))
-            return False
+            logger.error("({}) Database command failed: {} - {}".format(container, exit_code, output))
+
+        return exit_code == 0, output
+
+    @staticmethod
+    def _get_environment(container):
+        """Returns the environment of the database container's service as a dict."""
+        environment = App.get_config(container, "environment") or {}
+        if isinstance(environment, list):
+            environment = dict(variable.partition("=")[::2] for variable in environment)
+
+        return environment
+
+    @staticmethod
+    def _postgres_commands(container, *statements):
+        """
+        Returns a psql command running each statement on its own, as
+        CREATE DATABASE and DROP DATABASE cannot run in a transaction
+        """
+        user = Stack._get_environment(container).get("POSTGRES_USER", "postgres")
+        command = ["psql", "-v", "ON_ERROR_STOP=1", "-tA", "-U", user, "-d", "postgres"]
+        for statement in statements:
+            command.extend(["-c", statement])
+
+        return command
+
+    @staticmethod
+    def _postgres_terminate(*databases):
+        """Returns a statement closing other connections to databases so they can be copied or dropped."""
+        if len(databases) == 1:
+            condition = "datname = '{}'".format(databases[0])
         else:
-            logger.debug("({}) Create database: {} - {}".format(container, exit_code, output))
+            condition = "datname IN ({})".format(", ".join("'{}'".format(database) for database in databases))
+
+        return "SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE {} AND pid <> pg_backend_pid()".format(
+            condition
+        )
 
-        # Build the command to flush privileges and run it
-        command = "mysqladmin -u{} -p{} flush-privileges".format(username, password)
-        exit_code, output = App.run_command(docker_client, container, command)
+    @staticmethod
+    def _snapshot_postgres_database(docker_client, container, database):
+        """
+        Copies a Postgres database to a template database it can be restored
+        from. Connections to the database are closed while it is copied.
 
-        # Check result
-        if exit_code:
-            logger.error(
-                "({}) Purge operation to flush privileges failed: {} - {}".format(container, exit_code, output)
-            )
+        :returns: Whether the operation succeeded or not
+        :rtype: bool
+        """
+        snapshot = Stack.get_snapshot_name(database)
+        command = Stack._postgres_commands(
+            container,
+            Stack._postgres_terminate(database),
+            'DROP DATABASE IF EXISTS "{}"'.format(snapshot),
+            'CREATE DATABASE "{}" TEMPLATE "{}"'.format(snapshot, database),
+        )
+
+        return Stack._exec_database(docker_client, container, command)[0]
+
+    @staticmethod
+    def _restore_postgres_database(docker_client, container, database):
+        """
+        Recreates a Postgres database from its template database, if it has one.
+
+        :returns: Whether the operation succeeded or not
+        :rtype: bool
+        """
+        snapshot = Stack.get_snapshot_name(database)
+        success, output = Stack._exec_database(
+            docker_client,
+            container,
+            Stack._postgres_commands(container, "SELECT 1 FROM pg_database WHERE datname = '{}'".format(snapshot)),
+        )
+        if not success or output != "1":
+            logger.debug("({}) No snapshot database '{}' found".format(container, snapshot))
             return False
-        else:
-            logger.debug("({}) Flush privileges: {} - {}".format(container, exit_code, output))
 
-        return True
+        command = Stack._postgres_commands(
+            container,
+            Stack._postgres_terminate(database),
+            'DROP DATABASE IF EXISTS "{}"'.format(database),
+            'CREATE DATABASE "{}" TEMPLATE "{}"'.format(database, snapshot),
+        )
+
+        return Stack._exec_database(docker_client, container, command)[0]
+
+    @staticmethod
+    def _mysql_environment(container):
+        """Returns the environment passing the root password to MySQL clients."""
+        return {"MYSQL_PWD": Stack._get_environment(container).get("MYSQL_ROOT_PASSWORD")}
+
+    @staticmethod
+    def _snapshot_mysql_database(docker_client, container, database):
+        """
+        Dumps a MySQL database to a file in its container it can be restored
+        from.
+
+        :returns: Whether the operation succeeded or not
+        :rtype: bool
+        """
+        path = shlex.quote("{}/{}.sql".format(Stack.SNAPSHOT_DIRECTORY, Stack.get_snapshot_name(database)))
+        script = (
+            "mkdir -p {directory} && "
+            "mysqldump -uroot --single-transaction --routines --triggers --events {database} > {path}.tmp && "
+            "mv {path}.tmp {path}"
+        ).format(directory=shlex.quote(Stack.SNAPSHOT_DIRECTORY), database=shlex.quote(database), path=path)
+
+        return Stack._exec_database(
+            docker_client, container, ["sh", "-c", script], environment=Stack._mysql_environment(container)
+        )[0]
+
+    @staticmethod
+    def _restore_mysql_database(docker_client, container, database):
+        """
+        Recreates a MySQL database and loads its snapshot, if it has one.
+
+        :returns: Whether the operation succeeded or not
+        :rtype: bool
+        """
+        path = shlex.quote("{}/{}.sql".format(Stack.SNAPSHOT_DIRECTORY, Stack.get_snapshot_name(database)))
+        script = "test -f {path} && mysql -uroot -e {sql} && mysql -uroot {database} < {path}".format(
+            path=path,
+            sql=shlex.quote("DROP DATABASE IF EXISTS `{0}`; CREATE DATABASE `{0}`".format(database)),
+            database=shlex.quote(database),
+        )
+
+        return Stack._exec_database(
+            docker_client, container, ["sh", "-c", script], environment=Stack._mysql_environment(container)
+        )[0]
+
+    @staticmethod
+    def _snapshot_mariadb_database(docker_client, container, database):
+        """Snapshots a MariaDB database. This just proxies to MySQL method."""
+        return Stack._snapshot_mysql_database(docker_client, container, database)
+
+    @staticmethod
+    def _restore_mariadb_database(docker_client, container, database):
+        """Restores a MariaDB database. This just proxies to MySQL method."""
+        return Stack._restore_mysql_database(docker_client, container, database)
+
+    @staticmethod
+    def _dump_postgres_command(container, database):
+        """Returns the command writing a compressed dump of a Postgres database to stdout."""
+        user = Stack._get_environment(container).get("POSTGRES_USER", "postgres")
+        return ["pg_dump", "-Fc", "-U", user, database], None
+
+    @staticmethod
+    def _load_postgres_command(container, database, jobs=1):
+        """
+        Returns the command loading a Postgres dump from stdin. pg_restore can
+        only load tables in parallel from a file, so with several jobs the dump
+        is written to a file in the container first.
+        """
+        user = Stack._get_environment(container).get("POSTGRES_USER", "postgres")
+        restore = ["pg_restore", "--clean", "--if-exists", "--no-owner", "-U", user, "-d", database]
+        if jobs <= 1:
+            return restore, None
+
+        path = shlex.quote("/tmp/{}.dump".format(Stack.get_snapshot_name(database)))
+        script = "cat > {path} && {restore} --jobs={jobs} {path}; code=$?; rm -f {path}; exit $code".format(
+            path=path, restore=" ".join(shlex.quote(argument) for argument in restore), jobs=int(jobs)
+        )
+        return ["sh", "-c", script], None
+
+    @staticmethod
+    def _dump_mysql_command(container, database):
+        """Returns the command writing a gzipped dump of a MySQL database to stdout."""
+        # Keep the exit code of mysqldump rather than gzip, without relying on bash
+        script = (
+            "status=$(mktemp); "
+            "{{ mysqldump -uroot --single-transaction --routines --triggers --events {}; echo $? > $status; }} | gzip -c; "
+            "code=$(cat $status); rm -f $status; exit $code"
+        ).format(shlex.quote(database))
+        return ["sh", "-c", script], Stack._mysql_environment(container)
+
+    @staticmethod
+    def _load_mysql_command(container, database, jobs=1):
+        """Returns the command loading a gzipped MySQL dump from stdin. MySQL loads dumps serially."""
+        script = "gunzip -c | mysql -uroot {}".format(shlex.quote(database))
+        return ["sh", "-c", script], Stack._mysql_environment(container)
+
+    @staticmethod
+    def _dump_mariadb_command(container, database):
+        """Dumps a MariaDB database. This just proxies to MySQL method."""
+        return Stack._dump_mysql_command(container, database)
+
+    @staticmethod
+    def _load_mariadb_command(container, database, jobs=1):
+        """Loads a MariaDB dump. This just proxies to MySQL method."""
+        return Stack._load_mysql_command(container, database, jobs)
 
 
 class App:
+
+    # The default number of repositories that may be fetched at once
+    FETCH_CONCURRENCY = 8
+
+    # Snapshots of several apps' databases may be recorded at once
+    _snapshots_lock = threading.Lock()
+
+    # Where the process ID of a run of an app's tests is kept in its container
+    # while they run, so they can be stopped
+    TEST_PID_FILE = "/tmp/.stack-test-{app}-{run}.pid"
+
+    # Seconds to wait for tests that were just started to record their process ID
+    TEST_PID_TIMEOUT = 10
+
     @staticmethod
     def check(docker_client, app=None):
 
@@ -391,6 +997,7 @@ class App:
 
     @staticmethod
     def check_running(docker_client, app):
+        from docker import errors as docker_errors
 
         # Get the container name.
         name = App.get_container_name(app)
@@ -416,7 +1023,33 @@ class App:
         return False
 
     @staticmethod
-    def clean_images(docker_client, app=None):
+    def get_container(docker_client, app):
+        """
+        Returns the container for the app, looked up by its container name or,
+        if it has none, by the docker-compose service label.
+        :param docker_client: The Docker client instance
+        :type docker_client: docker.client
+        :param app: The app
+        :type app: str
+        :return: The container, or None if it could not be found
+        :rtype: docker.models.containers.Container
+        """
+        from docker import errors as docker_errors
+
+        name = App.get_container_name(app)
+        try:
+            if name:
+                return docker_client.containers.get(name)
+
+            containers = docker_client.containers.list(filters={"label": "com.docker.compose.service={}".format(app)})
+            return containers[0] if containers else None
+
+        except docker_errors.NotFound:
+            logger.debug("({}) Container could not be found".format(app))
+            return None
+
+    @staticmethod
+    def clean_images(docker_client, app=None):
 
         # Determine what to clean
         apps = [app] if app is not None else App.get_apps()
@@ -449,8 +1082,73 @@ class App:
                 # Log.
                 logger.debug("({}) Not a built app, no need to clean images".format(app_to_clean))
 
+    @staticmethod
+    def normalize_image(reference):
+        """
+        Returns an image reference in the short form Docker lists images with,
+        so 'docker.io/library/postgres' and 'postgres:latest' compare equal
+        :param reference: The image name, with an optional tag or digest
+        :type reference: str
+        :return: The reference without Docker Hub's registry, with a tag or digest
+        :rtype: str
+        """
+        name, at, digest = reference.partition("@")
+
+        # The first component is a registry if it looks like a host
+        registry, _, path = name.partition("/")
+        if path and registry in ("docker.io", "index.docker.io", "registry-1.docker.io"):
+            name = path[len("library/") :] if path.startswith("library/") and path.count("/") == 1 else path
+
+        elif registry == "library" and path.count("/") == 0:
+            name = path
+
+        # A digest picks the image by itself, images without either are the latest
+        tagged = ":" in name.rsplit("/", 1)[-1]
+        if at and tagged:
+            name = name.rsplit(":", 1)[0]
+
+        elif not at and not tagged:
+            name = "{}:latest".format(name)
+
+        return name + at + digest
+
+    @staticmethod
+    def check_ready(docker_client, apps):
+        """
+        Checks that each app's image exists and its container is running, with
+        one listing of images and one of containers for all of them
+        :param docker_client: The Docker client instance
+        :type docker_client: docker.client
+        :param apps: The apps
+        :type apps: list
+        :return: A dict of each app that is not ready to why not
+        :rtype: dict
+        """
+        tags = set()
+        for image in docker_client.images.list():
+            tags.update(App.normalize_image(tag) for tag in image.tags)
+            tags.update(App.normalize_image(digest) for digest in image.attrs.get("RepoDigests") or [])
+
+        statuses = {container.name: container.status for container in docker_client.containers.list(all=True)}
+
+        problems = {}
+        for app in apps:
+            image = App.get_image_name(app)
+            name = App.get_container_name(app)
+            if not image or App.normalize_image(image) not in tags:
+                problems[app] = "Container image does not exist, build and try again..."
+
+            elif name and statuses.get(name) != "running":
+                problems[app] = "Container is not running, ensure all containers are started..."
+
+            else:
+                logger.debug("({}) Container is ready with status '{}'".format(app, statuses.get(name, "N/A")))
+
+        return problems
+
     @staticmethod
     def check_docker_images(docker_client, app, external=False):
+        from docker import errors as docker_errors
 
         # Check the testing image.
         image = App.get_image_name(app)
@@ -644,6 +1342,7 @@ class App:
 
     @staticmethod
     def run_command(docker_client, app, cmd):
+        from docker import errors as docker_errors
 
         try:
             # Get the container.
@@ -659,8 +1358,180 @@ class App:
 
         return None
 
+    @staticmethod
+    def get_test_command(app):
+        """
+        Returns the command that runs the app's tests in its container, set
+        with 'test' in the app's stack config
+        :rtype: str
+        """
+        return ((Stack.get_config("apps", required=False) or {}).get(app) or {}).get("test")
+
+    @staticmethod
+    def run_tests(docker_client, app, stop=None, run=None):
+        """
+        Runs the app's test command in its container, logging its output line
+        by line as it arrives
+        :param docker_client: The Docker client instance
+        :type docker_client: docker.client
+        :param app: The app
+        :type app: str
+        :param stop: Once set, the tests are not started, see stop_tests
+        :type stop: threading.Event
+        :param run: Identifies this run of the tests to stop_tests
+        :type run: str
+        :rtype: AppTestResult
+        """
+        start = time.monotonic()
+        container = App.get_container(docker_client, app)
+        if container is None:
+            logger.error("({}) Container could not be found for running tests".format(app))
+            return AppTestResult(app, 1, 0.0, False)
+
+        if stop is not None and stop.is_set():
+            return AppTestResult(app, None, 0.0, True)
+
+        # Record the process ID of the tests while they run, atomically as it is read concurrently
+        pid_file = shlex.quote(App.TEST_PID_FILE.format(app=app, run=run or uuid.uuid4().hex))
+        command = [
+            "sh",
+            "-c",
+            "trap 'rm -f {0} {0}.tmp' EXIT; trap 'exit 143' TERM INT; "
+            'echo $$ > {0}.tmp && mv {0}.tmp {0} && sh -c "$0"'.format(pid_file),
+            App.get_test_command(app),
+        ]
+        logger.debug("({}) Running tests: {}".format(app, command[-1]))
+
+        api = docker_client.api
+        exec_id = api.exec_create(container.id, command, stdout=True, stderr=True)["Id"]
+        buffer = b""
+        for chunk in api.exec_start(exec_id, stream=True):
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                logger.info("({}) {}".format(app, line.decode("utf-8", "replace")))
+
+        if buffer:
+            logger.info("({}) {}".format(app, buffer.decode("utf-8", "replace")))
+
+        exit_code = api.exec_inspect(exec_id)["ExitCode"]
+        cancelled = exit_code != 0 and stop is not None and stop.is_set()
+        return AppTestResult(app, exit_code, time.monotonic() - start, cancelled)
+
+    @staticmethod
+    def stop_tests(docker_client, app, run):
+        """
+        Stops a run of the app's tests in its container, along with every
+        process they started, waiting briefly for tests that were only just
+        started to record their process ID
+        :param run: The run given to run_tests
+        :type run: str
+        """
+        container = App.get_container(docker_client, app)
+        if container is not None:
+            container.exec_run(
+                [
+                    "sh",
+                    "-c",
+                    "pids() {{ echo $1; for child in $(cat /proc/$1/task/*/children 2>/dev/null); do pids $child; done; }}; "
+                    "i=0; while [ ! -f {0} ] && [ $i -lt {1} ]; do sleep 0.1; i=$((i + 1)); done; "
+                    "[ -f {0} ] && kill $(pids $(cat {0})) 2>/dev/null".format(
+                        shlex.quote(App.TEST_PID_FILE.format(app=app, run=run)), App.TEST_PID_TIMEOUT * 10
+                    ),
+                ]
+            )
+
+    @staticmethod
+    def get_statuses(apps, version=None):
+        """
+        Returns the status of each app's container, inspecting them all at once
+        on one event loop
+        :param apps: The apps
+        :type apps: list
+        :param version: The Docker API version to use
+        :type version: str
+        :return: A dict of app to status
+        :rtype: dict
+        """
+        import asyncio
+
+        from dbmisvc_stack.docker_async import AsyncDockerClient, AsyncNotFound, run
+
+        async def get_status(client, app):
+            name = App.get_container_name(app)
+            if not name:
+                logger.debug("({}) Skipping app status check, no container name...".format(app))
+                return "N/A"
+
+            try:
+                return (await client.get_container(name))["State"]["Status"]
+
+            except AsyncNotFound:
+                logger.debug("({}) Container could not be found".format(app))
+                return "Not found"
+
+        async def get_statuses():
+            client = AsyncDockerClient(version=version)
+            return await asyncio.gather(*(get_status(client, app) for app in apps))
+
+        return dict(zip(apps, run(get_statuses())))
+
+    @staticmethod
+    def stream_logs(apps, follow=False, tail=None, since=None, version=None):
+        """
+        Logs the output of every app's container as it arrives, prefixed with
+        the app, streaming all of them at once on one event loop
+        :param apps: The apps
+        :type apps: list
+        :param follow: Whether to keep streaming new output
+        :param tail: How many of the last lines to start from
+        :param since: The Unix time to start from
+        :param version: The Docker API version to use
+        """
+        import asyncio
+
+        from dbmisvc_stack.docker_async import AsyncDockerClient, AsyncNotFound, run
+
+        async def stream_logs(client, app, name):
+            if not name:
+                logger.warning("({}) Container could not be found".format(app))
+                return
+
+            try:
+                tty = (await client.get_container(name))["Config"].get("Tty", False)
+                buffer = b""
+                async for _, data in client.logs(name, follow=follow, tail=tail, since=since, tty=tty):
+                    buffer += data
+                    *lines, buffer = buffer.split(b"\n")
+                    for line in lines:
+                        logger.info("({}) {}".format(app, line.decode("utf-8", "replace")))
+
+                if buffer:
+                    logger.info("({}) {}".format(app, buffer.decode("utf-8", "replace")))
+
+            except AsyncNotFound:
+                logger.warning("({}) Container could not be found".format(app))
+
+        async def stream_all():
+            client = AsyncDockerClient(version=version)
+            names = {app: App.get_container_name(app) for app in apps}
+
+            # Containers without a name of their own are found by their docker-compose service, all in one listing
+            if not all(names.values()):
+                label = "com.docker.compose.service"
+                services = {}
+                for container in await client.list_containers(all=True, filters={"label": [label]}):
+                    services.setdefault((container.get("Labels") or {}).get(label), container["Id"])
+
+                names = {app: name or services.get(app) for app, name in names.items()}
+
+            await asyncio.gather(*(stream_logs(client, app, names[app]) for app in apps))
+
+        run(stream_all())
+
     @staticmethod
     def get_status(docker_client, app):
+        from docker import errors as docker_errors
 
         # Get the container name.
         name = App.get_container_name(app)
@@ -681,14 +1552,441 @@ class App:
             return "Not found"
 
     @staticmethod
-    def init(app):
+    def get_repo_dir(app):
+        """
+        Returns the path, relative to the stack root, of the subtree for the app
+        :param app: The app
+        :return: The path to the app's subtree
+        :rtype: str
+        """
+        apps_dir = os.path.relpath(Stack.get_config("apps-directory"))
+
+        return os.path.join(apps_dir, app)
+
+    @staticmethod
+    def get_fetch_ref(app):
+        """
+        Returns the local ref an app's repository branch is fetched into
+        :param app: The app
+        :return: The name of the ref
+        :rtype: str
+        """
+        return "refs/stack/{}".format(app)
+
+    @staticmethod
+    def get_mirror_dir(app):
+        """
+        Returns the path of the bare mirror of the app's repository, if
+        'mirrors-directory' is set in the stack config. Mirrors are keyed by
+        app and repository URL so they can be shared by several stacks.
+        :param app: The app
+        :type app: str
+        :return: The path to the mirror, or None if mirrors are not enabled
+        :rtype: str
+        """
+        mirrors_dir = Stack.get_config("mirrors-directory", required=False)
+        repo_url = App.get_repo_url(app)
+        if not mirrors_dir or not repo_url:
+            return None
+
+        # Relative paths are relative to the stack root
+        mirrors_dir = os.path.join(Stack.get_stack_root(), os.path.expanduser(mirrors_dir))
+        digest = hashlib.sha1(repo_url.encode("utf-8")).hexdigest()[:10]
+
+        return os.path.normpath(os.path.join(mirrors_dir, "{}-{}.git".format(app, digest)))
+
+    @staticmethod
+    def update_mirror(app):
+        """
+        Creates or incrementally refreshes the bare mirror of the app's repository.
+        :param app: The app
+        :type app: str
+        :return: Whether the mirror is up to date or not
+        :rtype: bool
+        """
+        mirror_dir = App.get_mirror_dir(app)
+        if mirror_dir is None:
+            logger.error("({}) Repository mirrors are not enabled, set 'mirrors-directory'".format(app))
+            return False
+
+        start = time.monotonic()
+        if os.path.exists(mirror_dir):
+            command = ["git", "--git-dir={}".format(mirror_dir), "fetch", "--quiet", "--prune", "origin"]
+        else:
+            logger.info("({}) Creating repository mirror at '{}'...".format(app, mirror_dir))
+            command = ["git", "clone", "--quiet", "--mirror", App.get_repo_url(app), mirror_dir]
+
+        return_code = Stack.run(command)
+        if return_code != 0:
+            logger.warning("({}) Refreshing repository mirror failed with exit code: {}".format(app, return_code))
+            return False
+
+        logger.info("({}) Refreshed repository mirror in {:.2f}s".format(app, time.monotonic() - start))
+        return True
+
+    @staticmethod
+    def get_fetch_url(app, offline=False):
+        """
+        Returns where the app's repository should be fetched from. If mirrors
+        are enabled, the mirror is refreshed (unless offline) and used, falling
+        back on a stale mirror if the refresh fails.
+        :param app: The app
+        :type app: str
+        :param offline: Use the mirror as-is without refreshing it
+        :type offline: bool
+        :return: The URL or path to fetch from, or None if there is nothing to fetch from
+        :rtype: str
+        """
+        mirror_dir = App.get_mirror_dir(app)
+        if mirror_dir is None:
+            return App.get_repo_url(app)
+
+        if not offline and not App.update_mirror(app) and os.path.exists(mirror_dir):
+            logger.warning("({}) Using repository mirror as-is".format(app))
+
+        if not os.path.exists(mirror_dir):
+            logger.error("({}) Repository mirror does not exist at '{}'".format(app, mirror_dir))
+            return None
+
+        return mirror_dir
+
+    @staticmethod
+    def fetch(app, branch=None, offline=False):
+        """
+        Fetches the app's repository branch into a local ref so subtree operations
+        can run against it without touching the network. Fetches only write
+        objects and the app's own ref, so several may run at once.
+        :param app: The app to fetch
+        :type app: str
+        :param branch: The branch to fetch, defaults to the app's configured branch
+        :type branch: str
+        :param offline: Fetch from the app's repository mirror without refreshing it
+        :type offline: bool
+        :return: Whether the fetch succeeded or not
+        :rtype: bool
+        """
+        branch = branch or App.get_repo_branch(app)
+        if App.get_repo_url(app) is None or branch is None:
+            logger.error("({}) Repository URL or branch is not specified, cannot fetch...".format(app))
+            return False
+
+        if not Stack.check_git_version():
+            return False
+
+        logger.info("({}) Fetching branch '{}'...".format(app, branch))
+        start = time.monotonic()
+
+        # Determine the source
+        fetch_url = App.get_fetch_url(app, offline=offline)
+        if fetch_url is None:
+            return False
+
+        # Build the command, leaving FETCH_HEAD and gc alone as other fetches may be running
+        command = [
+            "git",
+            "fetch",
+            "--quiet",
+            "--no-tags",
+            "--no-write-fetch-head",
+            "--no-auto-gc",
+            fetch_url,
+            "+{}:{}".format(branch, App.get_fetch_ref(app)),
+        ]
+
+        return_code = Stack.run(command)
+        if return_code != 0:
+            logger.error("({}) Fetching branch '{}' failed with exit code: {}".format(app, branch, return_code))
+            return False
+
+        logger.info("({}) Fetched branch '{}' in {:.2f}s".format(app, branch, time.monotonic() - start))
+        return True
+
+    @staticmethod
+    def fetch_all(apps, jobs=None, offline=False):
+        """
+        Fetches the repositories of several apps concurrently.
+        :param apps: The apps to fetch
+        :type apps: list
+        :param jobs: The number of fetches to run at once
+        :type jobs: int
+        :param offline: Fetch from repository mirrors without refreshing them
+        :type offline: bool
+        :return: The apps that were fetched successfully, in the order given
+        :rtype: list
+        """
+        apps = list(apps)
+        if not apps:
+            return []
+
+        jobs = max(1, int(jobs or App.FETCH_CONCURRENCY))
+        logger.info("(stack) Fetching {} app(s), {} at a time".format(len(apps), jobs))
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(lambda app: App.fetch(app, offline=offline), apps))
+
+        logger.info("(stack) Fetched {}/{} app(s) in {:.2f}s".format(sum(results), len(apps), time.monotonic() - start))
+
+        return [app for app, fetched in zip(apps, results) if fetched]
+
+    @staticmethod
+    def get_subtree_split(app, rev="HEAD"):
+        """
+        Returns the upstream commit the app's subtree was last squashed from,
+        as recorded by the 'git-subtree-split' trailer of the squash commit
+        merged in by the most recent subtree add or pull on the first-parent
+        history of the given revision.
+        :param app: The app
+        :type app: str
+        :param rev: The revision of the stack to inspect
+        :type rev: str
+        :return: The upstream commit, or None if it cannot be determined
+        :rtype: str
+        """
+        if not Stack.check_git_version():
+            return None
+
+        prefix = App.get_repo_dir(app)
+
+        # Collect the merged-in side of every mainline merge, newest first
+        exit_code, output = Stack.run_output(["git", "log", "--first-parent", "--merges", "--format=%P", rev])
+        if exit_code != 0:
+            return None
+
+        candidates = [parents.split()[1] for parents in output.splitlines() if len(parents.split()) > 1]
+        if not candidates:
+            return None
+
+        # Read the subtree trailers of each, keeping the order given
+        exit_code, output = Stack.run_output(
+            [
+                "git",
+                "log",
+                "--no-walk=unsorted",
+                "--stdin",
+                "--format=%(trailers:key=git-subtree-dir,valueonly,separator=)"
+                "%x09%(trailers:key=git-subtree-split,valueonly,separator=)",
+            ],
+            input="\n".join(candidates),
+        )
+        if exit_code != 0:
+            return None
+
+        # Return the split of the first squash commit for this prefix
+        for line in output.splitlines():
+            directory, _, split = line.partition("\t")
+            if directory.strip().rstrip("/") == prefix and split.strip():
+                return split.strip()
+
+        return None
+
+    @staticmethod
+    def get_remote_head(app, branch=None, offline=False):
+        """
+        Returns the commit at the tip of the app's branch in its repository, via
+        'git ls-remote' so that nothing needs to be fetched.
+        :param app: The app
+        :type app: str
+        :param branch: The branch, defaults to the app's configured branch
+        :type branch: str
+        :param offline: Query the app's repository mirror instead of its repository
+        :type offline: bool
+        :return: The commit, or None if it cannot be determined
+        :rtype: str
+        """
+        repo_url = (offline and App.get_mirror_dir(app)) or App.get_repo_url(app)
+        branch = branch or App.get_repo_branch(app)
+        if repo_url is None or branch is None:
+            return None
+
+        exit_code, output = Stack.run_output(["git", "ls-remote", repo_url, branch])
+        if exit_code != 0:
+            logger.error("({}) Could not list refs of repository, exit code: {}".format(app, exit_code))
+            return None
+
+        # Prefer the branch over any tags of the same name
+        refs = dict(reversed(line.split("\t", 1)) for line in output.splitlines() if "\t" in line)
+        for ref in ["refs/heads/{}".format(branch), "refs/tags/{}^{{}}".format(branch), "refs/tags/{}".format(branch)]:
+            if ref in refs:
+                return refs[ref]
+
+        return next(iter(refs.values()), None)
+
+    @staticmethod
+    def get_changed_apps(apps, jobs=None, offline=False):
+        """
+        Compares the upstream commit each app's subtree was squashed from with
+        the current head of its remote branch and returns those that differ or
+        cannot be compared. Remotes are queried concurrently.
+        :param apps: The apps to check
+        :type apps: list
+        :param jobs: The number of remotes to query at once
+        :type jobs: int
+        :param offline: Query repository mirrors instead of repositories
+        :type offline: bool
+        :return: The apps that have changed, in the order given
+        :rtype: list
+        """
+        apps = list(apps)
+        if not apps:
+            return []
+
+        jobs = max(1, int(jobs or App.FETCH_CONCURRENCY))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            heads = list(executor.map(lambda app: App.get_remote_head(app, offline=offline), apps))
+
+        changed = []
+        for app, head in zip(apps, heads):
+            split = App.get_subtree_split(app)
+            if head is None or split is None or not head.startswith(split):
+                logger.debug("({}) Subtree is at '{}', remote is at '{}'".format(app, split, head))
+                changed.append(app)
+            else:
+                logger.info("({}) Subtree is up to date at '{}'".format(app, split[:7]))
+
+        return changed
+
+    @staticmethod
+    def replace_subtree(app, branch=None):
+        """
+        Replaces the app's subtree with its previously fetched ref in a single
+        commit, or adds it if it does not exist yet. The commit merges in a
+        squash commit just like 'git subtree add --squash' does so subtree
+        commands keep working, and only files that differ between the old and
+        new trees are written to disk. This mutates the index and so must not
+        run concurrently with other subtree operations.
+        :param app: The app
+        :type app: str
+        :param branch: The branch that was fetched, for the commit message
+        :type branch: str
+        :return: Whether the subtree was replaced or not
+        :rtype: bool
+        """
+        prefix = App.get_repo_dir(app)
+        branch = branch or App.get_repo_branch(app)
+        start = time.monotonic()
+
+        # Resolve the fetched commit and the current one
+        exit_code, upstream = Stack.run_output(["git", "rev-parse", "--verify", App.get_fetch_ref(app) + "^{commit}"])
+        if exit_code != 0:
+            logger.error("({}) No fetched branch to replace subtree with".format(app))
+            return False
+
+        head = Stack.run_output(["git", "rev-parse", "--verify", "HEAD"])[1]
+        exists = Stack.run_output(["git", "cat-file", "-e", "HEAD:{}".format(prefix)])[0] == 0
+
+        # Squash the new content
+        squash_message = "\n".join(
+            [
+                "Squashed '{}/' content from commit {}".format(prefix, upstream[:7]),
+                "",
+                "git-subtree-dir: {}".format(prefix),
+                "git-subtree-split: {}".format(upstream),
+            ]
+        )
+        exit_code, squash = Stack.run_output(["git", "commit-tree", upstream + "^{tree}", "-m", squash_message])
+        if exit_code != 0:
+            logger.error("({}) Could not create squash commit".format(app))
+            return False
+
+        # Build the new tree in a scratch index, the real one is left alone until it is ready
+        scratch = tempfile.mkdtemp()
+        env = dict(os.environ, GIT_INDEX_FILE=os.path.join(scratch, "index"))
+        try:
+            for command in [
+                ["git", "read-tree", head],
+                ["git", "rm", "-r", "--cached", "--quiet", "--ignore-unmatch", "--", prefix],
+                ["git", "read-tree", "--prefix={}/".format(prefix), upstream],
+            ]:
+                if Stack.run_output(command, env=env)[0] != 0:
+                    logger.error("({}) Could not build subtree index".format(app))
+                    return False
+
+            exit_code, tree = Stack.run_output(["git", "write-tree"], env=env)
+            if exit_code != 0:
+                logger.error("({}) Could not write subtree index".format(app))
+                return False
+
+        finally:
+            shutil.rmtree(scratch)
+
+        # Commit it
+        if exists:
+            message = "Stack op: Replacing subtree {} with branch {}".format(app, branch)
+        else:
+            message = "Stack op: Adding subtree {} from branch {}".format(app, branch)
+
+        exit_code, commit = Stack.run_output(["git", "commit-tree", tree, "-p", head, "-p", squash, "-m", message])
+        if exit_code != 0:
+            logger.error("({}) Could not commit subtree".format(app))
+            return False
+
+        # Move the index and working copy over, only touching files that changed
+        if Stack.run(["git", "read-tree", "-m", "-u", head, commit]) != 0:
+            logger.error("({}) Could not update working copy, are there local changes?".format(app))
+            return False
+
+        # HEAD may have moved meanwhile, put the working copy back if so
+        if Stack.run(["git", "update-ref", "-m", message, "HEAD", commit, head]) != 0:
+            Stack.run(["git", "read-tree", "-m", "-u", commit, head])
+            logger.error("({}) Could not update HEAD, the working copy was restored".format(app))
+            return False
+
+        logger.info(
+            "({}) {} subtree in {:.2f}s".format(app, "Replaced" if exists else "Added", time.monotonic() - start)
+        )
+        return True
+
+    @staticmethod
+    def merge_subtree(app, squash=False):
+        """
+        Merges the app's previously fetched ref into its subtree. This
+        mutates the index and so must not run concurrently with other
+        subtree operations.
+        :param app: The app
+        :type app: str
+        :param squash: Whether to squash the incoming commits
+        :type squash: bool
+        :return: Whether the subtree was merged or not
+        :rtype: bool
+        """
+        command = [
+            "git",
+            "subtree",
+            "merge",
+            "--prefix={}".format(App.get_repo_dir(app)),
+            App.get_fetch_ref(app),
+        ]
+
+        # Check for a squash.
+        if squash:
+            command.append("--squash")
+
+        start = time.monotonic()
+        return_code = Stack.run(command)
+        if return_code != 0:
+            logger.error("({}) Merging subtree failed with exit code: {}".format(app, return_code))
+            return False
+
+        logger.info("({}) Merged subtree in {:.2f}s".format(app, time.monotonic() - start))
+        return True
+
+    @staticmethod
+    def init(app, post_hook=True, fetch=True, offline=False):
         """
         This method prepares a built app by checkout out its code and running
         the necessary scripts
-        :param app:
-        :type app:
-        :return:
-        :rtype:
+        :param app: The app to initialize
+        :type app: str
+        :param post_hook: Whether to run the post-clone hook, callers initializing
+         several apps may instead run those hooks concurrently afterwards
+        :type post_hook: bool
+        :param fetch: Whether to fetch the app's repository, callers may instead
+         fetch several apps concurrently beforehand with `App.fetch_all`
+        :type fetch: bool
+        :param offline: Fetch from the app's repository mirror without refreshing it
+        :type offline: bool
+        :return: Whether the app was initialized or not
+        :rtype: bool
         """
 
         # Get the repo URL
@@ -698,52 +1996,102 @@ class App:
         # Ensure valid values.
         if repo_url is None or repo_branch is None:
             logger.error("({}) Repository URL or branch is not specified," " cannot initialize...".format(app))
-            return
-
-        # Determine the path to the app directory
-        apps_dir = os.path.relpath(Stack.get_config("apps-directory"))
-        subdir = os.path.join(apps_dir, app)
-
-        # Ensure it exists.
-        if os.path.exists(subdir):
+            return False
 
-            # Remove the current subtree.
-            Stack.run(["git", "rm", "-rf", subdir])
-            Stack.run(["rm", "-rf", subdir])
-            Stack.run(
-                [
-                    "git",
-                    "commit",
-                    "-m",
-                    '"Stack op: Removing subtree {} for cloning branch {}"'.format(app, repo_branch),
-                ]
-            )
+        # Fetch before touching the working copy
+        if fetch and not App.fetch(app, offline=offline):
+            logger.critical("({}) Could not fetch repository, cannot initialize...".format(app))
+            return False
 
-        # Build the command
-        command = [
-            "git",
-            "subtree",
-            "add",
-            "--prefix={}".format(subdir),
-            repo_url,
-            repo_branch,
-            "--squash",
-        ]
+        # Determine the path to the app directory
+        subdir = App.get_repo_dir(app)
 
         # Check for pre-clone hook
         Stack.hook("pre-clone", app, [os.path.realpath(subdir)])
 
-        # Run the command.
-        return_code = Stack.run(command)
-
         # Check for post-clone hook
-        if return_code == 0:
-            Stack.hook("post-clone", app, [os.path.realpath(subdir)])
+        if App.replace_subtree(app, repo_branch):
+            if post_hook:
+                Stack.hook("post-clone", app, [os.path.realpath(subdir)])
 
             logger.debug("({}) App was initialized successfully!".format(app))
+            return True
 
         else:
             logger.critical("({}) Something happened to the init process...".format(app))
+            return False
+
+    @staticmethod
+    def split_subtree(app, rejoin=False):
+        """
+        Splits the history of the app's subtree at HEAD into a standalone
+        history that can be pushed to its repository. Results are cached so
+        later splits only process commits that are new since the last one.
+        :param app: The app
+        :type app: str
+        :param rejoin: Merge the split back into the stack so splits in other
+         clones of the stack can also start from there
+        :type rejoin: bool
+        :return: The split commit, or None if the split failed
+        :rtype: str
+        """
+        prefix = App.get_repo_dir(app)
+
+        start = time.monotonic()
+        splitter = SubtreeSplit(prefix)
+        try:
+            split = splitter.split("HEAD")
+
+        except (ValueError, subprocess.CalledProcessError) as e:
+            logger.error("({}) Splitting subtree failed: {}".format(app, e))
+            return None
+
+        logger.info(
+            "({}) Split subtree into '{}' in {:.2f}s ({} new commit(s) processed)".format(
+                app, split[:7], time.monotonic() - start, splitter.processed
+            )
+        )
+
+        # Check for a rejoin
+        if rejoin and not App.rejoin_subtree(app, split):
+            return None
+
+        return split
+
+    @staticmethod
+    def rejoin_subtree(app, split):
+        """
+        Merges a split of the app's subtree back into HEAD, so splits in other
+        clones of the stack can also start from there
+        :param app: The app
+        :type app: str
+        :param split: The split commit, see split_subtree
+        :type split: str
+        :return: Whether the split was merged or not
+        :rtype: bool
+        """
+        prefix = App.get_repo_dir(app)
+        mainline = Stack.run_output(["git", "rev-parse", "HEAD"])[1]
+        message = "\n".join(
+            [
+                "Split '{}/' into commit '{}'".format(prefix, split),
+                "",
+                "git-subtree-dir: {}".format(prefix),
+                "git-subtree-mainline: {}".format(mainline),
+                "git-subtree-split: {}".format(split),
+            ]
+        )
+
+        # The split has the same tree as the prefix, so the merge keeps HEAD's tree
+        exit_code, merge = Stack.run_output(
+            ["git", "commit-tree", "HEAD^{tree}", "-p", mainline, "-p", split, "-m", message]
+        )
+        if exit_code != 0 or Stack.run(["git", "update-ref", "-m", "subtree rejoin", "HEAD", merge, mainline]):
+            logger.error("({}) Rejoining split subtree failed".format(app))
+            return False
+
+        logger.info("({}) Rejoined split subtree in '{}'".format(app, merge[:7]))
+        return True
 
     @staticmethod
     def get_external_port(app, internal_port):
@@ -759,6 +2107,417 @@ class App:
 
         return None
 
+    @staticmethod
+    def get_databases(apps=None):
+        """
+        Returns the databases of apps that define one in stack.yml
+        :param apps: The apps to look at, all of them if None
+        :type apps: list
+        :return: A dict of app to database name, in the order of the apps
+        :rtype: dict
+        """
+        if apps is None:
+            apps = list(Stack.get_config("apps", required=False) or {})
+
+        databases = {}
+        for app in apps:
+            database = App.get_app_stack_config(app, "database")
+            if database:
+                databases[app] = database
+
+        return databases
+
+    @staticmethod
+    def purge_all_data(docker_client, apps=None):
+        """
+        Purges the databases of several apps at once: databases with snapshots
+        are restored concurrently and the rest are recreated in one batch
+        :param docker_client: The Docker client instance
+        :type docker_client: Docker.Client
+        :param apps: The apps to purge, all of them if None
+        :type apps: list
+        :return: A dict of app to 'restored', 'purged' or 'failed'
+        :rtype: dict
+        """
+        databases = App.get_databases(apps)
+        if not databases:
+            logger.warning("(stack) No apps have a 'database' defined in stack, nothing to purge")
+            return {}
+
+        # Resolve the database container once for all apps
+        database, container = Stack.get_database_container() or (None, None)
+        if not container or not database:
+            logger.error("(stack) Database purge operation failed, could not determine database container and/or type")
+            return {app: "failed" for app in databases}
+
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(databases)) as executor:
+            restored = dict(
+                zip(
+                    databases,
+                    executor.map(lambda app: App.restore_data(docker_client, app, (database, container)), databases),
+                )
+            )
+
+        results = {app: "restored" for app in databases if restored[app]}
+        remaining = [app for app in databases if not restored[app]]
+        if remaining:
+            logger.warning(
+                "(stack) Preparing to purge databases '{}' from '{}' ({})".format(
+                    "', '".join(databases[app] for app in remaining), container, database
+                )
+            )
+
+            method = getattr(Stack, "_recreate_{}_databases".format(database))
+            if method(docker_client, container, [databases[app] for app in remaining]):
+                results.update({app: "purged" for app in remaining})
+
+            # Find out which failed
+            else:
+                method = getattr(Stack, "_recreate_{}_database".format(database))
+                for app in remaining:
+                    results[app] = "purged" if method(docker_client, container, databases[app]) else "failed"
+
+        logger.info("(stack) Purged {} database(s) in {:.2f}s:".format(len(databases), time.monotonic() - start))
+        for app in databases:
+            log = logger.error if results[app] == "failed" else logger.info
+            log("    ({}) {}: {}".format(app, databases[app], results[app]))
+
+        return results
+
+    @staticmethod
+    def get_dump_path(app):
+        """
+        Returns the default path of a dump of the app's database
+        :rtype: str
+        """
+        database, _ = Stack.get_database_container() or (None, None)
+        extension = "dump" if database == "postgres" else "sql.gz"
+        return os.path.join(Stack.get_stack_root(), "{}.{}".format(App.get_app_stack_config(app, "database"), extension))
+
+    @staticmethod
+    def _get_database_target(docker_client, app):
+        """
+        Returns the app's database name, the database type and the database
+        container, or None if any could not be found
+        """
+        database_name = App.get_app_stack_config(app, "database")
+        database, container = Stack.get_database_container() or (None, None)
+        if not database_name or not container:
+            logger.error("({}) No database or database container is defined".format(app))
+            return None
+
+        db_container = App.get_container(docker_client, container)
+        if db_container is None or db_container.status != "running":
+            logger.error("({}) Database container '{}' is not running".format(app, container))
+            return None
+
+        return database_name, database, container, db_container
+
+    @staticmethod
+    def dump_database(docker_client, app, path):
+        """
+        Streams a compressed dump of the app's database from the database
+        container straight to a file
+        :param docker_client: The Docker client instance
+        :type docker_client: Docker.Client
+        :param app: The identifier of the app
+        :type app: str
+        :param path: The file to write the dump to
+        :type path: str
+        :return: Whether the dump succeeded
+        :rtype: bool
+        """
+        from dbmisvc_stack.stream import stream_exec
+
+        target = App._get_database_target(docker_client, app)
+        if target is None:
+            return False
+
+        database_name, database, container, db_container = target
+        command, environment = getattr(Stack, "_dump_{}_command".format(database))(container, database_name)
+
+        # Only replace the file once the dump is complete
+        with open(path + ".tmp", "wb") as f:
+            exit_code, errors = stream_exec(
+                docker_client,
+                db_container,
+                command,
+                environment=environment,
+                sink=f,
+                label="({}) Dump of '{}'".format(app, database_name),
+            )
+
+        if exit_code:
+            os.remove(path + ".tmp")
+            logger.error("({}) Dump failed: {} - {}".format(app, exit_code, errors))
+            return False
+
+        os.replace(path + ".tmp", path)
+        logger.info("({}) Dumped database '{}' to '{}'".format(app, database_name, path))
+        return True
+
+    @staticmethod
+    def load_database(docker_client, app, path, jobs=1):
+        """
+        Streams a dump from a file straight into the app's database in the
+        database container
+        :param docker_client: The Docker client instance
+        :type docker_client: Docker.Client
+        :param app: The identifier of the app
+        :type app: str
+        :param path: The dump to load
+        :type path: str
+        :param jobs: How many tables to load at once, where the database supports it
+        :type jobs: int
+        :return: Whether the restore succeeded
+        :rtype: bool
+        """
+        from dbmisvc_stack.stream import stream_exec
+
+        target = App._get_database_target(docker_client, app)
+        if target is None:
+            return False
+
+        database_name, database, container, db_container = target
+        command, environment = getattr(Stack, "_load_{}_command".format(database))(container, database_name, jobs)
+
+        with open(path, "rb") as f:
+            exit_code, errors = stream_exec(
+                docker_client,
+                db_container,
+                command,
+                environment=environment,
+                source=f,
+                label="({}) Restore of '{}'".format(app, database_name),
+            )
+
+        if exit_code:
+            logger.error("({}) Restore failed: {} - {}".format(app, exit_code, errors))
+            return False
+
+        logger.info("({}) Restored database '{}' from '{}'".format(app, database_name, path))
+        return True
+
+    @staticmethod
+    def get_snapshot_config(app):
+        """
+        Returns the app's 'database-snapshot' config, or None if snapshots are
+        not used for it
+        :rtype: dict
+        """
+        config = App.get_app_stack_config(app, "database-snapshot")
+        if not config:
+            return None
+
+        return config if isinstance(config, dict) else {}
+
+    @staticmethod
+    def hash_migrations(app):
+        """
+        Hashes the app's migrations, the files under the configured
+        'migrations' paths or, by default, any 'migrations' directory
+        :param app: The app
+        :type app: str
+        :return: The hex digest
+        :rtype: str
+        """
+        config = App.get_snapshot_config(app) or {}
+        repo_dir = os.path.join(Stack.get_stack_root(), App.get_repo_dir(app))
+        paths = config.get("migrations") or []
+        if isinstance(paths, str):
+            paths = [paths]
+
+        digest = hashlib.sha256()
+        for root, directories, files in os.walk(repo_dir):
+            directories[:] = sorted(directory for directory in directories if directory not in (".git", "__pycache__"))
+            relative_root = os.path.relpath(root, repo_dir)
+
+            # Only hash files within the migrations
+            if paths:
+                if not any(
+                    relative_root == path or relative_root.startswith(path + os.sep)
+                    for path in map(os.path.normpath, paths)
+                ):
+                    continue
+
+            elif "migrations" not in relative_root.split(os.sep):
+                continue
+
+            for name in sorted(files):
+                if name.endswith((".pyc", ".pyo")):
+                    continue
+
+                digest.update(os.path.join(relative_root, name).encode("utf-8") + b"\0")
+                with open(os.path.join(root, name), "rb") as f:
+                    digest.update(f.read())
+
+                digest.update(b"\0")
+
+        return digest.hexdigest()
+
+    @staticmethod
+    def get_snapshots():
+        """
+        Returns the record of database snapshots taken, by app
+        :rtype: dict
+        """
+        try:
+            with open(Stack.get_state_path("snapshots.json"), "r") as f:
+                return json.load(f)
+
+        except (IOError, ValueError):
+            return {}
+
+    @staticmethod
+    def set_snapshot(app, snapshot):
+        """
+        Records the snapshot of an app's database, or forgets it if None
+        """
+        with App._snapshots_lock:
+            snapshots = App.get_snapshots()
+            if snapshot is None:
+                snapshots.pop(app, None)
+            else:
+                snapshots[app] = snapshot
+
+            path = Stack.get_state_path("snapshots.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(snapshots, f, indent=2, sort_keys=True)
+
+            os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def snapshot_data(docker_client, app):
+        """
+        Captures the app's database so that later purges can restore it rather
+        than recreating it empty
+        :param docker_client: The Docker client instance
+        :type docker_client: Docker.Client
+        :param app: The identifier of the app
+        :type app: str
+        :return: Whether the snapshot was taken
+        :rtype: bool
+        """
+        database_name = App.get_app_stack_config(app, "database")
+        database, container = Stack.get_database_container() or (None, None)
+        if not database_name or not container:
+            logger.error("({}) Cannot snapshot database, no database or database container is defined".format(app))
+            return False
+
+        start = time.monotonic()
+        method = getattr(Stack, "_snapshot_{}_database".format(database))
+        if not method(docker_client, container, database_name):
+            logger.error("({}) Database snapshot failed".format(app))
+            App.set_snapshot(app, None)
+            return False
+
+        App.set_snapshot(
+            app,
+            {"database": database_name, "type": database, "migrations": App.hash_migrations(app), "created": time.time()},
+        )
+        logger.info("({}) Database snapshot taken in {:.2f}s".format(app, time.monotonic() - start))
+        return True
+
+    @staticmethod
+    def restore_data(docker_client, app, database_container=None):
+        """
+        Restores the app's database from its snapshot, if it has one that was
+        taken with the app's current migrations
+        :param docker_client: The Docker client instance
+        :type docker_client: Docker.Client
+        :param app: The identifier of the app
+        :type app: str
+        :param database_container: The database type and container, if already known
+        :type database_container: tuple
+        :return: Whether the database was restored
+        :rtype: bool
+        """
+        if App.get_snapshot_config(app) is None:
+            return False
+
+        database_name = App.get_app_stack_config(app, "database")
+        database, container = database_container or Stack.get_database_container() or (None, None)
+        snapshot = App.get_snapshots().get(app)
+        if not snapshot or snapshot.get("database") != database_name or snapshot.get("type") != database:
+            logger.info("({}) No database snapshot has been taken yet".format(app))
+            return False
+
+        if snapshot.get("migrations") != App.hash_migrations(app):
+            logger.info("({}) Migrations have changed since the database snapshot was taken".format(app))
+            return False
+
+        start = time.monotonic()
+        method = getattr(Stack, "_restore_{}_database".format(database))
+        if not method(docker_client, container, database_name):
+            logger.warning("({}) Database snapshot could not be restored".format(app))
+            App.set_snapshot(app, None)
+            return False
+
+        logger.info("({}) Database restored from snapshot in {:.2f}s".format(app, time.monotonic() - start))
+        return True
+
+    @staticmethod
+    def wait_healthy(docker_client, app, timeout=60, interval=0.5):
+        """
+        Waits for the app's container to be running and, if it has a health
+        check, healthy
+        :param docker_client: The Docker client instance
+        :type docker_client: docker.client
+        :param app: The app
+        :type app: str
+        :param timeout: The seconds to wait for at most
+        :type timeout: float
+        :return: The container, or None if it did not become healthy in time
+        :rtype: docker.models.containers.Container
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            container = App.get_container(docker_client, app)
+            state = (container.attrs.get("State") or {}) if container is not None else {}
+            health = (state.get("Health") or {}).get("Status")
+            if state.get("Running") and health in (None, "healthy"):
+                return container
+
+            if time.monotonic() >= deadline:
+                return None
+
+            time.sleep(interval)
+
+    @staticmethod
+    def migrate_and_snapshot(docker_client, app):
+        """
+        Waits for the app's container to be ready, runs the app's configured
+        migrate command in it and then snapshots its database. Without a
+        migrate command, the snapshot has to be taken with the snapshot command
+        once the app has migrated. Taking a Postgres snapshot disconnects
+        everything connected to the app's database, the app included.
+        :return: Whether the snapshot was taken
+        :rtype: bool
+        """
+        config = App.get_snapshot_config(app)
+        if config is None:
+            return False
+
+        if not config.get("migrate"):
+            logger.info(
+                "({}) Run 'dbmisvc-stack snapshot {}' once migrations have run to speed up later purges".format(app, app)
+            )
+            return False
+
+        container = App.wait_healthy(docker_client, app, timeout=config.get("timeout", 60))
+        if container is None:
+            logger.error("({}) Container is not running or healthy, could not run migrations".format(app))
+            return False
+
+        logger.info("({}) Running migrations before taking a database snapshot...".format(app))
+        exit_code, output = container.exec_run(config["migrate"])
+        if exit_code:
+            logger.error("({}) Migrations failed: {} - {}".format(app, exit_code, output.decode("utf-8", "replace")))
+            return False
+
+        return App.snapshot_data(docker_client, app)
+
     @staticmethod
     def purge_data(docker_client, app):
         """
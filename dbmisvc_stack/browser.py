@@ -1,36 +1,322 @@
+import atexit
 import os
+import shutil
+import sys
+import threading
 import time
+from urllib.parse import urlsplit
 
 from splinter.driver.webdriver import BaseWebDriver
 from splinter.driver.webdriver.firefox import WebDriver as FirefoxDriver
 from splinter.driver.webdriver.chrome import WebDriver as ChromeDriver
 from selenium.webdriver.chrome.options import Options as ChromeOptions
+from selenium.common.exceptions import TimeoutException
 
 from selenium.webdriver.safari.webdriver import WebDriver as SafariDriver
 from splinter.driver.webdriver import WebDriverElement
 from splinter.driver.webdriver.cookie_manager import CookieManager
 
+from dbmisvc_stack.pool import SessionPool
+
+import logging
+
+logger = logging.getLogger("stack")
+
+# 'default' browses as a user would, 'lean' runs headless without the
+# images, fonts, background work and animations most tests do not need
+PROFILES = ("default", "lean")
+
+# The window size of headless browsers, so layouts do not vary between machines
+WINDOW_SIZE = (1280, 1024)
+
+FIREFOX_LEAN_PREFERENCES = {
+    "permissions.default.image": 2,
+    "browser.display.use_document_fonts": 0,
+    "gfx.downloadable_fonts.enabled": False,
+    "toolkit.cosmeticAnimations.enabled": False,
+    "ui.prefersReducedMotion": 1,
+    "network.prefetch-next": False,
+    "network.dns.disablePrefetch": True,
+    "network.http.speculative-parallel-limit": 0,
+    "browser.safebrowsing.malware.enabled": False,
+    "browser.safebrowsing.phishing.enabled": False,
+    "app.update.auto": False,
+    "extensions.update.enabled": False,
+    "datareporting.healthreport.uploadEnabled": False,
+    "datareporting.policy.dataSubmissionEnabled": False,
+    "toolkit.telemetry.enabled": False,
+    "browser.newtabpage.enabled": False,
+    "browser.startup.page": 0,
+}
+
+CHROME_LEAN_ARGUMENTS = [
+    "--headless=new",
+    "--window-size={},{}".format(*WINDOW_SIZE),
+    "--blink-settings=imagesEnabled=false",
+    "--disable-remote-fonts",
+    "--disable-background-networking",
+    "--disable-background-timer-throttling",
+    "--disable-component-update",
+    "--disable-extensions",
+    "--disable-component-extensions-with-background-pages",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--disable-dev-shm-usage",
+    "--disable-gpu",
+    "--force-prefers-reduced-motion",
+    "--wm-window-animations-disabled",
+    "--no-first-run",
+    "--mute-audio",
+]
+
+# Seconds each page took to load, by profile
+page_loads = {}
+_page_loads_lock = threading.Lock()
+
+
+def get_profile(profile=None):
+    """
+    Returns the profile to launch browsers with, STACK_BROWSER_PROFILE or
+    'default' if none is given.
+    """
+    profile = profile or os.environ.get("STACK_BROWSER_PROFILE") or "default"
+    if profile not in PROFILES:
+        raise ValueError("Unknown browser profile '{}', use one of: {}".format(profile, ", ".join(PROFILES)))
+
+    return profile
+
+
+def get_driver_path(name):
+    """
+    Returns the path of a WebDriver binary, e.g. 'chromedriver': from an
+    environment variable of the same name in capitals, the drivers directory
+    (as 'chromedriver_linux', 'chromedriver_osx' or 'chromedriver_win.exe'
+    for this platform, or just 'chromedriver'), or the PATH.
+    :return: The path, or None to leave finding it to Selenium
+    """
+    if os.environ.get(name.upper()):
+        return os.environ[name.upper()]
+
+    platform = {"darwin": "osx", "win32": "win"}.get(sys.platform, "linux")
+    extension = ".exe" if platform == "win" else ""
+    driver_root = os.path.realpath(os.path.join(os.path.dirname(__file__), "drivers"))
+    for filename in ("{}_{}{}".format(name, platform, extension), name + extension):
+        path = os.path.join(driver_root, filename)
+        if os.access(path, os.X_OK):
+            return path
+
+    return shutil.which(name)
 
-def Browser(browser_name="firefox"):
+
+def report_page_loads():
+    """Logs how long pages took to load with each profile."""
+    with _page_loads_lock:
+        for profile, durations in page_loads.items():
+            durations = sorted(durations)
+            logger.info(
+                "(browser) {} page load(s) with the '{}' profile: {:.3f}s on average, {:.3f}s at the 95th percentile".format(
+                    len(durations),
+                    profile,
+                    sum(durations) / len(durations),
+                    durations[min(len(durations) - 1, int(len(durations) * 0.95))],
+                )
+            )
+
+
+atexit.register(report_page_loads)
+
+
+def Browser(browser_name="firefox", profile=None):
 
     if browser_name.lower() == "firefox":
-        return Firefox()
+        return Firefox(profile)
 
     elif browser_name.lower() == "chrome":
-        return Chrome()
+        return Chrome(profile)
 
     elif browser_name.lower() == "safari":
         return Safari()
 
 
+def get_origin(url):
+    """
+    Returns the origin of a URL, e.g. 'https://example.com:8443', or None if
+    it has none, as for 'about:blank'.
+    """
+    parts = urlsplit(url or "")
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return None
+
+    return "{}://{}".format(parts.scheme, parts.netloc.rpartition("@")[2].lower())
+
+
+def reset_browser(browser):
+    """
+    Clears a browser's cookies and storage for every origin it visited and
+    leaves it on a blank page, so the next test starts as if in a new browser.
+    """
+    driver = browser.driver
+
+    # The current page may have been reached by a redirect or a link rather than a visit
+    origins = [get_origin(driver.current_url)]
+    origins.extend(sorted(getattr(browser, "visited_origins", None) or ()))
+    origins = [origin for origin in dict.fromkeys(origins) if origin]
+
+    # Chrome can clear every site's cookies and any origin's storage from anywhere
+    if hasattr(driver, "execute_cdp_cmd"):
+        driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+        for origin in origins:
+            driver.execute_cdp_cmd("Storage.clearDataForOrigin", {"origin": origin, "storageTypes": "all"})
+
+    # Others can only clear them from a page of each origin
+    else:
+        for origin in origins:
+            if get_origin(driver.current_url) != origin:
+                driver.get(origin + "/favicon.ico")
+
+            driver.execute_script("try { window.localStorage.clear(); window.sessionStorage.clear(); } catch (e) {}")
+            driver.delete_all_cookies()
+
+    browser.visited_origins = set()
+    driver.get("about:blank")
+
+
+def browser_alive(browser):
+    """Returns whether a browser's WebDriver session still responds."""
+    try:
+        browser.driver.current_url
+        return True
+
+    except Exception:
+        return False
+
+
+class BrowserPool(SessionPool):
+    """
+    Keeps warm browsers to lease to tests rather than starting a new one for
+    each, e.g.:
+
+        with pool.lease() as browser:
+            browser.visit(url)
+    """
+
+    def __init__(self, browser_name="firefox", size=2, max_uses=50, profile=None):
+        """
+        :param browser_name: firefox, chrome or safari
+        :param size: How many browsers may be open at once
+        :param max_uses: How many tests a browser serves before it is restarted
+        :param profile: The profile to launch browsers with, see get_profile
+        """
+        super(BrowserPool, self).__init__(
+            lambda: Browser(browser_name, profile),
+            size=size,
+            max_uses=max_uses,
+            reset=reset_browser,
+            alive=browser_alive,
+            close=lambda browser: browser.quit(),
+        )
+
+
+# Pools shared by the tests in this process, by browser name
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(browser_name="firefox", size=None, max_uses=None, profile=None):
+    """
+    Returns the process' pool for a browser and profile, creating it on
+    first use. The size and number of uses default to
+    STACK_BROWSER_POOL_SIZE and STACK_BROWSER_MAX_USES, or 2 and 50. The pool
+    is closed, and its lease times reported, when the process exits.
+    :rtype: BrowserPool
+    """
+    key = (browser_name.lower(), get_profile(profile))
+    with _pools_lock:
+        pool = _pools.get(key)
+        if pool is None:
+            pool = BrowserPool(
+                browser_name,
+                size=size or int(os.environ.get("STACK_BROWSER_POOL_SIZE", 2)),
+                max_uses=max_uses or int(os.environ.get("STACK_BROWSER_MAX_USES", 50)),
+                profile=key[1],
+            )
+            _pools[key] = pool
+            atexit.register(pool.report)
+            atexit.register(pool.close)
+
+        return pool
+
+
 class BrowserExtensions(BaseWebDriver):
 
-    SCROLL_SCRIPT = """
-        const element = arguments[0];
-        const elementRect = element.getBoundingClientRect();
-        const absoluteElementTop = elementRect.top + window.pageYOffset;
-        const middle = absoluteElementTop - (window.innerHeight / 2);
-        window.scrollTo(0, middle);
+    # Set by the browsers that record page loads
+    browser_profile = None
+
+    # The origins visited since the browser was last reset, see reset_browser
+    visited_origins = None
+
+    # Seconds scripts may run for, as last read from or set on the driver
+    script_timeout = None
+
+    # The WebDriver default, for drivers that cannot report their timeouts
+    DEFAULT_SCRIPT_TIMEOUT = 30
+
+    def visit(self, url):
+        start = time.monotonic()
+        super(BrowserExtensions, self).visit(url)
+
+        if self.browser_profile is not None:
+            with _page_loads_lock:
+                page_loads.setdefault(self.browser_profile, []).append(time.monotonic() - start)
+
+        # Remember where the visit started and, if it was redirected, where it ended
+        if self.visited_origins is None:
+            self.visited_origins = set()
+
+        self.visited_origins.update(
+            origin for origin in (get_origin(url), get_origin(self.driver.current_url)) if origin
+        )
+
+    # Finds the element, scrolls it to the middle of the window and checks it
+    # every frame until it is visible or the wait is over, in one round trip
+    VISIBLE_SCRIPT = """
+        const [xpath, index, timeout] = arguments;
+        const done = arguments[arguments.length - 1];
+        const deadline = Date.now() + timeout * 1000;
+        let scrolled = null;
+
+        const check = () => {
+            const element = document.evaluate(
+                xpath, document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+            ).snapshotItem(index);
+
+            if (element) {
+                if (element !== scrolled) {
+                    const top = element.getBoundingClientRect().top + window.pageYOffset;
+                    window.scrollTo(0, top - (window.innerHeight / 2));
+                    scrolled = element;
+                }
+
+                const rect = element.getBoundingClientRect();
+                const style = window.getComputedStyle(element);
+                if (rect.width > 0 && rect.height > 0 && rect.bottom > 0 && rect.top < window.innerHeight
+                        && style.visibility !== "hidden" && parseFloat(style.opacity) > 0) {
+                    return done(true);
+                }
+            }
+
+            if (Date.now() >= deadline) {
+                return done(false);
+            }
+
+            // Frames are not drawn for hidden pages
+            if (document.hidden) {
+                setTimeout(check, 50);
+            } else {
+                window.requestAnimationFrame(check);
+            }
+        };
+        check();
     """
 
     def find_by_partial_text(self, text):
@@ -83,24 +369,35 @@ class BrowserExtensions(BaseWebDriver):
             wait_time=wait_time,
         )
 
+    def raise_script_timeout(self, seconds):
+        """
+        Lets scripts run for at least the given seconds, never lowering the
+        timeout the driver was given elsewhere.
+        """
+        if self.script_timeout is None:
+            try:
+                self.script_timeout = self.driver.timeouts.script
+
+            # Selenium 3 cannot read timeouts, and no timeout is reported as null
+            except AttributeError:
+                self.script_timeout = self.DEFAULT_SCRIPT_TIMEOUT
+            except TypeError:
+                self.script_timeout = float("inf")
+
+        if self.script_timeout < seconds:
+            self.driver.set_script_timeout(seconds)
+            self.script_timeout = seconds
+
     def make_element_visible_by_xpath(self, xpath, index=0, wait_time=None):
+        wait_time = self.wait_time if wait_time is None else wait_time
 
-        # Check it.
-        if self.is_element_present_by_xpath(xpath=xpath, wait_time=wait_time):
+        # The script must be allowed to run for the whole wait
+        self.raise_script_timeout(wait_time + 1)
 
-            try:
-                # Get it.
-                element = self.find_by_xpath(xpath)[index]
-                if element:
-                    self.driver.execute_script(self.SCROLL_SCRIPT, element._element)
-
-                # Pause for a split second.
-                time.sleep(0.25)
-
-                return self.is_element_visible_by_xpath(xpath, wait_time)
-            except IndexError:
-                return False
-        else:
+        try:
+            return bool(self.driver.execute_async_script(self.VISIBLE_SCRIPT, xpath, index, wait_time))
+
+        except TimeoutException:
             return False
 
     def make_element_visible_by_id(self, identifier, wait_time=None):
@@ -141,7 +438,8 @@ class BrowserExtensions(BaseWebDriver):
 
 
 class Firefox(FirefoxDriver, BrowserExtensions):
-    def __init__(self):
+    def __init__(self, profile=None):
+        self.browser_profile = get_profile(profile)
 
         # Setup the preferences.
         preferences = dict()
@@ -155,21 +453,25 @@ class Firefox(FirefoxDriver, BrowserExtensions):
         # Disable browser notifications.
         preferences["dom.webnotifications.enabled"] = False
 
-        # Get the path to the project root.
-        driver_root = os.path.realpath(
-            os.path.join(os.path.dirname(__file__), "drivers")
-        )
-        driver_path = os.path.join(driver_root, "geckodriver")
-        kwargs = {
-            "executable_path": driver_path,
-            "profile_preferences": preferences,
-        }
+        kwargs = {"profile_preferences": preferences}
+        if self.browser_profile == "lean":
+            preferences.update(FIREFOX_LEAN_PREFERENCES)
+            kwargs["headless"] = True
+
+        # Find the driver for this platform.
+        driver_path = get_driver_path("geckodriver")
+        if driver_path:
+            kwargs["executable_path"] = driver_path
 
         super(Firefox, self).__init__(wait_time=5, **kwargs)
 
+        if self.browser_profile == "lean":
+            self.driver.set_window_size(*WINDOW_SIZE)
+
 
 class Chrome(ChromeDriver, BrowserExtensions):
-    def __init__(self):
+    def __init__(self, profile=None):
+        self.browser_profile = get_profile(profile)
 
         # Setup the options.
         options = ChromeOptions()
@@ -179,12 +481,17 @@ class Chrome(ChromeDriver, BrowserExtensions):
         options.add_argument("--disable-web-security")
         options.add_argument("--allow-running-insecure-content")
 
-        # Get the path to the project root.
-        driver_root = os.path.realpath(
-            os.path.join(os.path.dirname(__file__), "drivers")
-        )
-        driver_path = os.path.join(driver_root, "chromedriver_osx")
-        kwargs = {"executable_path": driver_path, "options": options}
+        if self.browser_profile == "lean":
+            for argument in CHROME_LEAN_ARGUMENTS:
+                options.add_argument(argument)
+
+            options.add_experimental_option("prefs", {"profile.managed_default_content_settings.images": 2})
+
+        # Find the driver for this platform.
+        kwargs = {"options": options}
+        driver_path = get_driver_path("chromedriver")
+        if driver_path:
+            kwargs["executable_path"] = driver_path
 
         super(Chrome, self).__init__(wait_time=5, **kwargs)
 
@@ -2,24 +2,30 @@
 dbmisvc-stack
 
 Usage:
-  dbmisvc-stack init [<app>] [-v | --verbose]
+  dbmisvc-stack init [<app>] [--jobs=<jobs>] [--offline] [-v | --verbose]
   dbmisvc-stack check [<app>] [-v | --verbose]
   dbmisvc-stack build [<app>] [--clean] [-v | --verbose]
-  dbmisvc-stack test [-v | --verbose]
+  dbmisvc-stack test [--apps] [--fail-fast] [--jobs=<jobs>] [--report=<file>] [-v | --verbose]
   dbmisvc-stack up [-d] [--clean] [--flags=<flags>] [-v | --verbose]
   dbmisvc-stack down [--clean] [--flags=<flags>] [-v | --verbose]
   dbmisvc-stack reup [-c|--clean] [-p|--purge] [-r|--recreate] [<app>] [-d] [--flags=<flags>] [-v | --verbose]
   dbmisvc-stack shell [--sh] <app> [-v | --verbose]
-  dbmisvc-stack clean <app> [-v | --verbose]
-  dbmisvc-stack logs <app> [--minutes=<minutes>] [--lines=<lines>] [-F|--follow]
-  dbmisvc-stack clone <app> <branch> [-v | --verbose]
+  dbmisvc-stack clean (<app> | --all) [-v | --verbose]
+  dbmisvc-stack snapshot <app> [-v | --verbose]
+  dbmisvc-stack db dump <app> [<file>] [-v | --verbose]
+  dbmisvc-stack db restore <app> <file> [--jobs=<jobs>] [-v | --verbose]
+  dbmisvc-stack logs (<app> | --all) [--minutes=<minutes>] [--lines=<lines>] [-F|--follow]
+  dbmisvc-stack clone <app> <branch> [--offline] [-v | --verbose]
   dbmisvc-stack status [<app>] [-v | --verbose]
-  dbmisvc-stack checkout <app> [-b] <branch> [-v | --verbose]
-  dbmisvc-stack update [<app>] [-v | --verbose]
-  dbmisvc-stack push <app> <branch> [--squash] [-v | --verbose]
-  dbmisvc-stack pull <app> <branch> [--squash] [-v | --verbose]
-  dbmisvc-stack packages [<package>] [-v | --verbose]
-  dbmisvc-stack secrets [-f | --force] [-v | --verbose]
+  dbmisvc-stack checkout <app> [-b] <branch> [--rejoin] [--offline] [-v | --verbose]
+  dbmisvc-stack update [<app>] [--jobs=<jobs>] [--dry-run] [-f | --force] [--offline] [-v | --verbose]
+  dbmisvc-stack push <app> <branch> [--rejoin] [-v | --verbose]
+  dbmisvc-stack pull <app> <branch> [--squash] [--offline] [-v | --verbose]
+  dbmisvc-stack mirror [<app>] [--jobs=<jobs>] [--background] [-v | --verbose]
+  dbmisvc-stack packages [<package>] [--jobs=<jobs>] [-f | --force] [--watch] [-v | --verbose]
+  dbmisvc-stack index [--port=<port>] [-v | --verbose]
+  dbmisvc-stack secrets [-f | --force] [--refresh] [-v | --verbose]
+  dbmisvc-stack completion [<shell>] [--refresh] [-v | --verbose]
   dbmisvc-stack -h | --help
   dbmisvc-stack --version
   dbmisvc-stack -v | --verbose
@@ -37,6 +43,18 @@ Options:
   -F,--follow                       Follow the logs in the current terminal
   -f,--force                        Force the command to run, possibly overwriting existing resources
   -r,--recreate                     Docker will recreate dependent services
+  --jobs=<jobs>                     How many repositories, hooks, packages, tables or test shards to process at once
+  --dry-run                         List what would change without changing anything
+  --offline                         Use repository mirrors as they are, without refreshing them
+  --background                      Run detached from the terminal
+  --rejoin                          Merge the split subtree history back into the stack
+  --port=<port>                     The port to serve on
+  --watch                           Keep rebuilding packages as they change
+  --all                             Apply to every app
+  --report=<file>                   Where to write the JUnit report of the tests
+  --apps                            Run each app's own tests in its container
+  --fail-fast                       Stop the other apps' tests after the first failure
+  --refresh                         Fetch secrets, or gather completions, again even if they were cached
 
 
 Examples:
@@ -48,14 +66,11 @@ Help:
 """  # noqa: E501
 
 
-from inspect import getmembers, isclass
-
 from docopt import docopt
 import logging
 from colorlog import ColoredFormatter
 
 from dbmisvc_stack import VERSION
-from dbmisvc_stack.app import Stack
 
 
 def setup_logger(options):
@@ -90,27 +105,36 @@ def setup_logger(options):
 def main():
     """Main CLI entrypoint."""
     import os
-    from dbmisvc_stack import commands
-    from dbmisvc_stack.commands.base import Base
 
+    # Parse options first so --help and --version return without loading the stack
     options = docopt(__doc__, version=VERSION)
 
+    from dbmisvc_stack.app import Stack, HookError
+    from dbmisvc_stack.commands import get_command
+
     # Setup logging.
     logger = setup_logger(options)
 
+    # Only the module of the command being run is imported
+    command = get_command(options)
+
     # Make sure we are in a valid location
-    if not Stack.check_stack(os.getcwd()):
+    if (command is None or command.requires_stack) and not Stack.check_stack(os.getcwd()):
         logger.critical("The Stack is invalid, cannot run...")
         return
 
-    # Here we'll try to dynamically match the command the user is trying to run
-    # with a pre-defined command class we've already created.
-    for (k, v) in options.items():
-        if hasattr(commands, k) and v:
-            module = getattr(commands, k)
-            _commands = getmembers(
-                module, lambda cmd: isclass(cmd) and issubclass(cmd, Base)
-            )
-            command = [command[1] for command in _commands if command[0] != "Base"][0]
-            command = command(options)
-            command.run()
+    if command is None:
+        return
+
+    command = command(options)
+    try:
+        command.run()
+
+    except HookError as e:
+        logger.critical("(stack) {}, aborting...".format(e))
+        exit(1)
+
+    finally:
+        # Summarize any hooks that were run and requests made to Docker
+        Stack.report_hooks()
+        Stack.report_docker()
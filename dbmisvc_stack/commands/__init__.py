@@ -1,19 +1,72 @@
-from dbmisvc_stack.commands.base import Base
-from dbmisvc_stack.commands.test import Test
-from dbmisvc_stack.commands.check import Check
-from dbmisvc_stack.commands.up import Up
-from dbmisvc_stack.commands.shell import Shell
-from dbmisvc_stack.commands.reup import Reup
-from dbmisvc_stack.commands.down import Down
-from dbmisvc_stack.commands.logs import Logs
-from dbmisvc_stack.commands.clone import Clone
-from dbmisvc_stack.commands.checkout import Checkout
-from dbmisvc_stack.commands.pull import Pull
-from dbmisvc_stack.commands.push import Push
-from dbmisvc_stack.commands.status import Status
-from dbmisvc_stack.commands.init import Init
-from dbmisvc_stack.commands.build import Build
-from dbmisvc_stack.commands.update import Update
-from dbmisvc_stack.commands.packages import Packages
-from dbmisvc_stack.commands.secrets import Secrets
-from dbmisvc_stack.commands.clean import Clean
+"""
+The stack's commands. Each docopt command maps to the class that runs it,
+which is only imported when it is needed so that starting the CLI does not
+load every command's dependencies.
+"""
+
+import sys
+from importlib import import_module
+from types import ModuleType
+
+# Docopt command -> module and class
+COMMANDS = {
+    "init": ("dbmisvc_stack.commands.init", "Init"),
+    "check": ("dbmisvc_stack.commands.check", "Check"),
+    "build": ("dbmisvc_stack.commands.build", "Build"),
+    "test": ("dbmisvc_stack.commands.test", "Test"),
+    "up": ("dbmisvc_stack.commands.up", "Up"),
+    "down": ("dbmisvc_stack.commands.down", "Down"),
+    "reup": ("dbmisvc_stack.commands.reup", "Reup"),
+    "shell": ("dbmisvc_stack.commands.shell", "Shell"),
+    "clean": ("dbmisvc_stack.commands.clean", "Clean"),
+    "snapshot": ("dbmisvc_stack.commands.snapshot", "Snapshot"),
+    "db": ("dbmisvc_stack.commands.db", "Db"),
+    "logs": ("dbmisvc_stack.commands.logs", "Logs"),
+    "clone": ("dbmisvc_stack.commands.clone", "Clone"),
+    "status": ("dbmisvc_stack.commands.status", "Status"),
+    "checkout": ("dbmisvc_stack.commands.checkout", "Checkout"),
+    "update": ("dbmisvc_stack.commands.update", "Update"),
+    "push": ("dbmisvc_stack.commands.push", "Push"),
+    "pull": ("dbmisvc_stack.commands.pull", "Pull"),
+    "mirror": ("dbmisvc_stack.commands.mirror", "Mirror"),
+    "packages": ("dbmisvc_stack.commands.packages", "Packages"),
+    "index": ("dbmisvc_stack.commands.index", "Index"),
+    "secrets": ("dbmisvc_stack.commands.secrets", "Secrets"),
+    "completion": ("dbmisvc_stack.commands.completion", "Completion"),
+}
+
+
+def get_command(options):
+    """
+    Returns the class of the command docopt parsed, importing only its module
+    :param options: The options parsed by docopt
+    :type options: dict
+    :return: The command class, or None if no command was given
+    """
+    for name, value in options.items():
+        if name in COMMANDS and value:
+            module, command = COMMANDS[name]
+            return getattr(import_module(module), command)
+
+    return None
+
+
+class _CommandsModule(ModuleType):
+    """
+    Imports command classes on first access, e.g. `from dbmisvc_stack.commands import Status`.
+    This replaces the module's class rather than defining a module level
+    __getattr__, which Python 3.6 does not support.
+    """
+
+    def __getattr__(self, name):
+        for module, command in COMMANDS.values():
+            if command == name:
+                return getattr(import_module(module), command)
+
+        if name == "Base":
+            return import_module("dbmisvc_stack.commands.base").Base
+
+        raise AttributeError("module '{}' has no attribute '{}'".format(self.__name__, name))
+
+
+sys.modules[__name__].__class__ = _CommandsModule
@@ -4,6 +4,9 @@
 class Base(object):
     """A base command."""
 
+    # Whether the command must be run from the root of a stack
+    requires_stack = True
+
     def __init__(self, options, *args, **kwargs):
         self.options = options
         self.args = args
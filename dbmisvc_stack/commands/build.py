@@ -1,9 +1,8 @@
 """The build command."""
 
-import docker
-
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App
+from dbmisvc_stack.app import Stack
 
 import logging
 
@@ -14,7 +13,7 @@ class Build(Base):
     def run(self):
 
         # Get the docker client.
-        docker_client = docker.from_env()
+        docker_client = Stack.get_docker_client()
 
         # Determine the app.
         app = self.options["<app>"]
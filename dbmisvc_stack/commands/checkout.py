@@ -42,57 +42,48 @@ class Checkout(Base):
             if not os.path.exists(subdir):
                 logger.error(
                     "({}) This repository does not exist yet, run"
-                    " 'stack clone' command first".format(app, subdir)
+                    " 'stack clone' command first".format(app)
                 )
                 return
 
             # Check for pre-checkout hook
             Stack.hook("pre-checkout", app, [os.path.realpath(subdir)])
 
-            # Do a split.
-            command = [
-                "git",
-                "subtree",
-                "split",
-                "--prefix={}".format(subdir),
-                "--branch",
-                branch,
-            ]
+            # Do a split, only rejoining it once the branch is known to accept it
+            split = App.split_subtree(app)
+            if split is None:
+                return
+
+            # The branch may only move forward
+            ref = "refs/heads/{}".format(branch)
+            if Stack.run_output(["git", "rev-parse", "--verify", "--quiet", ref])[0] == 0:
+                if Stack.run(["git", "merge-base", "--is-ancestor", ref, split]):
+                    logger.error(
+                        "({}) Branch '{}' is not an ancestor of commit '{}'".format(
+                            app, branch, split
+                        )
+                    )
+                    return
+
+            if self.options.get("--rejoin") and not App.rejoin_subtree(app, split):
+                return
 
-            Stack.run(command)
+            Stack.run(["git", "update-ref", "-m", "subtree split", ref, split])
+            logger.info("({}) Split subtree into branch '{}'".format(app, branch))
 
         else:
 
             # Check for pre-checkout hook
             Stack.hook("pre-checkout", app, [os.path.realpath(subdir)])
 
-            # Build the command
-            command = [
-                "git",
-                "subtree",
-                "add",
-                "--prefix={}".format(subdir),
-                repo_url,
-                branch,
-                "--squash",
-            ]
-
-            # Remove the current subtree.
-            Stack.run(["git", "rm", "-rf", subdir])
-            Stack.run(["rm", "-rf", subdir])
-            Stack.run(
-                [
-                    "git",
-                    "commit",
-                    "-m",
-                    '"Stack op: Removing subtree {} for cloning branch {}"'.format(
-                        app, branch
-                    ),
-                ]
-            )
+            # Fetch the branch before touching the working copy
+            if not App.fetch(app, branch, offline=self.options.get("--offline")):
+                return
 
-            # Run the command.
-            Stack.run(command)
+            # Replace the current subtree in a single commit.
+            if not App.replace_subtree(app, branch):
+                logger.error("({}) Could not check out branch '{}'".format(app, branch))
+                return
 
         # Check for post-checkout hook
         Stack.hook("post-checkout", app, [os.path.realpath(subdir)])
@@ -1,9 +1,8 @@
 """The clean command."""
 
-import docker
-
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App
+from dbmisvc_stack.app import Stack
 
 import logging
 
@@ -14,10 +13,18 @@ class Clean(Base):
     def run(self):
 
         # Get the docker client.
-        docker_client = docker.from_env()
+        docker_client = Stack.get_docker_client()
+
+        # Purge every app's database at once
+        if self.options.get("--all"):
+            results = App.purge_all_data(docker_client)
+            if "failed" in results.values():
+                exit(1)
+            return
 
         # Determine the app.
         app = self.options["<app>"]
 
-        # Purge database
-        App.purge_data(docker_client, app)
+        # Restore the database's snapshot, or purge it
+        if not App.restore_data(docker_client, app):
+            App.purge_data(docker_client, app)
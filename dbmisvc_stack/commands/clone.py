@@ -36,23 +36,13 @@ class Clone(Base):
             )
             return
 
-        # Build the command
-        command = [
-            "git",
-            "subtree",
-            "add",
-            "--prefix={}".format(subdir),
-            repo_url,
-            branch,
-            "--squash",
-        ]
-
         # Check for pre-clone hook
         Stack.hook("pre-clone", app, [os.path.realpath(subdir)])
 
-        # Run the command.
-        return_code = Stack.run(command)
+        # Fetch the branch and add it.
+        if not App.fetch(app, branch, offline=self.options.get("--offline")):
+            return
 
         # Check for post-clone hook
-        if return_code == 0:
+        if App.replace_subtree(app, branch):
             Stack.hook("post-clone", app, [os.path.realpath(subdir)])
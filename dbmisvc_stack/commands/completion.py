@@ -0,0 +1,229 @@
+"""The completion command."""
+
+import os
+import re
+import subprocess
+
+from dbmisvc_stack.commands.base import Base
+from dbmisvc_stack.app import App
+from dbmisvc_stack.app import Stack
+
+import logging
+
+logger = logging.getLogger("stack")
+
+bash_script = r"""# dbmisvc-stack completion for bash, load it with:
+#   eval "$(dbmisvc-stack completion bash)"
+
+_dbmisvc_stack_words() {
+    # Prints the candidates stored under a key in the stack's completion cache
+    local key value
+    while read -r key value; do
+        if [ "$key" = "$1" ]; then
+            printf '%s\n' "$value"
+            return
+        fi
+    done < .stack/completion
+}
+
+_dbmisvc_stack() {
+    local cur="${COMP_WORDS[COMP_CWORD]}" command="${COMP_WORDS[1]}" words="" word file skip=0
+    local -a args=()
+    COMPREPLY=()
+
+    # Only complete within a stack, and not the values of options
+    [ -f stack.yml ] || [ -f stack.yaml ] || return 0
+    [ "$cur" = "=" ] || [ "${COMP_WORDS[COMP_CWORD-1]}" = "=" ] && return 0
+
+    # Refresh the cache once the stack's configuration or hooks are newer than it
+    for file in stack.yml stack.yaml docker-compose.yml docker-compose.yaml hooks; do
+        if [ ! -f .stack/completion ] || [ "$file" -nt .stack/completion ]; then
+            dbmisvc-stack completion --refresh >/dev/null 2>&1 || return 0
+            break
+        fi
+    done
+
+    if [ "$COMP_CWORD" -eq 1 ]; then
+        words=$(_dbmisvc_stack_words commands)
+    elif [[ "$cur" == -* ]]; then
+        words=$(_dbmisvc_stack_words "options:$command")
+    else
+        # The arguments given so far, without options or their values
+        for word in "${COMP_WORDS[@]:2:COMP_CWORD-2}"; do
+            if [ "$word" = "=" ]; then
+                skip=1
+            elif [ "$skip" -eq 1 ]; then
+                skip=0
+            elif [[ "$word" != -* ]]; then
+                args+=("$word")
+            fi
+        done
+
+        case "$command" in
+            packages)
+                [ ${#args[@]} -eq 0 ] && words=$(_dbmisvc_stack_words packages) ;;
+            clone|checkout|push|pull)
+                if [ ${#args[@]} -eq 0 ]; then
+                    words=$(_dbmisvc_stack_words apps)
+                elif [ ${#args[@]} -eq 1 ]; then
+                    words=$(_dbmisvc_stack_words "branches:${args[0]}")
+                fi ;;
+            db)
+                if [ ${#args[@]} -eq 0 ]; then
+                    words="dump restore"
+                elif [ ${#args[@]} -eq 1 ]; then
+                    words=$(_dbmisvc_stack_words apps)
+                fi ;;
+            completion)
+                [ ${#args[@]} -eq 0 ] && words="bash zsh" ;;
+            test|up|down|index|secrets)
+                ;;
+            *)
+                [ ${#args[@]} -eq 0 ] && words=$(_dbmisvc_stack_words apps) ;;
+        esac
+    fi
+
+    COMPREPLY=($(compgen -W "$words" -- "$cur"))
+
+    # Leave the cursor after options that take a value
+    if [ ${#COMPREPLY[@]} -eq 1 ] && [[ "${COMPREPLY[0]}" == *= ]] && type compopt >/dev/null 2>&1; then
+        compopt -o nospace
+    fi
+}
+
+complete -F _dbmisvc_stack dbmisvc-stack
+"""
+
+zsh_script = r"""# dbmisvc-stack completion for zsh, load it with:
+#   eval "$(dbmisvc-stack completion zsh)"
+
+(( $+functions[compdef] )) || { autoload -U +X compinit && compinit }
+autoload -U +X bashcompinit && bashcompinit
+
+""" + "\n".join(bash_script.splitlines()[3:]) + "\n"
+
+
+class Completion(Base):
+
+    # Printing the script must work outside of a stack
+    requires_stack = False
+
+    def run(self):
+
+        if self.options["--refresh"]:
+            if not Stack.check_stack(Stack.get_stack_root()):
+                exit(1)
+
+            path = self.write_cache(self.get_candidates())
+            logger.debug("(completion) Wrote '{}'".format(path))
+            return
+
+        shell = self.options["<shell>"] or os.path.basename(os.environ.get("SHELL", ""))
+        if shell not in ("bash", "zsh"):
+            logger.error("(completion) Error: Completion is only available for bash and zsh")
+            exit(1)
+
+        print(bash_script if shell == "bash" else zsh_script, end="")
+
+    @staticmethod
+    def get_options():
+        """
+        Returns the options of each command, as listed in its usage
+        :rtype: dict
+        """
+        from dbmisvc_stack import cli
+
+        options = {}
+        for line in cli.__doc__.split("Options:")[0].splitlines():
+            words = line.split()
+            if len(words) < 2 or words[0] != "dbmisvc-stack" or not words[1].isalpha():
+                continue
+
+            # Options that take a value end in '=' so their value can follow
+            found = options.setdefault(words[1], [])
+            for option in re.findall(r"(?<![\w<])--?[\w-]+=?", line):
+                if option not in found:
+                    found.append(option)
+
+        return options
+
+    @staticmethod
+    def get_branches(app):
+        """
+        Returns the app's configured branch and those in its repository
+        mirror, if mirrors are enabled, without going to the network
+        :rtype: list
+        """
+        branches = [App.get_repo_branch(app) or "master"]
+
+        mirror_dir = App.get_mirror_dir(app)
+        if mirror_dir and os.path.exists(mirror_dir):
+            refs = subprocess.run(
+                ["git", "--git-dir={}".format(mirror_dir), "for-each-ref", "--format=%(refname:short)", "refs/heads"],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                universal_newlines=True,
+            ).stdout
+            branches.extend(refs.split())
+
+        return list(dict.fromkeys(branches))
+
+    @staticmethod
+    def get_hooks():
+        """
+        Returns the names of the hooks in the hooks directory and those
+        configured in the 'hooks' section of the stack config
+        :rtype: list
+        """
+        hooks = list(Stack.get_hooks_config("timeouts") or {})
+
+        hooks_dir = os.path.join(Stack.get_stack_root(), "hooks")
+        if os.path.isdir(hooks_dir):
+            hooks.extend(name[: -len(".py")] for name in os.listdir(hooks_dir) if name.endswith(".py"))
+
+        return sorted(set(hooks))
+
+    @staticmethod
+    def get_candidates():
+        """
+        Returns the words to complete, keyed by what they complete
+        :rtype: dict
+        """
+        from dbmisvc_stack.commands import COMMANDS
+
+        apps = sorted(App.get_apps())
+        apps_config = Stack.get_config("apps", required=False) or {}
+        packages = [package["name"] for package in Stack.get_config("packages", required=False) or []]
+        for app in apps_config:
+            packages.extend(Stack.get_app_config(app, "packages") or [])
+
+        candidates = {
+            "commands": sorted(COMMANDS),
+            "apps": apps,
+            "packages": sorted(set(packages)),
+            "hooks": Completion.get_hooks(),
+        }
+        for command, options in Completion.get_options().items():
+            candidates["options:{}".format(command)] = options
+
+        # Only apps with a repository have branches
+        for app in apps_config:
+            candidates["branches:{}".format(app)] = Completion.get_branches(app)
+
+        return candidates
+
+    @staticmethod
+    def write_cache(candidates):
+        """
+        Writes the candidates to '.stack/completion' atomically, a line per
+        key so the completion scripts can read it without starting Python
+        :return: The path of the cache
+        :rtype: str
+        """
+        path = Stack.get_state_path("completion")
+        with open(path + ".tmp", "w") as f:
+            for key, words in candidates.items():
+                f.write("{} {}\n".format(key, " ".join(words)))
+
+        os.replace(path + ".tmp", path)
+        return path
@@ -0,0 +1,37 @@
+"""The db command."""
+
+import os
+
+from dbmisvc_stack.commands.base import Base
+from dbmisvc_stack.app import App
+from dbmisvc_stack.app import Stack
+
+import logging
+
+logger = logging.getLogger("stack")
+
+
+class Db(Base):
+    def run(self):
+
+        # Get the docker client.
+        docker_client = Stack.get_docker_client()
+
+        # Determine the app.
+        app = self.options["<app>"]
+
+        if self.options["dump"]:
+            path = os.path.abspath(self.options["<file>"] or App.get_dump_path(app))
+            success = App.dump_database(docker_client, app, path)
+
+        else:
+            path = os.path.abspath(self.options["<file>"])
+            if not os.path.exists(path):
+                logger.error("({}) Dump '{}' does not exist".format(app, path))
+                exit(1)
+
+            jobs = max(1, int(self.options.get("--jobs") or 1))
+            success = App.load_database(docker_client, app, path, jobs=jobs)
+
+        if not success:
+            exit(1)
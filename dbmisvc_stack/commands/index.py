@@ -0,0 +1,41 @@
+"""The index command."""
+
+from dbmisvc_stack.commands.base import Base
+from dbmisvc_stack.commands.packages import Packages
+from dbmisvc_stack.app import Stack
+from dbmisvc_stack.index import is_loopback, make_server
+
+import logging
+
+logger = logging.getLogger("stack")
+
+
+class Index(Base):
+    def run(self):
+
+        # Ensure the built-in index is enabled
+        config = Stack.get_config("package-index", required=False)
+        if config is None:
+            logger.error("The built-in package index is not enabled, set 'package-index' in stack.yml")
+            exit(1)
+
+        directory = Packages.get_index_directory()
+        host = config.get("host") or "127.0.0.1"
+        port = self.options.get("--port") or config.get("port") or 3141
+
+        # Anyone who can reach the index could replace packages otherwise
+        if not is_loopback(host) and not config.get("password"):
+            logger.error("Set 'password' in 'package-index' to listen on '{}'".format(host))
+            exit(1)
+
+        server = make_server(directory, host, port, password=config.get("password"))
+
+        logger.info("Serving packages from '{}' at http://{}:{}/simple/".format(directory, host, server.server_port))
+        try:
+            server.serve_forever()
+
+        except KeyboardInterrupt:
+            logger.info("Stopping package index")
+
+        finally:
+            server.server_close()
@@ -1,7 +1,10 @@
 """The init command."""
 
+import os
+
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App
+from dbmisvc_stack.app import Stack
 
 import logging
 
@@ -24,16 +27,36 @@ class Init(Base):
                     app, App.get_repo_branch(app)
                 )
             )
-            App.init(app)
+            App.init(app, offline=self.options.get("--offline"))
 
         else:
 
-            # Iterate through built apps
-            for app in App.get_built_apps():
+            # Get built apps with repository details
+            apps = [
+                app
+                for app in App.get_built_apps()
+                if App.get_repo_url(app) and App.get_repo_branch(app)
+            ]
+
+            # Fetch all repositories at once, only the subtree adds must be serialized
+            fetched = App.fetch_all(
+                apps,
+                jobs=self.options.get("--jobs"),
+                offline=self.options.get("--offline"),
+            )
+
+            # Iterate through fetched apps, subtrees must be added one at a time
+            initialized = []
+            for app in fetched:
 
-                # Ensure it's a built app
-                if App.get_repo_url(app) and App.get_repo_branch(app):
+                # Initializer.
+                logger.debug("({}) Preparing to initialize".format(app))
+                if App.init(app, post_hook=False, fetch=False):
+                    initialized.append(app)
 
-                    # Initializer.
-                    logger.debug("({}) Preparing to initialize".format(app))
-                    App.init(app)
+            # Independent apps' post-clone hooks can run concurrently
+            Stack.hooks(
+                "post-clone",
+                {app: [os.path.realpath(App.get_repo_dir(app))] for app in initialized},
+                jobs=self.options.get("--jobs"),
+            )
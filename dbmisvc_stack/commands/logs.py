@@ -1,7 +1,10 @@
 """The logs command."""
 
+import time
+
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App, Stack
+from dbmisvc_stack.docker_async import AsyncDockerClient
 
 import logging
 
@@ -11,6 +14,44 @@ logger = logging.getLogger("stack")
 class Logs(Base):
     def run(self):
 
+        # Stream every app's logs at once, if Docker is on a unix socket
+        if self.options.get("--all"):
+            try:
+                AsyncDockerClient.get_socket_path()
+
+            except ValueError as e:
+                logger.debug("(stack) {}, streaming logs with docker-compose".format(e))
+                if self.options["--minutes"]:
+                    logger.warning("(stack) Logs of every app cannot be limited by minutes, showing all of them")
+
+                command = ["docker-compose", "logs", "-t"]
+                if self.options["--lines"]:
+                    command.extend(["--tail", self.options["--lines"]])
+
+                if self.options["--follow"]:
+                    command.append("-f")
+
+                Stack.run(command)
+                return
+
+            since = None
+            if self.options["--minutes"]:
+                since = int(time.time() - 60 * int(self.options["--minutes"]))
+
+            try:
+                App.stream_logs(
+                    list(App.get_apps()),
+                    follow=self.options["--follow"],
+                    tail=self.options["--lines"],
+                    since=since,
+                    version=Stack.get_docker_client().api.api_version,
+                )
+
+            except KeyboardInterrupt:
+                pass
+
+            return
+
         # Check for time constraints.
         if self.options["--minutes"]:
 
@@ -0,0 +1,78 @@
+"""The mirror command."""
+
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+from dbmisvc_stack.commands.base import Base
+from dbmisvc_stack.app import App
+from dbmisvc_stack.app import Stack
+
+import logging
+
+logger = logging.getLogger("stack")
+
+
+class Mirror(Base):
+    def run(self):
+
+        # Determine the apps with repositories
+        app = self.options["<app>"]
+        apps = [app] if app else [app for app in App.get_apps() if App.get_repo_url(app)]
+
+        # Ensure mirrors are enabled
+        if not Stack.get_config("mirrors-directory", required=False):
+            logger.error("Repository mirrors are not enabled, set 'mirrors-directory' in stack.yml")
+            exit(1)
+
+        # Check for running in the background
+        if self.options.get("--background"):
+            self.run_in_background(app)
+            return
+
+        # Refresh them all at once
+        jobs = max(1, int(self.options.get("--jobs") or App.FETCH_CONCURRENCY))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(App.update_mirror, apps))
+
+        if not all(results):
+            logger.error(
+                "Could not refresh mirrors for {}".format(
+                    ", ".join(app for app, result in zip(apps, results) if not result)
+                )
+            )
+            exit(1)
+
+    def run_in_background(self, app):
+
+        # Build the same command, without the background flag
+        command = ["dbmisvc-stack", "mirror"]
+        if app:
+            command.append(app)
+        if self.options.get("--jobs"):
+            command.append("--jobs={}".format(self.options["--jobs"]))
+
+        # Log to the mirrors directory
+        mirrors_dir = os.path.join(
+            Stack.get_stack_root(),
+            os.path.expanduser(Stack.get_config("mirrors-directory")),
+        )
+        os.makedirs(mirrors_dir, exist_ok=True)
+        log_path = os.path.join(mirrors_dir, "refresh.log")
+
+        # Detach it from this session.
+        with open(log_path, "a") as log:
+            process = subprocess.Popen(
+                command,
+                cwd=Stack.get_stack_root(),
+                stdin=subprocess.DEVNULL,
+                stdout=log,
+                stderr=subprocess.STDOUT,
+                start_new_session=True,
+            )
+
+        logger.info(
+            "Refreshing mirrors in the background (pid {}), logging to '{}'".format(
+                process.pid, log_path
+            )
+        )
@@ -1,18 +1,62 @@
 """The packages command."""
 
-import docker
+import glob
+import hashlib
+import io
+import json
 import os
+import shlex
+import shutil
+import tarfile
+import threading
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App
 from dbmisvc_stack.app import Stack
+from dbmisvc_stack.index import PackageIndex
+from dbmisvc_stack.watch import make_watcher, wait_debounced
 
 import logging
 
 logger = logging.getLogger("stack")
 
+# The outcome of updating a single package
+PackageResult = namedtuple("PackageResult", ["package", "status", "build_time", "upload_time", "dists"])
+
 
 class Packages(Base):
+
+    # The default number of packages that may be built at once
+    BUILD_CONCURRENCY = 4
+
+    # Directories that do not affect the built package
+    IGNORED_DIRECTORIES = {
+        ".git",
+        ".hg",
+        ".tox",
+        ".nox",
+        ".venv",
+        "venv",
+        ".eggs",
+        "__pycache__",
+        ".pytest_cache",
+        ".mypy_cache",
+        "build",
+        "dist",
+    }
+
+    # Seconds without changes that end a burst of edits when watching
+    WATCH_DEBOUNCE = 0.5
+
+    # Where built distributions are copied to in app containers
+    REINSTALL_DIRECTORY = "/tmp"
+
+    # Packages are updated concurrently, guard the record of their hashes
+    _hashes_lock = threading.Lock()
+
     def run(self):
 
         # Ensure we have an index specified
@@ -27,46 +71,244 @@ class Packages(Base):
         else:
             packages = [package["name"] for package in Stack.get_config("packages")]
 
-        # Process each package
-        for package in packages:
+        jobs = max(1, int(self.options.get("--jobs") or self.BUILD_CONCURRENCY))
+        results = self.update_all(packages, jobs, force=self.options.get("--force"))
 
-            # Update the package
-            if self.update(package):
-                logger.info("Package '{}' was updated successfully".format(package))
+        # Keep rebuilding as packages change
+        if self.options.get("--watch"):
+            self.watch(packages, jobs)
+            return
 
-                # Update services
-                self.update_apps(package)
+        if any(result.status == "failed" for result in results):
+            logger.error("Error: Could not update package")
+            exit(1)
+
+    def update_all(self, packages, jobs, force=False):
+        """
+        Builds and uploads changed packages at once and reinstalls the
+        updated ones in the apps that depend on them
+        :return: The results of the updates
+        :rtype: list
+        """
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(lambda package: self.update(package, force=force), packages))
+
+        # Process each updated package
+        docker_client = None
+        for result in results:
+            if result.status == "updated":
+                logger.info("Package '{}' was updated successfully".format(result.package))
+
+                # Update services, sharing one client
+                docker_client = docker_client or Stack.get_docker_client()
+                self.update_apps(result.package, result.dists, docker_client)
+
+        self.report(results)
+        return results
+
+    def watch(self, packages, jobs):
+        """
+        Watches the packages' sources and updates those that change until
+        interrupted
+        """
+
+        # Map sources to packages
+        paths = {os.path.abspath(App.get_packages_stack_config(package)["path"]): package for package in packages}
+        watcher = make_watcher(list(paths), ignore=self.ignored)
+        logger.info(
+            "Watching {} package(s) for changes with {}, press Ctrl+C to stop".format(
+                len(paths), type(watcher).__name__
+            )
+        )
+
+        try:
+            while True:
+                changed, first = wait_debounced(watcher, quiet=self.WATCH_DEBOUNCE)
+                changed_packages = [paths[path] for path in sorted(changed)]
+                logger.info("Detected changes in {}".format(", ".join(changed_packages)))
 
-            else:
-                logger.error("Error: Could not update package")
-                exit(1)
+                results = self.update_all(changed_packages, jobs)
+                if any(result.status == "updated" for result in results):
+                    logger.info("(packages) Changes running in {:.2f}s".format(time.monotonic() - first))
+
+        except KeyboardInterrupt:
+            logger.info("Stopped watching packages")
+
+        finally:
+            watcher.close()
+
+    @staticmethod
+    def ignored(name):
+        """
+        Returns whether a file or directory does not affect the built package
+        """
+        return name in Packages.IGNORED_DIRECTORIES or name.endswith((".egg-info", ".pyc", ".pyo"))
 
     @staticmethod
-    def update(package):
+    def hash_package(path, build=None):
+        """
+        Hashes the source of a package, ignoring build outputs and caches.
+        :param path: The path to the package
+        :type path: str
+        :param build: The build command, changing it changes the hash
+        :type build: str
+        :return: The hex digest
+        :rtype: str
+        """
+        digest = hashlib.sha256((build or "").encode("utf-8") + b"\0")
+        for root, directories, files in os.walk(path):
+            directories[:] = sorted(directory for directory in directories if not Packages.ignored(directory))
+
+            for name in sorted(files):
+                file_path = os.path.join(root, name)
+                if Packages.ignored(name) or not os.path.isfile(file_path):
+                    continue
+
+                digest.update(os.path.relpath(file_path, path).encode("utf-8") + b"\0")
+                with open(file_path, "rb") as f:
+                    for chunk in iter(lambda: f.read(65536), b""):
+                        digest.update(chunk)
+
+                digest.update(b"\0")
+
+        return digest.hexdigest()
 
+    @staticmethod
+    def get_built_hashes():
+        """
+        Returns the source hashes of packages as of their last successful upload
+        """
         try:
-            # Get devpi index details
-            port = App.get_external_port("devpi", "3141")
-            index_url = "http://localhost:{}/root/public/".format(port)
+            with open(Stack.get_state_path("packages.json"), "r") as f:
+                return json.load(f)
+
+        except (IOError, ValueError):
+            return {}
+
+    @staticmethod
+    def set_built_hash(package, source_hash):
+        """
+        Records the source hash of a package that was successfully uploaded
+        """
+        with Packages._hashes_lock:
+            hashes = Packages.get_built_hashes()
+            hashes[package] = source_hash
+
+            path = Stack.get_state_path("packages.json")
+            with open(path + ".tmp", "w") as f:
+                json.dump(hashes, f, indent=2, sort_keys=True)
+
+            os.replace(path + ".tmp", path)
+
+    @staticmethod
+    def build(package, path, build):
+        """
+        Builds a package into its own output directory so that stale files in
+        the package's 'dist' directory are never uploaded. A '{dist}' placeholder
+        in the build command is replaced with the output directory, otherwise
+        files the build writes to 'dist' are copied there.
+        :return: The built distributions, or None if the build failed
+        :rtype: list
+        """
+        output_dir = Stack.get_state_path("packages", package, "dist")
+        shutil.rmtree(output_dir, ignore_errors=True)
+        os.makedirs(output_dir)
+
+        # Note what is in dist already
+        dist_dir = os.path.join(path, "dist")
+        before = {
+            file: os.stat(file).st_mtime_ns for file in glob.glob(os.path.join(dist_dir, "*"))
+        }
+
+        # Build the package
+        command = shlex.split(build.replace("{dist}", shlex.quote(output_dir)))
+        if Stack.run(command, cwd=path) != 0:
+            return None
+
+        # Collect new or rebuilt files
+        if "{dist}" not in build:
+            for file in glob.glob(os.path.join(dist_dir, "*")):
+                if before.get(file) != os.stat(file).st_mtime_ns:
+                    shutil.copy2(file, output_dir)
+
+        return sorted(glob.glob(os.path.join(output_dir, "*")))
+
+    @staticmethod
+    def get_index_directory():
+        """
+        Returns the directory the built-in package index serves from
+        :rtype: str
+        """
+        config = Stack.get_config("package-index", required=False) or {}
+        return os.path.join(
+            Stack.get_stack_root(),
+            os.path.expanduser(config.get("directory") or os.path.join(".stack", "index")),
+        )
+
+    @staticmethod
+    def publish(dists):
+        """
+        Adds built distributions to the built-in package index. A running index
+        server picks them up on its next request.
+        :param dists: The distributions
+        :type dists: list
+        """
+        index = PackageIndex(Packages.get_index_directory())
+        for dist in dists:
+            with open(dist, "rb") as f:
+                index.add(os.path.basename(dist), f.read())
 
+    @staticmethod
+    def update(package, force=False):
+        """
+        Builds and uploads a package if its source changed since its last upload
+        :return: The result of the update
+        :rtype: PackageResult
+        """
+        build_time = upload_time = 0.0
+
+        try:
             # Get the description
             config = App.get_packages_stack_config(package)
 
-            # Get password
-            password = App.get_config("devpi", "environment").get("DEVPI_PASSWORD")
-
             # Get the location
             path = os.path.abspath(config["path"])
-            dists = os.path.join(path, "dist", "*")
+
+            # Skip it if nothing has changed
+            source_hash = Packages.hash_package(path, config.get("build"))
+            if not force and Packages.get_built_hashes().get(package) == source_hash:
+                logger.info("Package '{}' has not changed, skipping".format(package))
+                return PackageResult(package, "skipped", build_time, upload_time, [])
 
             # Build the package
-            Stack.run(config.get("build"), cwd=path)
+            start = time.monotonic()
+            dists = Packages.build(package, path, config.get("build"))
+            build_time = time.monotonic() - start
+            if not dists:
+                logger.error("Package '{}' build produced no distributions".format(package))
+                return PackageResult(package, "failed", build_time, upload_time, [])
+
+            # Publish straight to the built-in index, if used
+            if Stack.get_config("package-index", required=False) is not None:
+                start = time.monotonic()
+                Packages.publish(dists)
+                upload_time = time.monotonic() - start
+
+                Packages.set_built_hash(package, source_hash)
+                return PackageResult(package, "updated", build_time, upload_time, dists)
+
+            # Get devpi index details
+            port = App.get_external_port("devpi", "3141")
+            index_url = "http://localhost:{}/root/public/".format(port)
+
+            # Get password
+            password = App.get_config("devpi", "environment").get("DEVPI_PASSWORD")
 
             # Upload
             cmd = [
                 "twine",
                 "upload",
-                dists,
+                *dists,
                 "--repository-url",
                 index_url,
                 "--skip-existing",
@@ -77,81 +319,139 @@ class Packages(Base):
             ]
 
             # Run it and make sure it was successful
-            return Stack.run(cmd) == 0
+            start = time.monotonic()
+            uploaded = Stack.run(cmd) == 0
+            upload_time = time.monotonic() - start
+            if not uploaded:
+                return PackageResult(package, "failed", build_time, upload_time, dists)
+
+            Packages.set_built_hash(package, source_hash)
+            return PackageResult(package, "updated", build_time, upload_time, dists)
 
         except Exception as e:
             logger.exception("Error updating package: {}".format(e), exc_info=True)
-            return False
+            return PackageResult(package, "failed", build_time, upload_time, [])
+
+    @staticmethod
+    def report(results):
+        """
+        Logs how long each package took to build and upload
+        """
+        logger.info("(packages) Summary:")
+        for result in results:
+            logger.info(
+                "    ({}) {}: build {:.2f}s, upload {:.2f}s".format(
+                    result.package, result.status, result.build_time, result.upload_time
+                )
+            )
+
+    @staticmethod
+    def reinstall(docker_client, app, package, name, archive):
+        """
+        Copies a built distribution into the app's container and reinstalls it
+        :param docker_client: The Docker client instance
+        :param app: The app
+        :param package: The package
+        :param name: The file name of the distribution
+        :param archive: A tar archive containing the distribution
+        :type archive: bytes
+        :return: Whether the package was reinstalled, and how long it took
+        :rtype: bool, float
+        """
+        start = time.monotonic()
+        try:
+            container = App.get_container(docker_client, app)
+            if container is None or container.status != "running":
+                logger.error("    .... App {} is not running, cannot update".format(app))
+                return False, time.monotonic() - start
+
+            logger.info("App '{}' depends on '{}', reinstalling...".format(app, package))
+
+            # Copy it in and install it, its dependencies have not changed
+            container.put_archive(Packages.REINSTALL_DIRECTORY, archive)
+            code, output = container.exec_run(
+                [
+                    "pip",
+                    "install",
+                    "--force-reinstall",
+                    "--no-deps",
+                    "{}/{}".format(Packages.REINSTALL_DIRECTORY, name),
+                ]
+            )
+            if code != 0:
+                logger.error("    .... failed with exit code: {}".format(code))
+                logger.debug("({}) {}".format(app, output.decode("utf-8", "replace")))
+                return False, time.monotonic() - start
+
+            logger.info("    ... ({}) reinstall succeeded in {:.2f}s!".format(app, time.monotonic() - start))
+            return True, time.monotonic() - start
+
+        except Exception as e:
+            logger.exception(
+                "Error reinstalling package for {}: {}".format(app, e),
+                exc_info=True,
+            )
+            return False, time.monotonic() - start
 
     @staticmethod
-    def update_apps(package):
+    def update_apps(package, dists, docker_client=None):
+        """
+        Reinstalls a freshly built package in all running apps that list it,
+        concurrently across apps
+        :param package: The package
+        :param dists: The distributions that were built
+        :type dists: list
+        :param docker_client: The Docker client instance to share
+        :return: A dict of app to whether the package was reinstalled
+        :rtype: dict
+        """
 
         # Find all services listing this package
-        for app, config in Stack.get_config("apps").items():
-
-            try:
-                # Check packages
-                if config.get("packages") and package in config.get("packages"):
-
-                    # Get the docker client.
-                    docker_client = docker.from_env()
-
-                    # Determine the app.
-                    if App.check_running(docker_client, app):
-                        logger.info(
-                            "App '{}' depends on '{}', reinstalling...".format(
-                                app, package
-                            )
-                        )
-
-                        # Build the uninstall command
-                        uninstall = [
-                            "docker-compose",
-                            "exec",
-                            app,
-                            "pip",
-                            "uninstall",
-                            "-y",
-                            package,
-                        ]
-
-                        # Execute a shell.
-                        code = Stack.run(uninstall)
-                        if code == 0:
-                            logger.info("    ... uninstalled ...")
-
-                            # Build the install command
-                            install = [
-                                "docker-compose",
-                                "exec",
-                                app,
-                                "pip",
-                                "install",
-                                package,
-                            ]
-
-                            # Execute a shell.
-                            code = Stack.run(install)
-                            if code == 0:
-                                logger.info("        ... reinstall succeeded!")
-
-                            else:
-                                logger.error(
-                                    "    .... failed with exit code: {}".format(code)
-                                )
-
-                        else:
-                            logger.error(
-                                "    .... failed with exit code: {}".format(code)
-                            )
-
-                    else:
-                        logger.error(
-                            "    .... App {} is not running, cannot update".format(app)
-                        )
-
-            except Exception as e:
-                logger.exception(
-                    "Error reinstalling package for {}: {}".format(app, e),
-                    exc_info=True,
+        apps = [
+            app
+            for app, config in Stack.get_config("apps").items()
+            if config.get("packages") and package in config.get("packages")
+        ]
+        if not apps:
+            return {}
+
+        # Prefer wheels as they need no building in the container
+        wheels = [dist for dist in dists if dist.endswith(".whl")]
+        dist = (wheels or dists)[-1]
+        name = os.path.basename(dist)
+
+        # Archive it once for all containers
+        stream = io.BytesIO()
+        with tarfile.open(fileobj=stream, mode="w") as tar:
+            tar.add(dist, arcname=name)
+        archive = stream.getvalue()
+
+        docker_client = docker_client or Stack.get_docker_client()
+        start = time.monotonic()
+        with ThreadPoolExecutor(max_workers=len(apps)) as executor:
+            results = list(
+                executor.map(
+                    lambda app: Packages.reinstall(
+                        docker_client, app, package, name, archive
+                    ),
+                    apps,
+                )
+            )
+
+        for app, (reinstalled, duration) in zip(apps, results):
+            logger.info(
+                "    ({}) {}: {:.2f}s".format(
+                    app, "reinstalled" if reinstalled else "failed", duration
                 )
+            )
+
+        logger.info(
+            "Package '{}' reinstalled in {}/{} app(s) in {:.2f}s".format(
+                package,
+                sum(reinstalled for reinstalled, _ in results),
+                len(apps),
+                time.monotonic() - start,
+            )
+        )
+
+        return {app: reinstalled for app, (reinstalled, _) in zip(apps, results)}
@@ -31,23 +31,10 @@ class Pull(Base):
         # Ensure it exists.
         if not os.path.exists(subdir):
             logger.error(
-                '({}) No repository at {}, run "stack clone" command first'.format(app)
+                '({}) No repository at {}, run "stack clone" command first'.format(app, subdir)
             )
             return
 
-        # Build the command
-        command = [
-            "git",
-            "subtree",
-            "pull",
-            "--prefix={}".format(subdir),
-            repo_url,
-            branch,
-        ]
-
-        # Check for a squash.
-        if self.options.get("--squash"):
-            command.append("--squash")
-
-        # Run the command.
-        Stack.run(command)
+        # Fetch the branch and merge it.
+        if App.fetch(app, branch, offline=self.options.get("--offline")):
+            App.merge_subtree(app, squash=self.options.get("--squash"))
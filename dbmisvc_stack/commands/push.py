@@ -31,23 +31,24 @@ class Push(Base):
         # Ensure it exists.
         if not os.path.exists(subdir):
             logger.error(
-                '({}) No repository at {}, run "stack clone" command first'.format(app)
+                '({}) No repository at {}, run "stack clone" command first'.format(
+                    app, subdir
+                )
             )
             return
 
+        # Split the subtree, only commits since the last split are processed
+        split = App.split_subtree(app, rejoin=self.options.get("--rejoin"))
+        if split is None:
+            return
+
         # Build the command
         command = [
             "git",
-            "subtree",
             "push",
-            "--prefix={}".format(subdir),
             repo_url,
-            branch,
+            "{}:refs/heads/{}".format(split, branch),
         ]
 
-        # Check for a squash.
-        if self.options.get("--squash"):
-            command.append("--squash")
-
         # Run the command.
         Stack.run(command)
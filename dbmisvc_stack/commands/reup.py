@@ -1,6 +1,6 @@
 """The reup command."""
 
-import docker
+from concurrent.futures import ThreadPoolExecutor
 
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App
@@ -15,7 +15,7 @@ class Reup(Base):
     def run(self):
 
         # Get a docker client.
-        docker_client = docker.from_env()
+        docker_client = Stack.get_docker_client()
 
         # Get options.
         clean = self.options["--clean"]
@@ -44,14 +44,17 @@ class Reup(Base):
             up = ["docker-compose", "up", "--no-start"]
 
             # Check for purge
+            purged = False
             if self.options["--purge"]:
 
                 # Confirm
                 if self.yes_no("This will remove all app data, continue?"):
                     logger.warning("({}) Database will be purged!".format(app))
 
-                    # Process it
-                    App.purge_data(docker_client, app)
+                    # Restore the snapshot, or process it and snapshot it once the app is up
+                    if not App.restore_data(docker_client, app):
+                        App.purge_data(docker_client, app)
+                        purged = True
             else:
                 logger.info("({}) Database will not be purged".format(app))
 
@@ -90,6 +93,10 @@ class Reup(Base):
             # Run the post-up hook, if any
             Stack.hook("post-up", app)
 
+            # Capture the freshly migrated database
+            if purged:
+                App.migrate_and_snapshot(docker_client, app)
+
         else:
 
             # Check for clean.
@@ -103,6 +110,16 @@ class Reup(Base):
                         # Rebuild images
                         App.clean_images(docker_client, app)
 
+            # Purge every app's database while the database container is up
+            purged = []
+            if self.options["--purge"]:
+                if self.yes_no("This will remove all data of every app, continue?"):
+                    logger.warning("(stack) Databases will be purged!")
+                    results = App.purge_all_data(docker_client)
+                    purged = [app for app, result in results.items() if result == "purged"]
+            else:
+                logger.info("(stack) Databases will not be purged")
+
             # Build and run stack down
             down_command = ["stack", "down"]
             if clean:
@@ -122,3 +139,14 @@ class Reup(Base):
 
             # Run the pre-up hook, if any
             Stack.hook("post-up")
+
+            # Capture the freshly migrated databases, which needs the stack to still be up
+            if purged and self.options["-d"]:
+                with ThreadPoolExecutor(max_workers=len(purged)) as executor:
+                    list(executor.map(lambda app: App.migrate_and_snapshot(docker_client, app), purged))
+
+            elif purged:
+                logger.info(
+                    "(stack) Run 'dbmisvc-stack snapshot <app>' for {} once they have migrated"
+                    " to speed up later purges".format(", ".join(purged))
+                )
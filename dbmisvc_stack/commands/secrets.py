@@ -1,12 +1,18 @@
 """The secrets command."""
 
 import os
-import boto3
 import json
 import base64
-from botocore.exceptions import ClientError
+import hashlib
+import re
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import yaml
 
 from dbmisvc_stack.commands.base import Base
+from dbmisvc_stack.app import App
 from dbmisvc_stack.app import Stack
 
 import logging
@@ -20,85 +26,361 @@ headers = """#
 
 
 class Secrets(Base):
+
+    # Seconds fetched secrets are reused for without checking AWS
+    DEFAULT_TTL = 300
+
+    # How many secrets may be requested at once
+    FETCH_CONCURRENCY = 8
+
+    # The most secrets Secrets Manager returns in one batch
+    BATCH_SIZE = 20
+
     def run(self):
 
-        # Get name of secret
-        secret_name = Stack.get_secrets_config("name")
-        try:
-            # Get the secrets manager client.
-            session = boto3.session.Session(
-                profile_name=Stack.get_secrets_config("profile")
-            )
-            client = session.client(
-                "secretsmanager",
-                region_name=Stack.get_secrets_config("region"),
-            )
+        # Get names of secrets
+        secret_ids = self.get_secret_ids()
+        if not secret_ids:
+            logger.error("(secrets) No secrets are configured in stack.yml")
+            exit(1)
 
+        path = os.path.join(Stack.get_stack_root(), ".env")
+        try:
             # Get the secrets
-            response = client.get_secret_value(SecretId=secret_name)
-
-            # Get values of secrets
-            if "SecretString" in response:
-                secrets = json.loads(response["SecretString"])
-            else:
-                secrets = base64.b64decode(response["SecretBinary"])
+            values = self.get_secrets(secret_ids, refresh=self.options.get("--refresh"))
+            missing = [secret_id for secret_id in secret_ids if secret_id not in values]
+            if missing:
+                logger.error("(secrets) Error: Could not fetch secrets '{}'".format("', '".join(missing)))
+                exit(1)
 
-            # Check if file exists
-            path = os.path.join(Stack.get_stack_root(), ".env")
+            # Compare with the current file
+            content = self.render(secret_ids, values)
+            current = None
             if os.path.exists(path):
+                with open(path, "rb") as f:
+                    current = f.read()
 
-                # Prompt to overwrite
-                if not self.options["--force"]:
-                    logger.error(
-                        "(secrets) The .env secrets file already exists."
-                        ' Run with "-f" to overwrite.'
-                    )
-                    exit(0)
-
-            # Determine how to write
-            if type(secrets) is dict:
-                with open(path, "w") as f:
-                    f.write(headers + "\n")
-                    for key, value in secrets.items():
-                        if type(value) is str:
-                            f.write("{}={}\n".format(key.upper(), value))
-                        else:
-                            f.write("{}={}\n".format(key.upper(), json.dumps(value)))
+            if current == content:
+                logger.info("(secrets) The .env secrets file is up to date")
+                return
 
-            else:
-                with open(path, "w+b") as f:
-                    f.write(secrets)
+            # Report what changed, without values
+            keys = self.report(self.parse_env(current or b""), self.parse_env(content))
+            services = self.get_affected_services(keys)
 
-            logger.info("(secrets) Fetched and saved secrets to '{}'".format(path))
-
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "DecryptionFailureException":
-                # Secrets Manager can't decrypt the protected secret text using
-                # the provided KMS key.
-                # Deal with the exception here, and/or rethrow at your discretion.
-                raise e
-            elif e.response["Error"]["Code"] == "InternalServiceErrorException":
-                # An error occurred on the server side.
-                # Deal with the exception here, and/or rethrow at your discretion.
-                raise e
-            elif e.response["Error"]["Code"] == "InvalidParameterException":
-                # You provided an invalid value for a parameter.
-                # Deal with the exception here, and/or rethrow at your discretion.
-                raise e
-            elif e.response["Error"]["Code"] == "InvalidRequestException":
-                # You provided a parameter value that is not valid for the current
-                # state of the resource.
-                # Deal with the exception here, and/or rethrow at your discretion.
-                raise e
-            elif e.response["Error"]["Code"] == "ResourceNotFoundException":
-                # We can't find the resource that you asked for.
-                # Deal with the exception here, and/or rethrow at your discretion.
+            # Prompt to overwrite
+            if current is not None and not self.options["--force"]:
                 logger.error(
-                    "(secrets) Error: No secret could be found for name '{}'".format(
-                        secret_name
-                    )
+                    "(secrets) The .env secrets file already exists and differs."
+                    ' Run with "-f" to overwrite.'
                 )
+                exit(0)
+
+            self.write_env(path, content)
+            logger.info("(secrets) Fetched and saved secrets to '{}'".format(path))
+            if services:
+                logger.info("(secrets) Services with changed environments: {}".format(", ".join(services)))
 
         except Exception as e:
             logger.exception("Secrets error: {}".format(e))
             exit(1)
+
+    @staticmethod
+    def render(secret_ids, values):
+        """
+        Returns the contents of the .env file for the secrets
+        :rtype: bytes
+        """
+
+        # A single binary secret is the .env file itself. Its SecretBinary holds
+        # the file base64 encoded, and is kept base64 encoded again in the cache
+        if len(secret_ids) == 1 and "binary" in values[secret_ids[0]]:
+            return base64.b64decode(base64.b64decode(values[secret_ids[0]]["binary"]))
+
+        lines = [headers + "\n"]
+        for key, value in Secrets.merge(secret_ids, values).items():
+            if type(value) is str:
+                lines.append("{}={}\n".format(key.upper(), value))
+            else:
+                lines.append("{}={}\n".format(key.upper(), json.dumps(value)))
+
+        return "".join(lines).encode("utf-8")
+
+    @staticmethod
+    def parse_env(content):
+        """
+        Returns the variables set in the contents of a .env file
+        :rtype: dict
+        """
+        variables = {}
+        for line in content.decode("utf-8", "replace").splitlines():
+            line = line.strip()
+            if not line or line.startswith("#") or "=" not in line:
+                continue
+
+            key, _, value = line.partition("=")
+            variables[key.strip()] = value
+
+        return variables
+
+    @staticmethod
+    def report(current, new):
+        """
+        Logs which variables were added, removed or changed
+        :return: The names of the variables that differ
+        :rtype: set
+        """
+        added = sorted(set(new) - set(current))
+        removed = sorted(set(current) - set(new))
+        changed = sorted(key for key in set(new) & set(current) if new[key] != current[key])
+
+        for label, keys in (("Added", added), ("Removed", removed), ("Changed", changed)):
+            if keys:
+                logger.info("(secrets) {}: {}".format(label, ", ".join(keys)))
+
+        return set(added + removed + changed)
+
+    @staticmethod
+    def get_affected_services(keys):
+        """
+        Returns the services that load .env with 'env_file' or that refer to
+        any of the variables in their configuration
+        :param keys: The names of the variables that changed
+        :type keys: set
+        :rtype: list
+        """
+        services = []
+        if not keys:
+            return services
+
+        pattern = re.compile(r"\$\{?(" + "|".join(re.escape(key) for key in sorted(keys)) + r")\b")
+        for service, config in ((App.read_config() or {}).get("services") or {}).items():
+            env_files = config.get("env_file") or []
+            if isinstance(env_files, (str, dict)):
+                env_files = [env_files]
+
+            # Newer compose files may give the path as a mapping
+            env_files = [env_file.get("path") if isinstance(env_file, dict) else env_file for env_file in env_files]
+            if ".env" in (os.path.normpath(env_file) for env_file in env_files if env_file) or pattern.search(
+                yaml.dump(config)
+            ):
+                services.append(service)
+
+        return sorted(services)
+
+    @staticmethod
+    def write_env(path, content):
+        """
+        Replaces the .env file atomically, keeping its permissions
+        """
+        mode = os.stat(path).st_mode & 0o777 if os.path.exists(path) else 0o644
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".env.")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(content)
+
+            os.chmod(temp_path, mode)
+            os.replace(temp_path, path)
+
+        except Exception:
+            os.unlink(temp_path)
+            raise
+
+    @staticmethod
+    def get_secret_ids():
+        """
+        Returns the IDs of the stack's secrets followed by those of each app,
+        in the order they are merged
+        :rtype: list
+        """
+        secrets_config = Stack.get_config("secrets") or {}
+        secret_ids = [secrets_config["name"]] if secrets_config.get("name") else []
+        secret_ids.extend(secrets_config.get("names") or [])
+
+        for app in Stack.get_config("apps", required=False) or {}:
+            secret_ids.extend(Stack.get_app_config(app, "secrets") or [])
+
+        # Drop duplicates, keeping the first
+        return list(dict.fromkeys(secret_ids))
+
+    @staticmethod
+    def get_client():
+        """
+        Returns a Secrets Manager client. boto3 is only imported when needed as
+        importing it is slow.
+        """
+        import boto3
+
+        session = boto3.session.Session(profile_name=Stack.get_secrets_config("profile"))
+        return session.client(
+            "secretsmanager",
+            region_name=Stack.get_secrets_config("region"),
+            endpoint_url=Stack.get_secrets_config("endpoint-url"),
+        )
+
+    @staticmethod
+    def get_cache_path():
+        """
+        Returns the path of the stack's secret cache, in the user's cache
+        directory so the values are never within the stack's work tree
+        :rtype: str
+        """
+        cache_dir = os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache")
+        stack = hashlib.sha256(os.path.realpath(Stack.get_stack_root()).encode("utf-8")).hexdigest()[:16]
+
+        return os.path.join(cache_dir, "dbmisvc-stack", stack, "secrets.json")
+
+    @staticmethod
+    def load_cache():
+        """
+        Returns the secrets fetched previously
+        """
+        try:
+            with open(Secrets.get_cache_path(), "r") as f:
+                return json.load(f)
+
+        except (IOError, ValueError):
+            return {}
+
+    @staticmethod
+    def save_cache(cache):
+        """
+        Writes fetched secrets atomically, readable only by the user
+        """
+        path = Secrets.get_cache_path()
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+
+        # Only the user may read it
+        fd = os.open(path + ".tmp", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+
+        os.replace(path + ".tmp", path)
+
+        # Remove the cache earlier versions kept in the stack's work tree
+        legacy_path = os.path.join(Stack.get_stack_root(), ".stack", "secrets.json")
+        if os.path.exists(legacy_path):
+            os.remove(legacy_path)
+
+    @staticmethod
+    def get_secrets(secret_ids, refresh=False, client=None):
+        """
+        Returns the values of secrets, from the local cache if they were fetched
+        within the TTL, otherwise from Secrets Manager
+        :param secret_ids: The names or ARNs of the secrets
+        :param refresh: Whether to ignore the cache
+        :param client: The Secrets Manager client to use
+        :return: A dict of secret ID to a dict with either its 'string' or
+        base64 encoded 'binary' value
+        :rtype: dict
+        """
+        cache = Secrets.load_cache()
+        ttl = Stack.get_secrets_config("ttl")
+        ttl = Secrets.DEFAULT_TTL if ttl is None else ttl
+
+        # Use cached values that are fresh enough
+        now = time.time()
+        values = {
+            secret_id: cache[secret_id]
+            for secret_id in secret_ids
+            if not refresh and secret_id in cache and now - cache[secret_id]["fetched"] < ttl
+        }
+        stale = [secret_id for secret_id in secret_ids if secret_id not in values]
+        if not stale:
+            logger.info("(secrets) Using {} cached secret(s)".format(len(values)))
+            return values
+
+        # Fetch the rest
+        start = time.monotonic()
+        fetched = Secrets.fetch(client or Secrets.get_client(), stale)
+        for secret_id, value in fetched.items():
+            value["fetched"] = now
+            cache[secret_id] = values[secret_id] = value
+
+        logger.debug("(secrets) Fetched {} secret(s) in {:.2f}s".format(len(fetched), time.monotonic() - start))
+
+        Secrets.save_cache(cache)
+        return values
+
+    @staticmethod
+    def get_value(response):
+        """Returns the parts of a secret value response to keep."""
+        if "SecretString" in response:
+            return {"string": response["SecretString"]}
+
+        return {"binary": base64.b64encode(response["SecretBinary"]).decode("utf-8")}
+
+    @staticmethod
+    def fetch(client, secret_ids):
+        """
+        Fetches secrets in batches where the API supports it, otherwise one
+        request per secret, at once
+        :return: A dict of secret ID to value, missing secrets are left out
+        :rtype: dict
+        """
+        from botocore.exceptions import ClientError
+
+        if hasattr(client, "batch_get_secret_value"):
+            try:
+                batches = [
+                    secret_ids[index : index + Secrets.BATCH_SIZE]
+                    for index in range(0, len(secret_ids), Secrets.BATCH_SIZE)
+                ]
+                with ThreadPoolExecutor(max_workers=Secrets.FETCH_CONCURRENCY) as executor:
+                    responses = list(
+                        executor.map(lambda batch: client.batch_get_secret_value(SecretIdList=batch), batches)
+                    )
+
+                values = {}
+                for batch, response in zip(batches, responses):
+                    for error in response.get("Errors", []):
+                        logger.error(
+                            "(secrets) Error: Could not fetch '{}': {}".format(error["SecretId"], error["ErrorCode"])
+                        )
+
+                    # Secrets may be requested by name or ARN
+                    for secret in response.get("SecretValues", []):
+                        for secret_id in batch:
+                            if secret_id in (secret["Name"], secret["ARN"]):
+                                values[secret_id] = Secrets.get_value(secret)
+
+                return values
+
+            except ClientError as e:
+                logger.debug("(secrets) Batch retrieval failed, fetching one at a time: {}".format(e))
+
+        def get(secret_id):
+            try:
+                return Secrets.get_value(client.get_secret_value(SecretId=secret_id))
+
+            except ClientError as e:
+                if e.response["Error"]["Code"] == "ResourceNotFoundException":
+                    logger.error("(secrets) Error: No secret could be found for name '{}'".format(secret_id))
+                    return None
+
+                raise e
+
+        with ThreadPoolExecutor(max_workers=Secrets.FETCH_CONCURRENCY) as executor:
+            responses = list(executor.map(get, secret_ids))
+
+        return {secret_id: value for secret_id, value in zip(secret_ids, responses) if value is not None}
+
+    @staticmethod
+    def merge(secret_ids, values):
+        """
+        Merges the key/value pairs of secrets in the order given, later secrets
+        overriding earlier ones
+        :rtype: dict
+        """
+        secrets = {}
+        for secret_id in secret_ids:
+            if "string" not in values[secret_id]:
+                raise ValueError("Binary secret '{}' cannot be merged with others".format(secret_id))
+
+            for key, value in json.loads(values[secret_id]["string"]).items():
+                if key in secrets and secrets[key] != value:
+                    logger.warning("(secrets) '{}' overrides '{}'".format(secret_id, key))
+
+                secrets[key] = value
+
+        return secrets
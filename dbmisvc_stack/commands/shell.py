@@ -1,10 +1,10 @@
 """The shell command."""
 
-import docker
 import subprocess
 
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App
+from dbmisvc_stack.app import Stack
 
 import logging
 
@@ -18,7 +18,7 @@ class Shell(Base):
         shell = "/bin/sh" if self.options["--sh"] else "/bin/bash"
 
         # Get the docker client.
-        docker_client = docker.from_env()
+        docker_client = Stack.get_docker_client()
 
         # Determine the app.
         app = self.options["<app>"]
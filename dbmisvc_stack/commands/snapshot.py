@@ -0,0 +1,26 @@
+"""The snapshot command."""
+
+from dbmisvc_stack.commands.base import Base
+from dbmisvc_stack.app import App
+from dbmisvc_stack.app import Stack
+
+import logging
+
+logger = logging.getLogger("stack")
+
+
+class Snapshot(Base):
+    def run(self):
+
+        # Get the docker client.
+        docker_client = Stack.get_docker_client()
+
+        # Determine the app.
+        app = self.options["<app>"]
+        if App.get_snapshot_config(app) is None:
+            logger.error("({}) Database snapshots are not enabled, set 'database-snapshot' for the app".format(app))
+            exit(1)
+
+        # Capture its database
+        if not App.snapshot_data(docker_client, app):
+            exit(1)
@@ -1,9 +1,9 @@
 """The status command."""
 
-import docker
-
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App
+from dbmisvc_stack.app import Stack
+from dbmisvc_stack.docker_async import AsyncDockerClient
 
 import logging
 
@@ -14,7 +14,7 @@ class Status(Base):
     def run(self):
 
         # Get the docker client.
-        docker_client = docker.from_env()
+        docker_client = Stack.get_docker_client()
 
         # Get the app.
         app = self.options["<app>"]
@@ -27,8 +27,15 @@ class Status(Base):
 
         else:
 
-            # Get all app statuses
-            for app in App.get_apps():
-                logger.info(
-                    "({}) Status: {}".format(app, App.get_status(docker_client, app))
-                )
+            # Get all app statuses at once, if Docker is on a unix socket
+            apps = list(App.get_apps())
+            try:
+                AsyncDockerClient.get_socket_path()
+                statuses = App.get_statuses(apps, version=docker_client.api.api_version)
+
+            except ValueError as e:
+                logger.debug("(stack) {}, checking apps one at a time".format(e))
+                statuses = {app: App.get_status(docker_client, app) for app in apps}
+
+            for app in apps:
+                logger.info("({}) Status: {}".format(app, statuses[app]))
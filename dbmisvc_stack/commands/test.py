@@ -1,10 +1,14 @@
 """The test command."""
 
-import docker
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App
 from dbmisvc_stack.app import Stack
+from dbmisvc_stack import testing
 
 import logging
 
@@ -15,27 +19,106 @@ class Test(Base):
     def run(self):
 
         # Get a docker client.
-        docker_client = docker.from_env()
-
-        # Check all the build parameters.
-        apps = App.get_apps()
-        for app in apps:
-
-            # Check images.
-            if not App.check_docker_images(docker_client, app):
-                logger.error(
-                    "({}) Container image does not exist, build and"
-                    " try again...".format(app)
-                )
-                return
-
-            # Ensure it is running.
-            if not App.check_running(docker_client, app):
-                logger.error(
-                    "({}) Container is not running, ensure all containers"
-                    " are started...".format(app)
-                )
-                return
-
-        # Capture and redirect output.
-        Stack.run(["nosetests", "-s", "-v"])
+        docker_client = Stack.get_docker_client()
+
+        # Check all apps' images and containers at once.
+        problems = App.check_ready(docker_client, list(App.get_apps()))
+        for app, problem in problems.items():
+            logger.error("({}) {}".format(app, problem))
+
+        if problems:
+            return
+
+        # Run each app's own tests in its container instead.
+        if self.options.get("--apps"):
+            results = self.run_apps(docker_client, [app for app in App.get_apps() if App.get_test_command(app)])
+            if any(result.exit_code != 0 for result in results):
+                exit(1)
+
+            return
+
+        # Get the runner.
+        config = Stack.get_config("tests", required=False) or {}
+        runner = config.get("runner", "nose")
+        if runner not in testing.RUNNERS:
+            logger.error("(test) Unknown test runner '{}', use one of: {}".format(runner, ", ".join(testing.RUNNERS)))
+            exit(1)
+
+        # Find the tests, outside of the apps which test themselves.
+        root = Stack.get_stack_root()
+        apps_dir = os.path.join(root, Stack.get_config("apps-directory", required=False) or "apps")
+        modules = testing.discover(os.path.join(root, config.get("directory", "")), root, exclude=[apps_dir])
+        if not modules:
+            logger.warning("(test) No test modules were found")
+            return
+
+        # Run them in shards, one per CPU by default.
+        shards = int(self.options.get("--jobs") or config.get("shards") or os.cpu_count() or 1)
+        if not testing.run_tests(
+            modules,
+            testing.RUNNERS[runner],
+            Stack.get_state_path("tests", "shards"),
+            Stack.get_state_path("tests", "timings.json"),
+            shards,
+            root=root,
+            report=self.options.get("--report") or Stack.get_state_path("tests", "junit.xml"),
+        ):
+            exit(1)
+
+    def run_apps(self, docker_client, apps):
+        """
+        Runs the apps' tests in their containers at once, stopping the rest
+        after the first failure if '--fail-fast' is passed
+        :return: The result for each app
+        :rtype: list
+        """
+        if not apps:
+            logger.warning("(test) No apps have a 'test' command in stack.yml")
+            return []
+
+        stop = threading.Event()
+        running = set()
+        lock = threading.Lock()
+
+        # Each run records its process ID separately, so only these runs are stopped
+        runs = {app: uuid.uuid4().hex for app in apps}
+
+        def run(app):
+            with lock:
+                running.add(app)
+
+            result = App.run_tests(docker_client, app, stop, runs[app])
+            with lock:
+                running.discard(app)
+
+                # Only the first failure stops the others
+                failed_first = self.options.get("--fail-fast") and result.exit_code and not stop.is_set()
+                if failed_first:
+                    stop.set()
+                    others = set(running)
+
+            if failed_first:
+                logger.error("({}) Tests failed, stopping the others...".format(app))
+                for other in others:
+                    App.stop_tests(docker_client, other, runs[other])
+
+            return result
+
+        jobs = max(1, int(self.options.get("--jobs") or len(apps)))
+        logger.info("(test) Running tests for {} app(s), {} at a time...".format(len(apps), jobs))
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            results = list(executor.map(run, apps))
+
+        # Summarize
+        logger.info("(test) App test summary:")
+        for result in results:
+            if result.cancelled:
+                outcome = "cancelled"
+            elif result.exit_code == 0:
+                outcome = "passed"
+            else:
+                outcome = "failed with exit code {}".format(result.exit_code)
+
+            logger.info("    ({}) {} in {:.2f}s".format(result.app, outcome, result.duration))
+
+        return results
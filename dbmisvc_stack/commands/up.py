@@ -1,7 +1,5 @@
 """The up command."""
 
-import docker
-
 from dbmisvc_stack.commands.base import Base
 from dbmisvc_stack.app import App
 from dbmisvc_stack.app import Stack
@@ -15,7 +13,7 @@ class Up(Base):
     def run(self):
 
         # Get the docker client.
-        docker_client = docker.from_env()
+        docker_client = Stack.get_docker_client()
 
         # Check it.
         if not App.check(docker_client):
@@ -32,54 +32,65 @@ class Update(Base):
             )
             exit(1)
 
+        # Filter out apps without a repository URL or branch
+        for app in [app for app in apps if App.get_repo_url(app) is None or App.get_repo_branch(app) is None]:
+            logger.error(
+                "({}) No repository URL and/or branch specified...".format(app)
+            )
+            apps.remove(app)
+
+        # Skip apps whose remote branch has not moved since they were squashed
+        if not self.options.get("--force"):
+            apps = App.get_changed_apps(
+                apps,
+                jobs=self.options.get("--jobs"),
+                offline=self.options.get("--offline"),
+            )
+
+        # Check for a dry run
+        if self.options.get("--dry-run"):
+            if apps:
+                logger.info("Would update {}".format(", ".join(apps)))
+            else:
+                logger.info("All apps are up to date")
+            return
+
+        if not apps:
+            logger.info("All apps are up to date, nothing to update")
+            return
+
         logger.info("Will update {}".format(", ".join(apps)))
 
+        # Fetch all repositories at once, only the subtree operations must be serialized
+        fetched = App.fetch_all(
+            apps,
+            jobs=self.options.get("--jobs"),
+            offline=self.options.get("--offline"),
+        )
+        failed = [app for app in apps if app not in fetched]
+        apps = fetched
+
         # Iterate and update
         for app in apps:
 
-            # Get the repo URL
-            repo_url = App.get_repo_url(app)
+            # Get the branch
             branch = App.get_repo_branch(app)
-            if repo_url is None or branch is None:
-                logger.error(
-                    "({}) No repository URL and/or branch specified...".format(app)
-                )
-                continue
 
             # Determine the path to the app directory
-            apps_dir = os.path.relpath(Stack.get_config("apps-directory"))
-            subdir = os.path.join(apps_dir, app)
+            subdir = App.get_repo_dir(app)
 
             # Check for pre-checkout hook
             Stack.hook("pre-checkout", app, [os.path.realpath(subdir)])
 
-            # Build the command
-            command = [
-                "git",
-                "subtree",
-                "add",
-                "--prefix={}".format(subdir),
-                repo_url,
-                branch,
-                "--squash",
-            ]
-
-            # Remove the current subtree.
-            Stack.run(["git", "rm", "-rf", subdir])
-            Stack.run(["rm", "-rf", subdir])
-            Stack.run(
-                [
-                    "git",
-                    "commit",
-                    "-m",
-                    '"Stack op: Removing subtree {} for cloning branch {}"'.format(
-                        app, branch
-                    ),
-                ]
-            )
-
-            # Run the command.
-            Stack.run(command)
+            # Replace the current subtree in a single commit.
+            if not App.replace_subtree(app, branch):
+                logger.error("({}) Could not update to branch '{}'".format(app, branch))
+                failed.append(app)
+                continue
 
             # Check for post-checkout hook
             Stack.hook("post-checkout", app, [os.path.realpath(subdir)])
+
+        if failed:
+            logger.error("Could not update {}".format(", ".join(failed)))
+            exit(1)
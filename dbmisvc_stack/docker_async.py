@@ -0,0 +1,301 @@
+import asyncio
+import json
+import os
+import struct
+import time
+from urllib.parse import quote, urlencode
+
+import logging
+
+logger = logging.getLogger("stack")
+
+# The socket Docker listens on by default
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+# Header of each frame in a multiplexed stdout/stderr stream
+FRAME_HEADER = struct.Struct(">BxxxL")
+
+
+def run(coroutine):
+    """
+    Runs a coroutine on a new event loop and returns its result, as
+    asyncio.run does from Python 3.7
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        return loop.run_until_complete(coroutine)
+
+    finally:
+        try:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+
+        finally:
+            asyncio.set_event_loop(None)
+            loop.close()
+
+
+class AsyncDockerError(Exception):
+    """Raised when the Docker Engine API returns an error."""
+
+    def __init__(self, status, message):
+        super(AsyncDockerError, self).__init__("{} {}".format(status, message))
+        self.status = status
+        self.message = message
+
+
+class AsyncNotFound(AsyncDockerError):
+    """Raised when the Docker Engine API cannot find an object."""
+
+
+class Response(object):
+    """The status, headers and body stream of a response from Docker."""
+
+    def __init__(self, status, headers, reader, writer):
+        self.status = status
+        self.headers = headers
+        self.reader = reader
+        self.writer = writer
+
+    async def iter_chunks(self):
+        """Yields the body as it arrives, whether chunked, sized or read until closed."""
+        try:
+            if self.headers.get("transfer-encoding", "").lower() == "chunked":
+                while True:
+                    size = int((await self.reader.readline()).split(b";")[0].strip() or b"0", 16)
+                    if size == 0:
+                        await self.reader.readline()
+                        return
+
+                    chunk = await self.reader.readexactly(size)
+                    await self.reader.readexactly(2)
+                    yield chunk
+
+            elif "content-length" in self.headers:
+                length = int(self.headers["content-length"])
+                if length:
+                    yield await self.reader.readexactly(length)
+
+            else:
+                while True:
+                    chunk = await self.reader.read(65536)
+                    if not chunk:
+                        return
+                    yield chunk
+
+        finally:
+            self.close()
+
+    async def read(self):
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+    async def json(self):
+        return json.loads(await self.read() or b"null")
+
+    async def iter_lines(self):
+        """Yields each newline delimited JSON document in the body."""
+        buffer = b""
+        async for chunk in self.iter_chunks():
+            buffer += chunk
+            while b"\n" in buffer:
+                line, buffer = buffer.split(b"\n", 1)
+                if line.strip():
+                    yield json.loads(line)
+
+        if buffer.strip():
+            yield json.loads(buffer)
+
+    async def iter_frames(self):
+        """Yields the stream number and data of each frame of a multiplexed body."""
+        buffer = b""
+        async for chunk in self.iter_chunks():
+            buffer += chunk
+            while len(buffer) >= FRAME_HEADER.size:
+                stream, length = FRAME_HEADER.unpack_from(buffer)
+                if len(buffer) < FRAME_HEADER.size + length:
+                    break
+
+                yield stream, buffer[FRAME_HEADER.size : FRAME_HEADER.size + length]
+                buffer = buffer[FRAME_HEADER.size + length :]
+
+    def close(self):
+        self.writer.close()
+
+
+class AsyncDockerClient(object):
+    """
+    A minimal asyncio client for the Docker Engine API over its unix socket,
+    covering the calls the stack makes, so that many containers can be
+    queried at once on a single event loop rather than a thread each.
+    """
+
+    def __init__(self, socket_path=None, version=None):
+        """
+        :param socket_path: The path of Docker's socket, from DOCKER_HOST by default
+        :type socket_path: str
+        :param version: The API version to use, Docker's own if None
+        :type version: str
+        """
+        self.socket_path = socket_path or self.get_socket_path()
+        self.version = version
+
+    @staticmethod
+    def get_socket_path():
+        """
+        Returns the path of Docker's unix socket.
+        :raises ValueError: If DOCKER_HOST is not a unix socket
+        """
+        host = os.environ.get("DOCKER_HOST")
+        if not host:
+            return DEFAULT_SOCKET
+
+        if not host.startswith("unix://"):
+            raise ValueError("Docker at '{}' is not reachable through a unix socket".format(host))
+
+        return host[len("unix://") :]
+
+    async def request(self, method, path, params=None, body=None):
+        """
+        Sends a request to Docker and returns its response once its headers
+        have arrived. The body is read from the response.
+        :rtype: Response
+        :raises AsyncDockerError: If Docker returns an error
+        """
+        reader, writer = await asyncio.open_unix_connection(self.socket_path)
+
+        url = "/v{}{}".format(self.version, path) if self.version else path
+        if params:
+            url += "?" + urlencode({key: value for key, value in params.items() if value is not None})
+
+        data = json.dumps(body).encode("utf-8") if body is not None else b""
+        writer.write(
+            (
+                "{} {} HTTP/1.1\r\n"
+                "Host: docker\r\n"
+                "Content-Type: application/json\r\n"
+                "Content-Length: {}\r\n"
+                "Connection: close\r\n"
+                "\r\n"
+            ).format(method, url, len(data)).encode("utf-8")
+            + data
+        )
+        await writer.drain()
+
+        # Read the status and headers
+        status = int((await reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode("latin-1").strip()
+            if not line:
+                break
+
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        response = Response(status, headers, reader, writer)
+        if status >= 400:
+            body = await response.read()
+            try:
+                message = json.loads(body).get("message", "")
+            except ValueError:
+                message = body.decode("utf-8", "replace")
+
+            raise (AsyncNotFound if status == 404 else AsyncDockerError)(status, message)
+
+        return response
+
+    async def get_container(self, container):
+        """Returns the inspection of a container."""
+        return await (await self.request("GET", "/containers/{}/json".format(quote(container)))).json()
+
+    async def list_containers(self, all=False, filters=None):
+        """Returns the summaries of containers, optionally filtered."""
+        params = {"all": "1" if all else "0", "filters": json.dumps(filters) if filters else None}
+        return await (await self.request("GET", "/containers/json", params)).json()
+
+    async def exec_run(self, container, cmd, environment=None):
+        """
+        Runs a command in a container.
+        :return: The exit code and the combined stdout and stderr
+        :rtype: int, bytes
+        """
+        created = await (
+            await self.request(
+                "POST",
+                "/containers/{}/exec".format(quote(container)),
+                body={
+                    "AttachStdout": True,
+                    "AttachStderr": True,
+                    "Cmd": cmd if isinstance(cmd, list) else ["sh", "-c", cmd],
+                    "Env": ["{}={}".format(key, value) for key, value in (environment or {}).items()],
+                },
+            )
+        ).json()
+
+        response = await self.request("POST", "/exec/{}/start".format(created["Id"]), body={"Detach": False, "Tty": False})
+        output = b"".join([data async for _, data in response.iter_frames()])
+
+        inspection = await (await self.request("GET", "/exec/{}/json".format(created["Id"]))).json()
+        return inspection["ExitCode"], output
+
+    async def logs(self, container, follow=False, tail=None, since=None, tty=False):
+        """
+        Yields the stream number (1 for stdout, 2 for stderr) and data of a
+        container's logs as they arrive.
+        :param tty: Whether the container has a TTY, its logs are not multiplexed then
+        """
+        response = await self.request(
+            "GET",
+            "/containers/{}/logs".format(quote(container)),
+            {
+                "stdout": "1",
+                "stderr": "1",
+                "timestamps": "1",
+                "follow": "1" if follow else "0",
+                "tail": tail if tail is not None else "all",
+                "since": since,
+            },
+        )
+        if tty:
+            async for chunk in response.iter_chunks():
+                yield 1, chunk
+        else:
+            async for frame in response.iter_frames():
+                yield frame
+
+    async def stats(self, container, stream=True):
+        """Yields a container's resource usage statistics as they are sampled."""
+        response = await self.request(
+            "GET", "/containers/{}/stats".format(quote(container)), {"stream": "1" if stream else "0"}
+        )
+        async for stats in response.iter_lines():
+            yield stats
+
+    async def events(self, filters=None, since=None, until=None):
+        """Yields Docker's events as they happen."""
+        response = await self.request(
+            "GET",
+            "/events",
+            {"filters": json.dumps(filters) if filters else None, "since": since, "until": until},
+        )
+        async for event in response.iter_lines():
+            yield event
+
+    async def wait_healthy(self, container, timeout=60, interval=0.5):
+        """
+        Waits for a container to be running and, if it has a health check,
+        healthy.
+        :return: Whether it became healthy in time
+        :rtype: bool
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            state = (await self.get_container(container))["State"]
+            health = (state.get("Health") or {}).get("Status")
+            if state.get("Running") and health in (None, "healthy"):
+                return True
+
+            if time.monotonic() >= deadline:
+                return False
+
+            await asyncio.sleep(interval)
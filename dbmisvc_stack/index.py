@@ -0,0 +1,317 @@
+import base64
+import hashlib
+import html
+import ipaddress
+import os
+import re
+import socketserver
+import threading
+import time
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import unquote
+
+import logging
+
+logger = logging.getLogger("stack")
+
+# The file types the index serves
+DISTRIBUTION_EXTENSIONS = (".whl", ".tar.gz", ".zip", ".tar.bz2")
+
+
+def normalize(name):
+    """Normalizes a project name as described in PEP 503."""
+    return re.sub(r"[-_.]+", "-", name).lower()
+
+
+def is_loopback(host):
+    """Returns whether an address to listen on is only reachable from this machine."""
+    if host == "localhost":
+        return True
+
+    try:
+        return ipaddress.ip_address(host).is_loopback
+
+    except ValueError:
+        return False
+
+
+def get_project(filename):
+    """
+    Returns the normalized project name of a distribution's file name, or None
+    if it is not a distribution.
+    """
+    if filename.endswith(".whl"):
+        return normalize(filename.split("-", 1)[0])
+
+    for extension in DISTRIBUTION_EXTENSIONS:
+        if filename.endswith(extension) and "-" in filename:
+            return normalize(filename[: -len(extension)].rsplit("-", 1)[0])
+
+    return None
+
+
+class PackageIndex(object):
+    """
+    A PEP 503 index of the distributions in a directory. The index is kept in
+    memory and refreshed when the directory changes, hashing only files that
+    were added or modified since the last refresh.
+    """
+
+    # How recently changed a directory must be for its mtime to be distrusted
+    RACY_NS = 2 * 10**9
+
+    def __init__(self, directory):
+        """
+        :param directory: The directory the distributions are kept in
+        :type directory: str
+        """
+        self.directory = os.path.abspath(directory)
+        os.makedirs(self.directory, exist_ok=True)
+
+        # File name -> (mtime, size, project, sha256)
+        self.files = {}
+
+        self._mtime = None
+        self._lock = threading.Lock()
+
+    def refresh(self):
+        """
+        Updates the index if the directory changed since it was last read.
+        :return: Whether the directory had changed
+        :rtype: bool
+        """
+        with self._lock:
+            mtime = os.stat(self.directory).st_mtime_ns
+            if mtime == self._mtime:
+                return False
+
+            files = {}
+            with os.scandir(self.directory) as entries:
+                for entry in entries:
+                    project = get_project(entry.name)
+                    if project is None or not entry.is_file():
+                        continue
+
+                    stat = entry.stat()
+                    cached = self.files.get(entry.name)
+                    if cached and cached[:2] == (stat.st_mtime_ns, stat.st_size):
+                        files[entry.name] = cached
+                        continue
+
+                    files[entry.name] = (stat.st_mtime_ns, stat.st_size, project, self.hash_file(entry.path))
+
+            logger.debug(
+                "(index) Refreshed '{}': {} file(s), {} added or changed".format(
+                    self.directory,
+                    len(files),
+                    sum(1 for name, file in files.items() if self.files.get(name) != file),
+                )
+            )
+
+            self.files = files
+
+            # A change made within the timestamp granularity of this scan would
+            # not change the mtime, so keep checking recently changed directories
+            self._mtime = mtime if int(time.time() * 1e9) - mtime > self.RACY_NS else None
+            return True
+
+    @staticmethod
+    def hash_file(path):
+        """Returns the sha256 hex digest of a file."""
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+
+        return digest.hexdigest()
+
+    def projects(self):
+        """Returns the sorted normalized names of the projects in the index."""
+        self.refresh()
+        return sorted({file[2] for file in self.files.values()})
+
+    def project_files(self, project):
+        """
+        Returns the sorted file names and hashes of a project's distributions.
+        :rtype: list
+        """
+        self.refresh()
+        project = normalize(project)
+        return sorted((name, file[3]) for name, file in self.files.items() if file[2] == project)
+
+    def get_path(self, filename):
+        """Returns the path of a distribution in the index, or None if it is not in it."""
+        self.refresh()
+        return os.path.join(self.directory, filename) if filename in self.files else None
+
+    def add(self, filename, content):
+        """
+        Writes a distribution into the index atomically.
+        :param filename: The file name of the distribution
+        :type filename: str
+        :param content: The distribution
+        :type content: bytes
+        :return: The path of the distribution
+        :rtype: str
+        """
+        filename = os.path.basename(filename)
+        if get_project(filename) is None:
+            raise ValueError("'{}' is not a distribution".format(filename))
+
+        path = os.path.join(self.directory, filename)
+        temp_path = os.path.join(self.directory, ".{}.{}".format(filename, threading.get_ident()))
+        with open(temp_path, "wb") as f:
+            f.write(content)
+
+        os.replace(temp_path, path)
+        return path
+
+
+class IndexHandler(BaseHTTPRequestHandler):
+    """
+    Serves the simple index at '/simple/', distributions at '/packages/' and
+    accepts uploads in the form twine sends them to any other path.
+    """
+
+    # Set on the handler class built by make_server
+    index = None
+    password = None
+
+    def log_message(self, format, *args):
+        logger.debug("(index) {} {}".format(self.address_string(), format % args))
+
+    def send_body(self, body, content_type="text/html; charset=utf-8", status=200):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def send_page(self, title, links):
+        body = "<!DOCTYPE html>\n<html><head><title>{0}</title></head><body><h1>{0}</h1>\n{1}\n</body></html>\n".format(
+            html.escape(title),
+            "\n".join('<a href="{}">{}</a><br/>'.format(html.escape(href), html.escape(text)) for href, text in links),
+        )
+        self.send_body(body.encode("utf-8"))
+
+    def do_GET(self):
+        path = unquote(self.path.split("?", 1)[0])
+        parts = [part for part in path.split("/") if part]
+
+        if parts == ["simple"]:
+            self.send_page("Simple index", [("/simple/{}/".format(project), project) for project in self.index.projects()])
+
+        elif len(parts) == 2 and parts[0] == "simple":
+
+            # Point clients at the normalized name
+            project = normalize(parts[1])
+            if project != parts[1]:
+                self.send_response(301)
+                self.send_header("Location", "/simple/{}/".format(project))
+                self.end_headers()
+                return
+
+            files = self.index.project_files(project)
+            if not files:
+                self.send_error(404)
+                return
+
+            self.send_page(
+                "Links for {}".format(project),
+                [("/packages/{}#sha256={}".format(name, digest), name) for name, digest in files],
+            )
+
+        elif len(parts) == 2 and parts[0] == "packages" and self.index.get_path(parts[1]):
+            with open(self.index.get_path(parts[1]), "rb") as f:
+                self.send_body(f.read(), content_type="application/octet-stream")
+
+        else:
+            self.send_error(404)
+
+    do_HEAD = do_GET
+
+    def authorized(self):
+        if not self.password:
+            return True
+
+        scheme, _, credentials = self.headers.get("Authorization", "").partition(" ")
+        if scheme.lower() != "basic":
+            return False
+
+        try:
+            _, _, password = base64.b64decode(credentials).decode("utf-8").partition(":")
+        except ValueError:
+            return False
+
+        return password == self.password
+
+    def do_POST(self):
+        if not self.authorized():
+            self.send_response(401)
+            self.send_header("WWW-Authenticate", 'Basic realm="stack"')
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        # Parse the form
+        content = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        form = BytesParser(policy=HTTP).parsebytes(
+            "Content-Type: {}\r\n\r\n".format(self.headers.get("Content-Type", "")).encode("utf-8") + content
+        )
+        if not form.is_multipart():
+            self.send_error(400, "Expected a multipart form")
+            return
+
+        fields = {}
+        upload = None
+        for part in form.iter_parts():
+            name = part.get_param("name", header="content-disposition")
+            if part.get_filename():
+                upload = (part.get_filename(), part.get_payload(decode=True))
+            elif name:
+                fields[name] = part.get_payload(decode=True).decode("utf-8")
+
+        if fields.get(":action") != "file_upload" or upload is None:
+            self.send_error(400, "Expected a file upload")
+            return
+
+        filename, data = upload
+        digest = fields.get("sha256_digest")
+        if digest and digest != hashlib.sha256(data).hexdigest():
+            self.send_error(400, "Digest mismatch for '{}'".format(filename))
+            return
+
+        try:
+            self.index.add(filename, data)
+        except ValueError as e:
+            self.send_error(400, str(e))
+            return
+
+        logger.info("(index) Received '{}'".format(os.path.basename(filename)))
+        self.send_body(b"OK\n", content_type="text/plain")
+
+
+class IndexServer(socketserver.ThreadingMixIn, HTTPServer):
+    """Serves each request in its own thread, as http.server.ThreadingHTTPServer does from Python 3.7."""
+
+    daemon_threads = True
+
+
+def make_server(directory, host="127.0.0.1", port=3141, password=None):
+    """
+    Returns an HTTP server for the index of a directory, ready to be run with
+    serve_forever() in this or another thread.
+    :param directory: The directory the distributions are kept in
+    :param host: The address to listen on
+    :param port: The port to listen on, 0 for any free port
+    :param password: The password required for uploads, if any
+    :rtype: IndexServer
+    """
+    index = PackageIndex(directory)
+    index.refresh()
+
+    handler = type("IndexHandler", (IndexHandler,), {"index": index, "password": password})
+    return IndexServer((host, int(port)), handler)
@@ -0,0 +1,187 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import logging
+
+logger = logging.getLogger("stack")
+
+
+class PoolTimeout(Exception):
+    """Raised when no session could be leased in time."""
+
+
+class SessionPool(object):
+    """
+    Keeps up to a number of expensive sessions alive and leases them out one
+    at a time, resetting each between leases and replacing it after a number
+    of uses or when it is no longer alive.
+    """
+
+    def __init__(self, factory, size=2, max_uses=50, reset=None, alive=None, close=None):
+        """
+        :param factory: Creates a session
+        :type factory: callable
+        :param size: How many sessions may exist at once
+        :param max_uses: How many leases a session serves before it is replaced, forever if None
+        :param reset: Clears a session's state between leases
+        :type reset: callable
+        :param alive: Returns whether a session can still be used
+        :type alive: callable
+        :param close: Ends a session
+        :type close: callable
+        """
+        self.factory = factory
+        self.size = max(1, int(size))
+        self.max_uses = max_uses
+        self.reset = reset or (lambda session: None)
+        self.alive = alive or (lambda session: True)
+        self.close_session = close or (lambda session: None)
+
+        # Idle sessions and how many leases each served
+        self.idle = deque()
+        self.uses = {}
+        self.count = 0
+        self.closed = False
+        self._condition = threading.Condition()
+
+        # Seconds each lease waited for a session, and sessions created and recycled
+        self.waits = []
+        self.created = 0
+        self.recycled = 0
+
+    def acquire(self, timeout=None):
+        """
+        Leases a session, waiting for one to be released if all are in use.
+        :param timeout: Seconds to wait at most, forever if None
+        :raises PoolTimeout: If no session was released in time
+        """
+        start = time.monotonic()
+        deadline = None if timeout is None else start + timeout
+        while True:
+            with self._condition:
+                while not self.idle and self.count >= self.size and not self.closed:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeout("No session was released within {}s".format(timeout))
+
+                    self._condition.wait(remaining)
+
+                if self.closed:
+                    raise RuntimeError("The pool is closed")
+
+                session = self.idle.popleft() if self.idle else None
+                if session is None:
+                    self.count += 1
+
+            # Create or check sessions outside of the lock as either may be slow
+            if session is None:
+                try:
+                    session = self.factory()
+
+                except Exception:
+                    with self._condition:
+                        self.count -= 1
+                        self._condition.notify()
+                    raise
+
+                self.uses[id(session)] = 0
+                self.created += 1
+
+            elif not self.alive(session):
+                logger.debug("(pool) Replacing a session that is no longer alive")
+                self.discard(session)
+                continue
+
+            self.waits.append(time.monotonic() - start)
+            return session
+
+    def release(self, session, broken=False):
+        """
+        Returns a leased session to the pool, resetting it for the next lease
+        or replacing it if it is broken or was used enough.
+        """
+        self.uses[id(session)] = self.uses.get(id(session), 0) + 1
+        if not broken and self.max_uses is not None and self.uses[id(session)] >= self.max_uses:
+            logger.debug("(pool) Recycling a session after {} uses".format(self.uses[id(session)]))
+            broken = True
+
+        if not broken:
+            try:
+                self.reset(session)
+
+            except Exception as e:
+                logger.debug("(pool) Could not reset a session, replacing it: {}".format(e))
+                broken = True
+
+        if broken or self.closed:
+            self.discard(session)
+            return
+
+        with self._condition:
+            self.idle.append(session)
+            self._condition.notify()
+
+    def discard(self, session):
+        """Ends a session, making room for a new one."""
+        self.uses.pop(id(session), None)
+        try:
+            self.close_session(session)
+
+        except Exception as e:
+            logger.debug("(pool) Could not close a session: {}".format(e))
+
+        with self._condition:
+            self.count -= 1
+            self.recycled += 1
+            self._condition.notify()
+
+    @contextmanager
+    def lease(self, timeout=None):
+        """
+        Leases a session for the duration of a with block. Sessions that
+        are no longer alive after an error are replaced.
+        """
+        session = self.acquire(timeout)
+        try:
+            yield session
+
+        except BaseException:
+            self.release(session, broken=not self.alive(session))
+            raise
+
+        self.release(session)
+
+    def stats(self):
+        """
+        Returns how many leases were made, how long they waited on average
+        and at most, and how many sessions were created and recycled.
+        :rtype: dict
+        """
+        waits = list(self.waits)
+        return {
+            "leases": len(waits),
+            "mean_wait": sum(waits) / len(waits) if waits else 0.0,
+            "max_wait": max(waits) if waits else 0.0,
+            "created": self.created,
+            "recycled": self.recycled,
+        }
+
+    def report(self):
+        stats = self.stats()
+        logger.info(
+            "(pool) {leases} lease(s), waited {mean_wait:.3f}s on average and {max_wait:.3f}s at most,"
+            " {created} session(s) created and {recycled} recycled".format(**stats)
+        )
+
+    def close(self):
+        """Ends every idle session, and leased ones as they are released."""
+        with self._condition:
+            self.closed = True
+            idle = list(self.idle)
+            self.idle.clear()
+            self._condition.notify_all()
+
+        for session in idle:
+            self.discard(session)
@@ -0,0 +1,111 @@
+import socket
+import threading
+import time
+
+from docker.utils.socket import STDOUT, frames_iter
+
+import logging
+
+logger = logging.getLogger("stack")
+
+
+class Progress(object):
+    """
+    Counts bytes moved and logs the total and throughput every few seconds
+    and when done.
+    """
+
+    # Seconds between progress reports
+    INTERVAL = 2.0
+
+    def __init__(self, label):
+        self.label = label
+        self.bytes = 0
+        self.start = self.reported = time.monotonic()
+        self._lock = threading.Lock()
+
+    def update(self, count):
+        with self._lock:
+            self.bytes += count
+            now = time.monotonic()
+            if now - self.reported >= self.INTERVAL:
+                self.reported = now
+                self.log()
+
+    def log(self, done=False):
+        elapsed = max(time.monotonic() - self.start, 1e-6)
+        logger.info(
+            "{} {} {:.1f} MB in {:.1f}s ({:.1f} MB/s)".format(
+                self.label,
+                "transferred" if done else "...",
+                self.bytes / 1e6,
+                elapsed,
+                self.bytes / 1e6 / elapsed,
+            )
+        )
+
+
+def stream_exec(docker_client, container, command, environment=None, source=None, sink=None, label="(stream)"):
+    """
+    Runs a command in a container, streaming a file to its stdin and/or its
+    stdout to a file through the exec socket, without holding either in memory.
+    :param docker_client: The Docker client instance
+    :param container: The container
+    :type container: docker.models.containers.Container
+    :param command: The command
+    :type command: list
+    :param environment: Environment variables for the command
+    :type environment: dict
+    :param source: A binary file to send to the command's stdin
+    :param sink: A binary file to write the command's stdout to
+    :param label: The prefix of progress reports
+    :return: The exit code of the command and its stderr
+    :rtype: int, str
+    """
+    api = docker_client.api
+    exec_id = api.exec_create(
+        container.id, command, stdin=source is not None, stdout=True, stderr=True, environment=environment
+    )["Id"]
+    sock = api.exec_start(exec_id, socket=True)
+
+    # The raw socket is needed to close our end for writing once stdin is sent
+    raw = getattr(sock, "_sock", sock)
+    progress = Progress(label)
+    errors = []
+
+    def feed():
+        try:
+            for chunk in iter(lambda: source.read(1 << 20), b""):
+                raw.sendall(chunk)
+                progress.update(len(chunk))
+
+        except OSError as e:
+            errors.append("Could not send input: {}".format(e).encode("utf-8"))
+
+        finally:
+            try:
+                raw.shutdown(socket.SHUT_WR)
+            except OSError:
+                pass
+
+    # Send stdin while reading output so neither side blocks
+    feeder = None
+    if source is not None:
+        feeder = threading.Thread(target=feed, daemon=True)
+        feeder.start()
+
+    try:
+        for stream, data in frames_iter(sock, tty=False):
+            if stream == STDOUT and sink is not None:
+                sink.write(data)
+                progress.update(len(data))
+            elif stream != STDOUT:
+                errors.append(data)
+
+    finally:
+        if feeder is not None:
+            feeder.join()
+        sock.close()
+
+    progress.log(done=True)
+    return api.exec_inspect(exec_id)["ExitCode"], b"".join(errors).decode("utf-8", "replace").strip()
@@ -0,0 +1,325 @@
+import json
+import os
+import subprocess
+import time
+from urllib.parse import quote
+
+import logging
+
+logger = logging.getLogger("stack")
+
+
+class SubtreeSplit:
+    """
+    Splits the history of a subtree prefix out of the stack's history the same
+    way 'git subtree split' does, but persists the mapping of stack commits to
+    split commits under the git directory. Later splits start from the commits
+    already split and only process commits that are new since then.
+    """
+
+    # Bump this if the format of the cache file changes
+    CACHE_VERSION = 1
+
+    # How many previously split commits to keep as starting points
+    MAX_TIPS = 20
+
+    def __init__(self, prefix):
+        """
+        :param prefix: The path of the subtree, relative to the stack root
+        :type prefix: str
+        """
+        self.prefix = os.path.normpath(prefix)
+
+        # Stack commit -> split commit
+        self.map = {}
+
+        # Stack commits without the prefix
+        self.notree = set()
+
+        # Previously split stack commits, everything reachable from these is cached
+        self.tips = []
+
+        # The number of commits processed and created by the last split
+        self.processed = 0
+        self.created = 0
+
+        self._cat_file = None
+        self._trees = {}
+        self._latest_new = None
+
+        # Place the cache in the git directory, keyed by prefix
+        self.cache_path = self._git(
+            "rev-parse", "--git-path", "stack/subtree-cache/{}.json".format(quote(self.prefix, safe=""))
+        )
+
+    def _git(self, *args, check=True):
+        """Runs git and returns its stripped stdout."""
+        process = subprocess.run(["git"] + list(args), stdout=subprocess.PIPE, universal_newlines=True)
+        if check and process.returncode != 0:
+            raise subprocess.CalledProcessError(process.returncode, ["git"] + list(args))
+
+        return process.stdout.strip()
+
+    def _object(self, name):
+        """
+        Resolves an object name to its id through a single long-running
+        'git cat-file' process, returning None if it does not exist.
+        """
+        if self._cat_file is None:
+            self._cat_file = subprocess.Popen(
+                ["git", "cat-file", "--batch-check=%(objectname) %(objecttype)"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+                bufsize=1,
+            )
+
+        self._cat_file.stdin.write(name + "\n")
+        self._cat_file.stdin.flush()
+        fields = self._cat_file.stdout.readline().split()
+
+        return fields if len(fields) == 2 and fields[1] != "missing" else None
+
+    def _toptree(self, commit):
+        """Returns the root tree of a commit."""
+        if commit not in self._trees:
+            self._trees[commit] = self._object("{}^{{tree}}".format(commit))[0]
+
+        return self._trees[commit]
+
+    def _subtree(self, commit):
+        """Returns the tree of the prefix in a commit, or None if it has none."""
+        obj = self._object("{}:{}".format(commit, self.prefix))
+
+        # Submodules are ignored
+        return obj[0] if obj is not None and obj[1] == "tree" else None
+
+    def load(self):
+        """Loads the cache from disk, dropping starting points that no longer exist."""
+        try:
+            with open(self.cache_path, "r") as f:
+                cache = json.load(f)
+
+        except (IOError, ValueError):
+            return
+
+        if cache.get("version") != self.CACHE_VERSION or cache.get("prefix") != self.prefix:
+            logger.debug("(stack) Ignoring incompatible subtree split cache '{}'".format(self.cache_path))
+            return
+
+        self.map = cache["map"]
+        self.notree = set(cache["notree"])
+        self.tips = [tip for tip in cache["tips"] if self._object(tip) is not None]
+
+    def save(self):
+        """Writes the cache to disk atomically."""
+        os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+        cache = {
+            "version": self.CACHE_VERSION,
+            "prefix": self.prefix,
+            "map": self.map,
+            "notree": sorted(self.notree),
+            "tips": self.tips[-self.MAX_TIPS :],
+        }
+
+        path = "{}.{}".format(self.cache_path, os.getpid())
+        with open(path, "w") as f:
+            json.dump(cache, f)
+
+        os.replace(path, self.cache_path)
+
+    def _find_existing_splits(self, rev):
+        """
+        Reads the squash and rejoin trailers of commits that are new since
+        the last split and returns the commits to exclude from the walk.
+        """
+        unrevs = []
+        output = self._git(
+            "log",
+            "--grep=^git-subtree-dir: {}/*$".format(self.prefix),
+            "--no-show-signature",
+            "--pretty=format:START %H%n%s%n%n%b%nEND%n",
+            rev,
+            "--not",
+            *self.tips
+        )
+
+        squash = main = sub = None
+        for line in output.splitlines():
+            fields = line.split()
+            if not fields:
+                continue
+
+            if fields[0] == "START":
+                squash = fields[1]
+            elif fields[0] == "git-subtree-mainline:" and len(fields) > 1:
+                main = fields[1]
+            elif fields[0] == "git-subtree-split:" and len(fields) > 1:
+                sub = self._git("rev-parse", "--verify", "--quiet", "{}^{{commit}}".format(fields[1]), check=False)
+                if not sub:
+                    raise ValueError("Could not find split commit '{}' from commit '{}'".format(fields[1], squash))
+            elif fields[0] == "END":
+
+                # Squash commits refer to a subtree
+                if sub and not main:
+                    self.map[squash] = sub
+
+                # Rejoin commits refer to a previous split
+                if sub and main:
+                    self.map[main] = sub
+                    self.map[sub] = sub
+                    unrevs.extend(
+                        "^{}^".format(commit) for commit in (main, sub) if self._object("{}^".format(commit))
+                    )
+
+                main = sub = None
+
+        return unrevs
+
+    def _copy_commit(self, rev, tree, parents):
+        """Creates a commit with the tree and parents given and the metadata of another commit."""
+        headers, _, message = subprocess.check_output(["git", "cat-file", "commit", rev]).partition(b"\n\n")
+
+        # Keep the original author and committer so split commits are reproducible
+        env = dict(os.environ)
+        for line in headers.decode("utf-8", "surrogateescape").splitlines():
+            role, _, value = line.partition(" ")
+            if role in ("author", "committer"):
+                identity, _, date = value.rpartition("> ")
+                name, _, email = identity.partition(" <")
+                env["GIT_{}_NAME".format(role.upper())] = name
+                env["GIT_{}_EMAIL".format(role.upper())] = email
+                env["GIT_{}_DATE".format(role.upper())] = date
+
+        command = ["git", "commit-tree", tree]
+        for parent in parents:
+            command.extend(["-p", parent])
+
+        self.created += 1
+        return subprocess.check_output(command, input=message, env=env).decode("utf-8").strip()
+
+    def _copy_or_skip(self, rev, tree, newparents):
+        """Reuses an identical parent in place of the commit, or copies it."""
+        identical = nonidentical = None
+        gotparents = []
+        copycommit = False
+        for parent in newparents:
+            if self._toptree(parent) == tree:
+
+                # An identical parent could be used in place of this commit
+                if identical:
+                    mergebase = self._git("merge-base", identical, parent, check=False)
+                    if identical == mergebase:
+                        identical = parent
+                    elif parent != mergebase:
+                        copycommit = True
+                else:
+                    identical = parent
+
+            else:
+                nonidentical = parent
+
+            # Sometimes several parents map to the same split commit
+            if parent not in gotparents:
+                gotparents.append(parent)
+
+        # Preserve history along the other branch
+        if identical and nonidentical:
+            if int(self._git("rev-list", "--count", "{}..{}".format(identical, nonidentical))):
+                copycommit = True
+
+        if identical and not copycommit:
+            return identical
+
+        commit = self._copy_commit(rev, tree, gotparents)
+        self._trees[commit] = tree
+        return commit
+
+    def _process(self, rev, parents):
+        """Splits a commit, first splitting any parents that were not walked."""
+        pending = [(rev, parents)]
+        pending_commits = {rev}
+        while pending:
+            commit, commit_parents = pending[-1]
+            if commit in self.map:
+                pending.pop()
+                pending_commits.discard(commit)
+                continue
+
+            # Commits outside of the walk need their parents looked up
+            if commit_parents is None:
+                commit_parents = self._git("rev-parse", "{}^@".format(commit)).split()
+                pending[-1] = (commit, commit_parents)
+
+            missed = [
+                parent
+                for parent in commit_parents
+                if parent not in self.map and parent not in self.notree and parent not in pending_commits
+            ]
+            if missed:
+                pending.extend((parent, None) for parent in reversed(missed))
+                pending_commits.update(missed)
+                continue
+
+            pending.pop()
+            pending_commits.discard(commit)
+            self.processed += 1
+            newparents = [self.map[parent] for parent in commit_parents if parent in self.map]
+
+            # Mainline commits without the prefix
+            tree = self._subtree(commit)
+            if tree is None:
+                self.notree.add(commit)
+                if newparents:
+                    self.map[commit] = commit
+                continue
+
+            self.map[commit] = self._copy_or_skip(commit, tree, newparents)
+            self._latest_new = self.map[commit]
+
+    def split(self, rev="HEAD"):
+        """
+        Splits the prefix's history up to the given commit.
+        :param rev: The stack commit to split
+        :type rev: str
+        :return: The split commit
+        :rtype: str
+        """
+        start = time.monotonic()
+        self.processed = self.created = 0
+        self.load()
+
+        try:
+            rev = self._git("rev-parse", "--verify", "{}^{{commit}}".format(rev))
+            unrevs = self._find_existing_splits(rev)
+
+            # Only walk commits that were not split before
+            walk = self._git(
+                "rev-list", "--topo-order", "--reverse", "--parents", rev, *(unrevs + ["^" + tip for tip in self.tips])
+            )
+            for line in walk.splitlines():
+                commit, *parents = line.split()
+                self._process(commit, parents)
+
+        finally:
+            if self._cat_file is not None:
+                self._cat_file.stdin.close()
+                self._cat_file.wait()
+                self._cat_file = None
+
+        # Determine the result
+        split = self.map.get(rev) if rev not in self.notree else self._latest_new
+        if split is None:
+            raise ValueError("No new revisions were found for '{}'".format(self.prefix))
+
+        if rev not in self.tips:
+            self.tips.append(rev)
+        self.save()
+
+        logger.debug(
+            "(stack) Split '{}' at {} into {}: processed {} commit(s), created {} in {:.2f}s".format(
+                self.prefix, rev[:7], split[:7], self.processed, self.created, time.monotonic() - start
+            )
+        )
+
+        return split
@@ -0,0 +1,254 @@
+import heapq
+import json
+import os
+import re
+import subprocess
+import sys
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+
+import logging
+
+logger = logging.getLogger("stack")
+
+# Test modules, matched as nose matches them by default
+TEST_MODULE = re.compile(r"(?:^|[_.-])[Tt]est\w*\.py$")
+
+# Directories never searched for tests
+IGNORED_DIRECTORIES = {"__pycache__", "node_modules", "venv"}
+
+# The commands that run a shard of modules, writing a JUnit report
+RUNNERS = {
+    "nose": ["nosetests", "-v", "--with-xunit", "--xunit-file={report}"],
+    "pytest": [sys.executable, "-m", "pytest", "-v", "--junitxml={report}"],
+}
+
+
+def discover(directory, root, exclude=()):
+    """
+    Returns the test modules under a directory.
+    :param directory: The directory to search
+    :param root: The directory the returned paths are relative to
+    :param exclude: Directories not to search
+    :return: The sorted paths of the test modules
+    :rtype: list
+    """
+    exclude = {os.path.abspath(path) for path in exclude}
+    modules = []
+    for current, directories, files in os.walk(directory):
+        directories[:] = [
+            name
+            for name in directories
+            if not name.startswith(".")
+            and name not in IGNORED_DIRECTORIES
+            and os.path.abspath(os.path.join(current, name)) not in exclude
+        ]
+        modules.extend(os.path.relpath(os.path.join(current, name), root) for name in files if TEST_MODULE.search(name))
+
+    return sorted(modules)
+
+
+def load_timings(path):
+    """Returns the recorded seconds each test module took to run."""
+    try:
+        with open(path, "r") as f:
+            return json.load(f)
+
+    except (IOError, ValueError):
+        return {}
+
+
+def save_timings(path, timings):
+    with open(path + ".tmp", "w") as f:
+        json.dump(timings, f, indent=2, sort_keys=True)
+
+    os.replace(path + ".tmp", path)
+
+
+def partition(modules, timings, shards):
+    """
+    Splits modules into shards of about the same total duration, placing the
+    longest modules first, each in the shard with the least time so far.
+    Modules without a recorded duration count as the average one.
+    :param modules: The test modules
+    :param timings: The recorded seconds of each module
+    :param shards: How many shards to make at most
+    :return: The modules of each shard, none empty
+    :rtype: list
+    """
+    known = [timings[module] for module in modules if module in timings]
+    default = sum(known) / len(known) if known else 1.0
+
+    heap = [(0.0, index, []) for index in range(max(1, min(shards, len(modules))))]
+    for module in sorted(modules, key=lambda module: (-timings.get(module, default), module)):
+        total, index, shard = heapq.heappop(heap)
+        shard.append(module)
+        heapq.heappush(heap, (total + timings.get(module, default), index, shard))
+
+    return [shard for _, _, shard in sorted(heap, key=lambda item: item[1]) if shard]
+
+
+def get_module(testcase, modules):
+    """
+    Returns the module a JUnit test case ran from, by its file if the runner
+    recorded it, otherwise by the longest module path its class name starts with.
+    :param testcase: The test case element
+    :param modules: A dict of dotted module path -> module
+    :return: The module, or None if it is not known
+    """
+    if testcase.get("file") and testcase.get("file") in modules.values():
+        return testcase.get("file")
+
+    parts = testcase.get("classname", "").split(".")
+    for index in range(len(parts), 0, -1):
+        module = modules.get(".".join(parts[:index]))
+        if module:
+            return module
+
+    return None
+
+
+def get_dotted_modules(modules):
+    """
+    Returns the modules keyed by each dotted path they may be reported under,
+    as a runner imports them from one of their parent directories. Paths
+    shared by several modules are left out.
+    :rtype: dict
+    """
+    dotted = {}
+    for module in modules:
+        parts = os.path.splitext(module)[0].split(os.sep)
+        for index in range(len(parts)):
+            key = ".".join(parts[index:])
+            dotted[key] = module if dotted.get(key, module) == module else None
+
+    return dotted
+
+
+def merge_reports(paths, output):
+    """
+    Merges the JUnit reports of shards into one.
+    :param paths: The reports, missing ones are skipped
+    :param output: The path to write the merged report to
+    :return: The merged report's test cases
+    :rtype: list
+    """
+    merged = ElementTree.Element("testsuites")
+    totals = {"tests": 0, "failures": 0, "errors": 0, "skipped": 0, "time": 0.0}
+    for path in paths:
+        try:
+            root = ElementTree.parse(path).getroot()
+
+        except (IOError, ElementTree.ParseError) as e:
+            logger.debug("(test) Could not read report '{}': {}".format(path, e))
+            continue
+
+        for suite in [root] if root.tag == "testsuite" else root.findall("testsuite"):
+            merged.append(suite)
+            for key in ("tests", "failures", "errors"):
+                totals[key] += int(suite.get(key, 0))
+
+            # nose calls them 'skip'
+            totals["skipped"] += int(suite.get("skipped", suite.get("skip", 0)))
+            totals["time"] += sum(float(testcase.get("time", 0)) for testcase in suite.iter("testcase"))
+
+    for key, value in totals.items():
+        merged.set(key, "{:.3f}".format(value) if key == "time" else str(value))
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    ElementTree.ElementTree(merged).write(output, encoding="utf-8", xml_declaration=True)
+
+    return list(merged.iter("testcase"))
+
+
+def run_shard(command, modules, report, log, cwd=None):
+    """
+    Runs a shard of test modules, writing its output to a file.
+    :return: The exit code of the runner and how long it took
+    :rtype: int, float
+    """
+    start = time.monotonic()
+    command = [argument.format(report=report) for argument in command] + modules
+    with open(log, "w") as f:
+        try:
+            exit_code = subprocess.call(command, stdout=f, stderr=subprocess.STDOUT, cwd=cwd)
+
+        except OSError as e:
+            f.write("Could not run '{}': {}\n".format(command[0], e))
+            exit_code = 127
+
+    return exit_code, time.monotonic() - start
+
+
+def run_tests(modules, command, directory, timings_path, shards, root=None, report=None, slowest=10):
+    """
+    Runs test modules in shards at once, balanced by their recorded durations,
+    and merges their reports.
+    :param modules: The test modules
+    :type modules: list
+    :param command: The runner's command, with '{report}' where its JUnit report goes
+    :type command: list
+    :param directory: Where shard reports and output, and the merged report, are written
+    :param timings_path: The file module durations are recorded in
+    :param shards: How many shards to run at once
+    :param root: The directory to run the shards in
+    :param report: The path of the merged JUnit report, 'junit.xml' in the directory by default
+    :param slowest: How many of the slowest tests to report
+    :return: Whether every shard passed
+    :rtype: bool
+    """
+    timings = load_timings(timings_path)
+    parts = partition(modules, timings, shards)
+    os.makedirs(directory, exist_ok=True)
+
+    logger.info("(test) Running {} module(s) in {} shard(s)...".format(len(modules), len(parts)))
+    reports = [os.path.join(directory, "shard-{}.xml".format(index + 1)) for index in range(len(parts))]
+    logs = [os.path.join(directory, "shard-{}.log".format(index + 1)) for index in range(len(parts))]
+    for path in reports:
+        if os.path.exists(path):
+            os.remove(path)
+
+    with ThreadPoolExecutor(max_workers=len(parts)) as executor:
+        results = list(executor.map(lambda args: run_shard(command, *args, cwd=root), zip(parts, reports, logs)))
+
+    passed = True
+    for index, (exit_code, duration) in enumerate(results):
+        level = logging.INFO if exit_code == 0 else logging.ERROR
+        logger.log(
+            level,
+            "(test) Shard {}/{}: {} module(s) {} in {:.2f}s".format(
+                index + 1, len(parts), len(parts[index]), "passed" if exit_code == 0 else "failed", duration
+            ),
+        )
+
+        # Show the output of failed shards
+        if exit_code != 0:
+            passed = False
+            with open(logs[index], "r") as f:
+                logger.error(f.read().rstrip())
+
+    # Merge reports and record how long each module took
+    report = report or os.path.join(directory, "junit.xml")
+    testcases = merge_reports(reports, report)
+    dotted = get_dotted_modules(modules)
+    durations = {}
+    for testcase in testcases:
+        module = get_module(testcase, dotted)
+        if module:
+            durations[module] = durations.get(module, 0.0) + float(testcase.get("time", 0))
+
+    timings.update(durations)
+    save_timings(timings_path, timings)
+
+    if testcases and slowest:
+        logger.info("(test) Slowest tests:")
+        for testcase in sorted(testcases, key=lambda testcase: -float(testcase.get("time", 0)))[:slowest]:
+            logger.info(
+                "(test)   {:>8.2f}s {}.{}".format(
+                    float(testcase.get("time", 0)), testcase.get("classname"), testcase.get("name")
+                )
+            )
+
+    logger.info("(test) Report written to '{}'".format(report))
+    return passed
@@ -0,0 +1,229 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+import logging
+
+logger = logging.getLogger("stack")
+
+
+class PollingWatcher(object):
+    """
+    Watches directories for changes by comparing the modification times and
+    sizes of their files between polls.
+    """
+
+    # Seconds between polls
+    INTERVAL = 1.0
+
+    def __init__(self, paths, ignore=None):
+        """
+        :param paths: The directories to watch
+        :type paths: list
+        :param ignore: Returns whether a file or directory name should be ignored
+        :type ignore: callable
+        """
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.ignore = ignore or (lambda name: False)
+        self.snapshots = {path: self.snapshot(path) for path in self.paths}
+
+    def snapshot(self, path):
+        """Returns the modification time and size of each file under a directory."""
+        snapshot = {}
+        for root, directories, files in os.walk(path):
+            directories[:] = [directory for directory in directories if not self.ignore(directory)]
+            for name in files:
+                if self.ignore(name):
+                    continue
+
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                    snapshot[os.path.join(root, name)] = (stat.st_mtime_ns, stat.st_size)
+
+                except OSError:
+                    continue
+
+        return snapshot
+
+    def wait(self, timeout=None):
+        """
+        Waits for files to change.
+        :param timeout: Seconds to wait at most, forever if None
+        :return: The watched directories with changes
+        :rtype: set
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            changed = set()
+            for path in self.paths:
+                snapshot = self.snapshot(path)
+                if snapshot != self.snapshots[path]:
+                    self.snapshots[path] = snapshot
+                    changed.add(path)
+
+            if changed or (deadline is not None and time.monotonic() >= deadline):
+                return changed
+
+            interval = self.INTERVAL if deadline is None else min(self.INTERVAL, max(0, deadline - time.monotonic()))
+            time.sleep(interval)
+
+    def close(self):
+        pass
+
+
+class InotifyWatcher(object):
+    """
+    Watches directories for changes with Linux's inotify, through ctypes so
+    no extra dependencies are needed.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_Q_OVERFLOW = 0x00004000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0o4000
+    IN_CLOEXEC = 0o2000000
+
+    MASK = IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+    # struct inotify_event: wd, mask, cookie, len, followed by the name
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self, paths, ignore=None):
+        """
+        :param paths: The directories to watch
+        :type paths: list
+        :param ignore: Returns whether a file or directory name should be ignored
+        :type ignore: callable
+        :raises OSError: If inotify is not available
+        """
+        self.paths = [os.path.abspath(path) for path in paths]
+        self.ignore = ignore or (lambda name: False)
+
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError("inotify is not available")
+
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "Could not initialize inotify")
+
+        # Watch descriptor -> (directory, watched path it is under)
+        self.watches = {}
+        for path in self.paths:
+            self.add_watches(path, path)
+
+    def add_watches(self, directory, root):
+        """Watches a directory and all of its subdirectories."""
+        for current, directories, _ in os.walk(directory):
+            directories[:] = [name for name in directories if not self.ignore(name)]
+
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(current), self.MASK)
+            if wd < 0:
+                logger.debug("(watch) Could not watch '{}': {}".format(current, os.strerror(ctypes.get_errno())))
+                continue
+
+            self.watches[wd] = (current, root)
+
+    def read_events(self):
+        """Reads pending events and returns the watched directories with changes."""
+        changed = set()
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return changed
+
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+            name = os.fsdecode(data[offset + self.EVENT.size : offset + self.EVENT.size + length].rstrip(b"\0"))
+            offset += self.EVENT.size + length
+
+            # Events were dropped, assume everything changed
+            if mask & self.IN_Q_OVERFLOW:
+                changed.update(self.paths)
+                continue
+
+            if wd not in self.watches or (name and self.ignore(name)):
+                continue
+
+            directory, root = self.watches[wd]
+            changed.add(root)
+
+            # Watch new directories too
+            if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                self.add_watches(os.path.join(directory, name), root)
+
+            if mask & self.IN_DELETE_SELF:
+                del self.watches[wd]
+
+        return changed
+
+    def wait(self, timeout=None):
+        """
+        Waits for files to change.
+        :param timeout: Seconds to wait at most, forever if None
+        :return: The watched directories with changes
+        :rtype: set
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0, deadline - time.monotonic())
+            readable, _, _ = select.select([self.fd], [], [], remaining)
+            if readable:
+                changed = self.read_events()
+                if changed:
+                    return changed
+
+            if deadline is not None and time.monotonic() >= deadline:
+                return set()
+
+    def close(self):
+        os.close(self.fd)
+
+
+def make_watcher(paths, ignore=None, polling=False):
+    """
+    Returns an inotify watcher for the directories if inotify is available,
+    otherwise a polling watcher.
+    """
+    if not polling:
+        try:
+            return InotifyWatcher(paths, ignore)
+
+        except (OSError, AttributeError, TypeError) as e:
+            logger.debug("(watch) inotify is not available, polling instead: {}".format(e))
+
+    return PollingWatcher(paths, ignore)
+
+
+def wait_debounced(watcher, quiet=0.5, timeout=None):
+    """
+    Waits for changes, then keeps collecting them until none were made for a
+    moment so a burst of edits is handled once.
+    :param watcher: The watcher
+    :param quiet: Seconds without changes that end a burst
+    :param timeout: Seconds to wait for the first change, forever if None
+    :return: The watched directories with changes, and when the first was seen
+    :rtype: set, float
+    """
+    changed = watcher.wait(timeout)
+    first = time.monotonic()
+    if not changed:
+        return changed, first
+
+    while True:
+        more = watcher.wait(quiet)
+        if not more:
+            return changed, first
+
+        changed.update(more)
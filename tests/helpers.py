@@ -0,0 +1,160 @@
+"""Shared fixtures for tests that need a stack on disk."""
+
+
+import os
+import shutil
+import subprocess
+import tempfile
+from unittest import TestCase
+
+import yaml
+
+from dbmisvc_stack.app import Stack
+
+
+class StackTestCase(TestCase):
+    """Runs each test from a temporary stack root with its own git identity."""
+
+    GIT_ENV = {
+        "GIT_AUTHOR_NAME": "Stack Test",
+        "GIT_AUTHOR_EMAIL": "stack@example.com",
+        "GIT_COMMITTER_NAME": "Stack Test",
+        "GIT_COMMITTER_EMAIL": "stack@example.com",
+        "GIT_CONFIG_NOSYSTEM": "1",
+    }
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.environ = dict(os.environ)
+        self.tmp = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmp, "stack")
+        os.makedirs(os.path.join(self.root, "hooks"))
+        os.environ.update(self.GIT_ENV)
+        os.environ["HOME"] = self.tmp
+        os.chdir(self.root)
+        Stack.hook_results = []
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        os.environ.clear()
+        os.environ.update(self.environ)
+        shutil.rmtree(self.tmp)
+        Stack.hook_results = []
+
+    def write_stack(self, **config):
+        config.setdefault("name", "test")
+        config.setdefault("apps-directory", "apps")
+        with open(os.path.join(self.root, "stack.yml"), "w") as f:
+            yaml.dump({"stack": config}, f)
+
+    def write_compose(self, services):
+        with open(os.path.join(self.root, "docker-compose.yml"), "w") as f:
+            yaml.dump({"version": "2.1", "services": services}, f)
+
+    def git(self, *args, cwd=None):
+        return subprocess.run(
+            ["git"] + list(args),
+            cwd=cwd or self.root,
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout.strip()
+
+    def init_stack_repo(self):
+        """Commits the current stack root as the initial commit of a new repository."""
+        self.git("init", "--quiet", "--initial-branch=main")
+        self.git("add", "-A")
+        self.git("commit", "--quiet", "-m", "Initial stack")
+
+    def make_upstream(self, name, files, branch="main"):
+        """Creates a bare repository with a single commit of the given files."""
+        work = os.path.join(self.tmp, "work", name)
+        os.makedirs(work)
+        self.git("init", "--quiet", "--initial-branch={}".format(branch), cwd=work)
+        self.commit_upstream(name, files)
+
+        bare = os.path.join(self.tmp, "remotes", "{}.git".format(name))
+        self.git("clone", "--quiet", "--bare", work, bare, cwd=self.tmp)
+        self.git("remote", "add", "origin", bare, cwd=work)
+        return bare
+
+    def commit_upstream(self, name, files, push=False):
+        """Commits files to an upstream repository's work tree, optionally pushing them."""
+        work = os.path.join(self.tmp, "work", name)
+        for path, content in files.items():
+            with open(os.path.join(work, path), "w") as f:
+                f.write(content)
+
+        self.git("add", "-A", cwd=work)
+        self.git("commit", "--quiet", "-m", "Update {}".format(", ".join(sorted(files))), cwd=work)
+        if push:
+            self.git("push", "--quiet", "origin", "HEAD", cwd=work)
+
+        return self.git("rev-parse", "HEAD", cwd=work)
+
+
+class FakeContainer(object):
+    """Records the archives and commands sent to a container."""
+
+    def __init__(self, status="running", exit_code=0, outputs=None, name=None, health=None):
+        self.name = name
+        self.status = status
+        self.health = health
+        self.exit_code = exit_code
+        self.outputs = outputs or {}
+        self.archives = []
+        self.commands = []
+
+    @property
+    def attrs(self):
+        state = {"Running": self.status == "running"}
+        if self.health:
+            state["Health"] = {"Status": self.health}
+
+        return {"State": state}
+
+    def put_archive(self, path, data):
+        self.archives.append((path, data))
+        return True
+
+    def exec_run(self, cmd, environment=None):
+        self.commands.append((cmd, environment))
+        return self.exit_code, self.outputs.get(len(self.commands), b"")
+
+
+class FakeContainers(object):
+    def __init__(self, containers):
+        self.containers = containers
+
+    def get(self, name):
+        return self.containers[name]
+
+    def list(self, all=False, filters=None):
+        return [container for container in self.containers.values() if all or container.status == "running"]
+
+
+class FakeImage(object):
+    def __init__(self, tags, digests=()):
+        self.tags = tags
+        self.attrs = {"RepoDigests": list(digests)}
+
+
+class FakeImages(object):
+    def __init__(self, references):
+        self.images = [
+            FakeImage([], [reference]) if "@" in reference else FakeImage([reference]) for reference in references
+        ]
+
+    def list(self):
+        return self.images
+
+
+class FakeDockerClient(object):
+    """Stands in for a Docker client with containers looked up by name."""
+
+    def __init__(self, containers, images=()):
+        for name, container in containers.items():
+            container.name = container.name or name
+
+        self.containers = FakeContainers(containers)
+        self.images = FakeImages(images)
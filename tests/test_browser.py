@@ -0,0 +1,204 @@
+"""Tests for the browser helpers that do not need a running browser."""
+
+
+import os
+import shutil
+import stat
+import tempfile
+import unittest
+from unittest import TestCase, mock
+
+try:
+    from dbmisvc_stack import browser
+except ImportError:
+    browser = None
+
+
+def make_browser(driver):
+    """Returns browser extensions driving a fake driver, without starting a browser."""
+    fake = browser.BrowserExtensions.__new__(browser.BrowserExtensions)
+    fake.driver = driver
+    return fake
+
+
+class FakeDriver(object):
+    """Follows redirects and records what was cleared on which page."""
+
+    def __init__(self, redirects=None):
+        self.current_url = "about:blank"
+        self.redirects = redirects or {}
+        self.cleared = []
+
+    def get(self, url):
+        self.current_url = self.redirects.get(url, url)
+
+    def execute_script(self, script, *args):
+        self.cleared.append(("storage", browser.get_origin(self.current_url)))
+
+    def delete_all_cookies(self):
+        self.cleared.append(("cookies", browser.get_origin(self.current_url)))
+
+
+class FakeChromeDriver(FakeDriver):
+    def execute_cdp_cmd(self, command, parameters):
+        self.cleared.append((command, parameters.get("origin")))
+
+
+@unittest.skipIf(browser is None, "splinter is not installed")
+class TestOrigins(TestCase):
+    def test_get_origin(self):
+        self.assertEqual(browser.get_origin("https://User@Example.com:8443/path?q=1"), "https://example.com:8443")
+        self.assertEqual(browser.get_origin("http://localhost/"), "http://localhost")
+        self.assertIsNone(browser.get_origin("about:blank"))
+        self.assertIsNone(browser.get_origin("data:text/html,hi"))
+        self.assertIsNone(browser.get_origin(None))
+
+    def test_visit_records_redirected_origins(self):
+        fake = make_browser(FakeDriver({"https://app.test/login": "https://sso.test/auth?next=app"}))
+        fake.visit("https://app.test/login")
+        fake.visit("https://app.test/home")
+
+        self.assertEqual(fake.visited_origins, {"https://app.test", "https://sso.test"})
+
+    def test_reset_clears_every_origin(self):
+        driver = FakeDriver({"https://app.test/login": "https://sso.test/auth"})
+        fake = make_browser(driver)
+        fake.visit("https://other.test/")
+        fake.visit("https://app.test/login")
+
+        browser.reset_browser(fake)
+
+        # The current origin is cleared in place, the others from a page of their own
+        self.assertEqual(
+            driver.cleared,
+            [
+                ("storage", "https://sso.test"),
+                ("cookies", "https://sso.test"),
+                ("storage", "https://app.test"),
+                ("cookies", "https://app.test"),
+                ("storage", "https://other.test"),
+                ("cookies", "https://other.test"),
+            ],
+        )
+        self.assertEqual(driver.current_url, "about:blank")
+        self.assertEqual(fake.visited_origins, set())
+
+    def test_reset_clears_origins_with_devtools(self):
+        driver = FakeChromeDriver()
+        fake = make_browser(driver)
+        fake.visit("https://app.test/")
+        fake.visit("https://other.test/")
+
+        browser.reset_browser(fake)
+
+        self.assertEqual(
+            driver.cleared,
+            [
+                ("Network.clearBrowserCookies", None),
+                ("Storage.clearDataForOrigin", "https://other.test"),
+                ("Storage.clearDataForOrigin", "https://app.test"),
+            ],
+        )
+        self.assertEqual(driver.current_url, "about:blank")
+
+
+class FakeTimeoutDriver(object):
+    def __init__(self, script=None):
+        if script is not None:
+            self.timeouts = mock.Mock(script=script)
+
+        self.script_timeouts = []
+
+    def set_script_timeout(self, seconds):
+        self.script_timeouts.append(seconds)
+
+
+@unittest.skipIf(browser is None, "splinter is not installed")
+class TestScriptTimeout(TestCase):
+    def test_only_raises_timeout(self):
+        driver = FakeTimeoutDriver(script=30)
+        fake = make_browser(driver)
+
+        fake.raise_script_timeout(6)
+        fake.raise_script_timeout(61)
+        fake.raise_script_timeout(40)
+
+        self.assertEqual(driver.script_timeouts, [61])
+
+    def test_unknown_timeout_is_the_default(self):
+        driver = FakeTimeoutDriver()
+        fake = make_browser(driver)
+
+        fake.raise_script_timeout(6)
+        fake.raise_script_timeout(31)
+
+        self.assertEqual(driver.script_timeouts, [31])
+
+
+@unittest.skipIf(browser is None, "splinter is not installed")
+class TestProfiles(TestCase):
+    def test_get_profile(self):
+        with mock.patch.dict(os.environ, {"STACK_BROWSER_PROFILE": "lean"}):
+            self.assertEqual(browser.get_profile(), "lean")
+            self.assertEqual(browser.get_profile("default"), "default")
+
+        with mock.patch.dict(os.environ, clear=True):
+            self.assertEqual(browser.get_profile(), "default")
+
+    def test_unknown_profile(self):
+        with self.assertRaises(ValueError):
+            browser.get_profile("fast")
+
+        with mock.patch.dict(os.environ, {"STACK_BROWSER_PROFILE": "fast"}), self.assertRaises(ValueError):
+            browser.get_profile()
+
+
+@unittest.skipIf(browser is None, "splinter is not installed")
+class TestDriverPath(TestCase):
+    def setUp(self):
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        self.drivers = os.path.join(self.tmp, "drivers")
+        self.bin = os.path.join(self.tmp, "bin")
+        os.makedirs(self.drivers)
+        os.makedirs(self.bin)
+
+        # Look for drivers in the temporary directory, on Linux, with only it on the PATH
+        for patcher in (
+            mock.patch.object(browser, "__file__", os.path.join(self.tmp, "browser.py")),
+            mock.patch.object(browser.sys, "platform", "linux"),
+            mock.patch.dict(os.environ, {"PATH": self.bin}, clear=True),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_driver(self, directory, name):
+        path = os.path.join(directory, name)
+        with open(path, "w") as f:
+            f.write("#!/bin/sh\n")
+
+        os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+        return path
+
+    def test_environment_variable_comes_first(self):
+        self.make_driver(self.drivers, "chromedriver_linux")
+        os.environ["CHROMEDRIVER"] = "/opt/chromedriver"
+
+        self.assertEqual(browser.get_driver_path("chromedriver"), "/opt/chromedriver")
+
+    def test_platform_driver_comes_before_plain(self):
+        plain = self.make_driver(self.drivers, "chromedriver")
+        self.assertEqual(browser.get_driver_path("chromedriver"), plain)
+
+        platform = self.make_driver(self.drivers, "chromedriver_linux")
+        self.assertEqual(browser.get_driver_path("chromedriver"), platform)
+
+    def test_other_platforms_are_ignored(self):
+        self.make_driver(self.drivers, "geckodriver_osx")
+
+        self.assertIsNone(browser.get_driver_path("geckodriver"))
+
+    def test_falls_back_to_path(self):
+        path = self.make_driver(self.bin, "geckodriver")
+
+        self.assertEqual(browser.get_driver_path("geckodriver"), path)
@@ -2,9 +2,10 @@
 
 
 import subprocess
-from unittest import TestCase
+import sys
+from unittest import TestCase, skipIf
 
-from dbmisvc_stack import __version__
+from dbmisvc_stack import __version__, cli, commands
 
 
 class TestHelp(TestCase):
@@ -38,3 +39,60 @@ class TestVersion(TestCase):
         )
         output = process.stdout
         self.assertEqual(output.strip(), __version__)
+
+
+class TestStartup(TestCase):
+
+    # Microseconds importing the CLI may take, it should not load any command's dependencies
+    IMPORT_BUDGET = 100000
+
+    def run_python(self, code, *flags):
+        return subprocess.run(
+            [sys.executable, *flags, "-c", code],
+            check=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            universal_newlines=True,
+        )
+
+    @skipIf(sys.version_info < (3, 7), "-X importtime needs Python 3.7")
+    def test_import_time(self):
+        process = self.run_python("import dbmisvc_stack.cli", "-X", "importtime")
+
+        # Lines are 'import time: self | cumulative | module'
+        cumulative = {
+            line.split("|")[2].strip(): int(line.split("|")[1])
+            for line in process.stderr.splitlines()
+            if line.startswith("import time:") and line.split("|")[1].strip().isdigit()
+        }
+        self.assertLess(cumulative["dbmisvc_stack.cli"], self.IMPORT_BUDGET)
+
+    def test_only_the_command_run_is_imported(self):
+        process = self.run_python(
+            "import sys\n"
+            "import dbmisvc_stack.cli\n"
+            "print(sorted(module for module in ('docker', 'boto3', 'yaml') if module in sys.modules))\n"
+            "from dbmisvc_stack.commands import get_command\n"
+            "get_command({'--verbose': False, 'status': True, 'secrets': False})\n"
+            "print(sorted(module for module in sys.modules if module.startswith('dbmisvc_stack.commands.')))\n"
+            "print('boto3' in sys.modules, 'botocore' in sys.modules)\n"
+        )
+        self.assertEqual(
+            process.stdout.splitlines(),
+            ["[]", "['dbmisvc_stack.commands.base', 'dbmisvc_stack.commands.status']", "False False"],
+        )
+
+    def test_lazy_command_import(self):
+        process = self.run_python("from dbmisvc_stack.commands import Status; print(Status.__module__)")
+
+        self.assertEqual(process.stdout.strip(), "dbmisvc_stack.commands.status")
+
+    def test_every_command_is_registered(self):
+        usage = [line.split()[1] for line in cli.__doc__.splitlines() if line.startswith("  dbmisvc-stack ")]
+        names = {name for name in usage if name.isalpha()}
+
+        self.assertEqual(names, set(commands.COMMANDS))
+        for name in names:
+            self.assertTrue(issubclass(commands.get_command({name: True}), commands.Base))
+
+        self.assertIsNone(commands.get_command({"--verbose": True}))
@@ -0,0 +1,83 @@
+"""Tests for shell completion."""
+
+
+import os
+import shutil
+import subprocess
+import unittest
+
+from dbmisvc_stack.app import App
+from dbmisvc_stack.commands.completion import Completion, bash_script
+from tests.helpers import StackTestCase
+
+
+class TestCompletion(StackTestCase):
+    def setUp(self):
+        super(TestCompletion, self).setUp()
+        self.write_stack(
+            packages=[{"name": "shared", "path": "packages/shared"}],
+            apps={"web": {"repository": "https://example.com/web.git", "branch": "develop", "packages": ["client"]}},
+        )
+        self.write_compose({"web": {"image": "web"}, "db": {"image": "db"}})
+        os.makedirs(os.path.join(self.root, "hooks"), exist_ok=True)
+        for name in ("post-up.py", "pre-clone.py", "README"):
+            open(os.path.join(self.root, "hooks", name), "w").close()
+
+    def read_cache(self):
+        with open(os.path.join(self.root, ".stack", "completion")) as f:
+            return {line.split(" ", 1)[0]: line.split()[1:] for line in f.read().splitlines()}
+
+    def test_write_cache(self):
+        Completion.write_cache(Completion.get_candidates())
+        cache = self.read_cache()
+
+        self.assertIn("logs", cache["commands"])
+        self.assertEqual(cache["apps"], ["db", "web"])
+        self.assertEqual(cache["packages"], ["client", "shared"])
+        self.assertEqual(cache["branches:web"], ["develop"])
+        self.assertEqual(cache["hooks"], ["post-up", "pre-clone"])
+        self.assertEqual(cache["options:logs"], ["--all", "--minutes=", "--lines=", "-F", "--follow"])
+        self.assertNotIn("branches:db", cache)
+
+    def test_configured_hooks(self):
+        self.write_stack(hooks={"timeouts": {"post-clone": 1800, "post-up": 60}})
+
+        self.assertEqual(Completion.get_hooks(), ["post-clone", "post-up", "pre-clone"])
+
+    def test_cache_is_not_committed(self):
+        Completion.write_cache(Completion.get_candidates())
+        self.init_stack_repo()
+
+        self.assertEqual(self.git("ls-files", ".stack"), "")
+        self.assertEqual(self.git("status", "--porcelain", "--ignored=no"), "")
+
+    def test_branches_from_mirror(self):
+        bare = self.make_upstream("web", {"README": "web"}, branch="main")
+        self.git("--git-dir={}".format(bare), "branch", "feature", "main")
+        self.write_stack(**{"mirrors-directory": "mirrors", "apps": {"web": {"repository": bare, "branch": "main"}}})
+        self.git("clone", "--quiet", "--mirror", bare, App.get_mirror_dir("web"))
+
+        self.assertEqual(Completion.get_branches("web"), ["main", "feature"])
+
+    @unittest.skipUnless(shutil.which("bash"), "bash is not installed")
+    def test_bash(self):
+        Completion.write_cache(Completion.get_candidates())
+
+        def complete(line):
+            script = bash_script + '\nCOMP_WORDS=($1); COMP_CWORD=$2; _dbmisvc_stack; echo "${COMPREPLY[@]}"'
+            process = subprocess.run(
+                ["bash", "-c", script, "bash", line, str(len(line.split()) - (0 if line.endswith(" ") else 1))],
+                check=True,
+                stdout=subprocess.PIPE,
+                universal_newlines=True,
+            )
+            return process.stdout.split()
+
+        self.assertIn("status", complete("dbmisvc-stack sta"))
+        self.assertEqual(complete("dbmisvc-stack logs "), ["db", "web"])
+        self.assertEqual(complete("dbmisvc-stack logs w"), ["web"])
+        self.assertEqual(complete("dbmisvc-stack logs --m"), ["--minutes="])
+        self.assertEqual(complete("dbmisvc-stack checkout web "), ["develop"])
+        self.assertEqual(complete("dbmisvc-stack packages "), ["client", "shared"])
+        self.assertEqual(complete("dbmisvc-stack db "), ["dump", "restore"])
+        self.assertEqual(complete("dbmisvc-stack up "), [])
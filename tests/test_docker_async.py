@@ -0,0 +1,236 @@
+"""Tests for the asyncio Docker client, against a fake Docker socket server."""
+
+
+import asyncio
+import json
+import os
+import shutil
+import socketserver
+import struct
+import tempfile
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler
+from unittest import mock
+
+from dbmisvc_stack.app import App, Stack
+from dbmisvc_stack.commands.logs import Logs
+from dbmisvc_stack.docker_async import AsyncDockerClient, AsyncNotFound, run
+from tests.helpers import StackTestCase
+
+
+def frame(stream, data):
+    return struct.pack(">BxxxL", stream, len(data)) + data
+
+
+class FakeDockerHandler(BaseHTTPRequestHandler):
+    """Answers the few Docker Engine API endpoints the client uses."""
+
+    protocol_version = "HTTP/1.1"
+    containers = {
+        "one": {"State": {"Status": "running", "Running": True}, "Config": {"Tty": False}},
+        "two": {"State": {"Status": "exited", "Running": False}, "Config": {"Tty": False}},
+        "stack_web_1": {
+            "State": {"Status": "running", "Running": True},
+            "Config": {"Tty": False, "Labels": {"com.docker.compose.service": "web"}},
+        },
+    }
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_chunked(self, chunks):
+        self.send_response(200)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for chunk in chunks:
+            self.wfile.write("{:x}\r\n".format(len(chunk)).encode("utf-8") + chunk + b"\r\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def route(self):
+        path = self.path.split("?", 1)[0]
+        if path.startswith("/v1.43"):
+            path = path[len("/v1.43") :]
+
+        return path.strip("/").split("/")
+
+    def do_GET(self):
+        parts = self.route()
+        if parts == ["containers", "json"]:
+            self.send_json(
+                [
+                    {"Id": name, "Names": ["/" + name], "Labels": container["Config"].get("Labels", {})}
+                    for name, container in self.containers.items()
+                ]
+            )
+
+        elif parts[0] == "containers" and parts[1] not in self.containers:
+            self.send_json({"message": "No such container: {}".format(parts[1])}, status=404)
+
+        elif parts[0] == "containers" and parts[2] == "json":
+            self.send_json(self.containers[parts[1]])
+
+        elif parts[0] == "containers" and parts[2] == "logs":
+            self.send_chunked([frame(1, b"first line\nsecond "), frame(2, b"line\n"), frame(1, b"last")])
+
+        elif parts[0] == "containers" and parts[2] == "stats":
+            self.send_chunked([b'{"cpu": 1}\n{"cp', b'u": 2}\n'])
+
+        elif parts == ["events"]:
+            self.send_chunked([b'{"Action": "start"}\n'])
+
+        elif parts[0] == "exec":
+            self.send_json({"ExitCode": 3})
+
+        else:
+            self.send_json({"message": "page not found"}, status=404)
+
+    def do_POST(self):
+        parts = self.route()
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])) or b"null")
+        if parts[0] == "containers" and parts[2] == "exec":
+            self.server.execs.append(body)
+            self.send_json({"Id": "exec1"}, status=201)
+
+        elif parts[0] == "exec" and parts[2] == "start":
+
+            # The stream runs until the connection closes
+            self.send_response(200)
+            self.send_header("Content-Type", "application/vnd.docker.raw-stream")
+            self.end_headers()
+            self.wfile.write(frame(1, b"out") + frame(2, b"err"))
+            self.close_connection = True
+
+
+class FakeDockerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    # Docker listens with a deep backlog, many clients connect at once
+    request_queue_size = 128
+
+    def __init__(self, path):
+        socketserver.UnixStreamServer.__init__(self, path, FakeDockerHandler)
+        self.execs = []
+
+
+class FakeDockerMixin(object):
+    def start_docker(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.socket_path = os.path.join(directory, "docker.sock")
+
+        self.docker = FakeDockerServer(self.socket_path)
+        thread = threading.Thread(target=self.docker.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.docker.server_close)
+        self.addCleanup(self.docker.shutdown)
+
+
+class TestAsyncDockerClient(FakeDockerMixin, unittest.TestCase):
+    def setUp(self):
+        self.start_docker()
+        self.client = AsyncDockerClient(self.socket_path, version="1.43")
+
+    def run_async(self, coroutine):
+        return run(coroutine)
+
+    def test_get_container(self):
+        container = self.run_async(self.client.get_container("one"))
+
+        self.assertEqual(container["State"]["Status"], "running")
+        with self.assertRaises(AsyncNotFound):
+            self.run_async(self.client.get_container("missing"))
+
+    def test_list_containers(self):
+        containers = self.run_async(self.client.list_containers(all=True, filters={"label": ["a=b"]}))
+
+        self.assertEqual([container["Id"] for container in containers], ["one", "two", "stack_web_1"])
+
+    def test_exec_run(self):
+        exit_code, output = self.run_async(self.client.exec_run("one", ["ls", "/"], environment={"A": "b"}))
+
+        self.assertEqual((exit_code, output), (3, b"outerr"))
+        self.assertEqual(self.docker.execs[0]["Cmd"], ["ls", "/"])
+        self.assertEqual(self.docker.execs[0]["Env"], ["A=b"])
+
+    def test_logs(self):
+        async def logs():
+            return [frame async for frame in self.client.logs("one")]
+
+        self.assertEqual(self.run_async(logs()), [(1, b"first line\nsecond "), (2, b"line\n"), (1, b"last")])
+
+    def test_stats_and_events(self):
+        async def collect():
+            stats = [stats async for stats in self.client.stats("one")]
+            events = [event async for event in self.client.events(filters={"type": ["container"]})]
+            return stats, events
+
+        self.assertEqual(self.run_async(collect()), ([{"cpu": 1}, {"cpu": 2}], [{"Action": "start"}]))
+
+    def test_many_containers_at_once(self):
+        async def inspect_all():
+            return await asyncio.gather(*(self.client.get_container("one") for _ in range(50)))
+
+        self.assertEqual(len(self.run_async(inspect_all())), 50)
+
+    def test_wait_healthy(self):
+        self.assertTrue(self.run_async(self.client.wait_healthy("one")))
+        self.assertFalse(self.run_async(self.client.wait_healthy("two", timeout=0.2, interval=0.1)))
+
+
+class TestApp(FakeDockerMixin, StackTestCase):
+    def setUp(self):
+        super(TestApp, self).setUp()
+        self.start_docker()
+        os.environ["DOCKER_HOST"] = "unix://" + self.socket_path
+        self.write_compose(
+            {
+                "one": {"image": "one", "container_name": "one"},
+                "two": {"image": "two", "container_name": "two"},
+                "three": {"image": "three", "container_name": "three"},
+                "web": {"image": "web"},
+            }
+        )
+
+    def test_get_statuses(self):
+        self.assertEqual(
+            App.get_statuses(["one", "two", "three", "web"], version="1.43"),
+            {"one": "running", "two": "exited", "three": "Not found", "web": "N/A"},
+        )
+
+    def test_stream_logs(self):
+        with self.assertLogs("stack", level="INFO") as logs:
+            App.stream_logs(["one"], version="1.43")
+
+        self.assertEqual(
+            [line.split(":", 2)[2] for line in logs.output],
+            ["(one) first line", "(one) second line", "(one) last"],
+        )
+
+    def test_stream_logs_by_service(self):
+        with self.assertLogs("stack", level="INFO") as logs:
+            App.stream_logs(["web"], version="1.43")
+
+        self.assertEqual(
+            [line.split(":", 2)[2] for line in logs.output],
+            ["(web) first line", "(web) second line", "(web) last"],
+        )
+
+    def test_logs_without_unix_socket(self):
+        os.environ["DOCKER_HOST"] = "tcp://127.0.0.1:2375"
+        options = {"<app>": None, "--all": True, "--minutes": None, "--lines": "10", "--follow": True}
+
+        with mock.patch.object(Stack, "run", return_value=0) as run, mock.patch.object(App, "stream_logs") as stream:
+            Logs(options).run()
+
+        stream.assert_not_called()
+        run.assert_called_once_with(["docker-compose", "logs", "-t", "--tail", "10", "-f"])
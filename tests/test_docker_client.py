@@ -0,0 +1,69 @@
+"""Tests for the shared Docker client."""
+
+
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
+
+from dbmisvc_stack.app import Stack
+from tests.helpers import StackTestCase
+
+
+def fake_from_env(version=None, max_pool_size=None):
+    api = SimpleNamespace(api_version="1.43" if version == "auto" else version, hooks={"response": []})
+    return SimpleNamespace(api=api, version=version, max_pool_size=max_pool_size)
+
+
+class DockerClientTestCase(StackTestCase):
+    def setUp(self):
+        super(DockerClientTestCase, self).setUp()
+        self.write_stack()
+        Stack._docker_client = None
+        Stack.docker_timings = {}
+        self.addCleanup(setattr, Stack, "_docker_client", None)
+
+        patcher = mock.patch("docker.from_env", side_effect=fake_from_env)
+        self.from_env = patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class TestGetDockerClient(DockerClientTestCase):
+    def test_shared_and_pooled(self):
+        client = Stack.get_docker_client()
+
+        self.assertIs(Stack.get_docker_client(), client)
+        self.from_env.assert_called_once_with(version="auto", max_pool_size=Stack.DOCKER_POOL_SIZE)
+
+    def test_pins_negotiated_version(self):
+        Stack.get_docker_client()
+
+        # A later run reuses the version
+        Stack._docker_client = None
+        self.assertEqual(Stack.get_docker_client().version, "1.43")
+
+    def test_configured_version(self):
+        self.write_stack(**{"docker-api-version": "1.41"})
+
+        self.assertEqual(Stack.get_docker_client().version, "1.41")
+
+
+class TestDockerTimings(DockerClientTestCase):
+    def respond(self, method, path, seconds):
+        request = SimpleNamespace(method=method, url="http+docker://localhost/v1.43" + path)
+        for hook in Stack.get_docker_client().api.hooks["response"]:
+            hook(SimpleNamespace(request=request, elapsed=timedelta(seconds=seconds)))
+
+    def test_counts_requests_by_endpoint(self):
+        self.respond("GET", "/containers/json?all=1", 0.5)
+        self.respond("GET", "/containers/one/json", 0.25)
+        self.respond("GET", "/containers/two/json", 0.25)
+        self.respond("POST", "/exec/abc123/start", 1)
+
+        self.assertEqual(
+            Stack.docker_timings,
+            {
+                "GET /containers/json": [1, 0.5],
+                "GET /containers/{id}/json": [2, 0.5],
+                "POST /exec/{id}/start": [1, 1.0],
+            },
+        )
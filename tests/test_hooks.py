@@ -0,0 +1,73 @@
+"""Tests for running stack hooks."""
+
+
+import os
+import textwrap
+import time
+
+from dbmisvc_stack.app import Stack, HookError
+from tests.helpers import StackTestCase
+
+
+class HookTestCase(StackTestCase):
+    def write_config(self, hooks):
+        self.write_stack(hooks=hooks)
+
+    def write_hook(self, step, source):
+        with open(os.path.join(self.root, "hooks", "{}.py".format(step)), "w") as f:
+            f.write(textwrap.dedent(source))
+
+
+class TestHook(HookTestCase):
+    def test_returns_exit_code_and_records_result(self):
+        self.write_config({})
+        self.write_hook("post-clone", "import sys; sys.exit(3)")
+
+        self.assertEqual(Stack.hook("post-clone", "app"), 3)
+        self.assertEqual(len(Stack.hook_results), 1)
+        self.assertEqual(Stack.hook_results[0].app, "app")
+        self.assertEqual(Stack.hook_results[0].exit_code, 3)
+
+    def test_missing_hook_is_not_recorded(self):
+        self.write_config({})
+
+        self.assertEqual(Stack.hook("post-clone", "app"), 0)
+        self.assertEqual(Stack.hook_results, [])
+
+    def test_timeout(self):
+        self.write_config({"timeout": 30, "timeouts": {"post-clone": 1}})
+        self.write_hook("post-clone", "import time; time.sleep(10)")
+
+        start = time.monotonic()
+        self.assertEqual(Stack.hook("post-clone", "app"), Stack.HOOK_TIMEOUT_EXIT_CODE)
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertTrue(Stack.hook_results[0].timed_out)
+
+    def test_abort_on_failure(self):
+        self.write_config({"abort-on-failure": True})
+        self.write_hook("pre-clone", "import sys; sys.exit(1)")
+
+        with self.assertRaises(HookError):
+            Stack.hook("pre-clone", "app")
+
+
+class TestHooks(HookTestCase):
+    def test_runs_concurrently(self):
+        self.write_config({"concurrency": 4})
+        self.write_hook("post-clone", "import time; time.sleep(1)")
+
+        start = time.monotonic()
+        codes = Stack.hooks("post-clone", {app: [] for app in ["a", "b", "c", "d"]})
+        self.assertLess(time.monotonic() - start, 3)
+        self.assertEqual(codes, {"a": 0, "b": 0, "c": 0, "d": 0})
+        self.assertEqual(len(Stack.hook_results), 4)
+
+    def test_abort_after_all_hooks_run(self):
+        self.write_config({"abort-on-failure": True})
+        self.write_hook("post-clone", "import sys; sys.exit(1 if sys.argv[1] == 'b' else 0)")
+
+        with self.assertRaises(HookError) as context:
+            Stack.hooks("post-clone", {app: [] for app in ["a", "b", "c"]}, jobs=2)
+
+        self.assertEqual([result.app for result in context.exception.results], ["b"])
+        self.assertEqual(len(Stack.hook_results), 3)
@@ -0,0 +1,143 @@
+"""Tests for the built-in package index."""
+
+
+import base64
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+import uuid
+from unittest import mock
+from urllib.error import HTTPError
+from urllib.request import Request, urlopen
+
+from dbmisvc_stack.index import PackageIndex, get_project, is_loopback, make_server
+
+
+class IndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_dist(self, name, content=b"dist"):
+        with open(os.path.join(self.directory, name), "wb") as f:
+            f.write(content)
+
+
+class TestPackageIndex(IndexTestCase):
+    def test_is_loopback(self):
+        for host in ("localhost", "127.0.0.1", "127.0.1.1", "::1"):
+            self.assertTrue(is_loopback(host), host)
+
+        for host in ("0.0.0.0", "172.17.0.1", "::", "example.com"):
+            self.assertFalse(is_loopback(host), host)
+
+    def test_get_project(self):
+        self.assertEqual(get_project("Some_Package-1.0-py3-none-any.whl"), "some-package")
+        self.assertEqual(get_project("some.package-1.0.tar.gz"), "some-package")
+        self.assertIsNone(get_project("notes.txt"))
+
+    def test_lists_projects(self):
+        self.write_dist("one-1.0.tar.gz")
+        self.write_dist("one-1.1-py3-none-any.whl")
+        self.write_dist("two-1.0.zip")
+        self.write_dist("README")
+        index = PackageIndex(self.directory)
+
+        self.assertEqual(index.projects(), ["one", "two"])
+        self.assertEqual(
+            index.project_files("One"),
+            [
+                ("one-1.0.tar.gz", hashlib.sha256(b"dist").hexdigest()),
+                ("one-1.1-py3-none-any.whl", hashlib.sha256(b"dist").hexdigest()),
+            ],
+        )
+
+    def test_refresh_hashes_only_new_files(self):
+        self.write_dist("one-1.0.tar.gz")
+        os.utime(self.directory, (0, 0))
+        index = PackageIndex(self.directory)
+        index.refresh()
+        self.assertFalse(index.refresh())
+
+        index.add("one-1.1.tar.gz", b"new")
+        with mock.patch.object(PackageIndex, "hash_file", wraps=PackageIndex.hash_file) as hash_file:
+            self.assertTrue(index.refresh())
+
+        hash_file.assert_called_once_with(os.path.join(self.directory, "one-1.1.tar.gz"))
+        self.assertEqual(len(index.project_files("one")), 2)
+
+    def test_add_rejects_other_files(self):
+        with self.assertRaises(ValueError):
+            PackageIndex(self.directory).add("../setup.py", b"")
+
+
+class TestIndexServer(IndexTestCase):
+    def start(self, password=None):
+        server = make_server(self.directory, port=0, password=password)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        return "http://127.0.0.1:{}".format(server.server_port)
+
+    def upload(self, url, name, content, digest=None, password=None):
+        boundary = uuid.uuid4().hex
+        fields = {":action": "file_upload", "name": get_project(name)}
+        if digest:
+            fields["sha256_digest"] = digest
+
+        body = b""
+        for field, value in fields.items():
+            body += "--{}\r\nContent-Disposition: form-data; name=\"{}\"\r\n\r\n{}\r\n".format(
+                boundary, field, value
+            ).encode("utf-8")
+        body += (
+            "--{}\r\nContent-Disposition: form-data; name=\"content\"; filename=\"{}\"\r\n"
+            "Content-Type: application/octet-stream\r\n\r\n".format(boundary, name).encode("utf-8")
+            + content
+            + "\r\n--{}--\r\n".format(boundary).encode("utf-8")
+        )
+
+        request = Request(url + "/", data=body, method="POST")
+        request.add_header("Content-Type", "multipart/form-data; boundary={}".format(boundary))
+        if password:
+            credentials = base64.b64encode("root:{}".format(password).encode("utf-8")).decode("utf-8")
+            request.add_header("Authorization", "Basic {}".format(credentials))
+
+        return urlopen(request).status
+
+    def test_serves_simple_index(self):
+        self.write_dist("one-1.0.tar.gz", b"one")
+        url = self.start()
+
+        self.assertIn(b'href="/simple/one/"', urlopen(url + "/simple/").read())
+        page = urlopen(url + "/simple/One/").read().decode("utf-8")
+        self.assertIn("/packages/one-1.0.tar.gz#sha256={}".format(hashlib.sha256(b"one").hexdigest()), page)
+        self.assertEqual(urlopen(url + "/packages/one-1.0.tar.gz").read(), b"one")
+
+        with self.assertRaises(HTTPError):
+            urlopen(url + "/simple/two/")
+
+    def test_upload(self):
+        url = self.start()
+        content = b"wheel"
+
+        self.assertEqual(self.upload(url, "one-1.0-py3-none-any.whl", content, hashlib.sha256(content).hexdigest()), 200)
+        self.assertEqual(urlopen(url + "/packages/one-1.0-py3-none-any.whl").read(), content)
+
+        with self.assertRaises(HTTPError):
+            self.upload(url, "one-1.1-py3-none-any.whl", content, "bad")
+
+    def test_upload_requires_password(self):
+        url = self.start(password="secret")
+
+        with self.assertRaises(HTTPError) as error:
+            self.upload(url, "one-1.0.tar.gz", b"sdist")
+        self.assertEqual(error.exception.code, 401)
+
+        self.assertEqual(self.upload(url, "one-1.0.tar.gz", b"sdist", password="secret"), 200)
@@ -0,0 +1,113 @@
+"""Tests for building stack packages."""
+
+
+import os
+
+from dbmisvc_stack.commands.packages import Packages
+from tests.helpers import FakeContainer, FakeDockerClient, StackTestCase
+
+
+class PackagesTestCase(StackTestCase):
+    def setUp(self):
+        super(PackagesTestCase, self).setUp()
+        self.path = os.path.join(self.tmp, "package")
+        os.makedirs(os.path.join(self.path, "package"))
+        self.write_source("setup.py", "from setuptools import setup\n")
+        self.write_source("package/__init__.py", "VERSION = 1\n")
+
+    def write_source(self, name, content):
+        with open(os.path.join(self.path, name), "w") as f:
+            f.write(content)
+
+
+class TestHashPackage(PackagesTestCase):
+    def test_changes_with_source(self):
+        before = Packages.hash_package(self.path)
+        self.write_source("package/__init__.py", "VERSION = 2\n")
+
+        self.assertNotEqual(Packages.hash_package(self.path), before)
+
+    def test_ignores_build_outputs(self):
+        before = Packages.hash_package(self.path)
+        os.makedirs(os.path.join(self.path, "dist"))
+        os.makedirs(os.path.join(self.path, "package.egg-info"))
+        os.makedirs(os.path.join(self.path, "package", "__pycache__"))
+        self.write_source("dist/package-1.tar.gz", "archive")
+        self.write_source("package.egg-info/PKG-INFO", "info")
+        self.write_source("package/__pycache__/__init__.cpython-38.pyc", "bytecode")
+
+        self.assertEqual(Packages.hash_package(self.path), before)
+
+    def test_changes_with_build_command(self):
+        self.assertNotEqual(
+            Packages.hash_package(self.path, "python -m build"),
+            Packages.hash_package(self.path, "python setup.py sdist"),
+        )
+
+
+class TestBuild(PackagesTestCase):
+    def test_collects_only_new_files(self):
+        os.makedirs(os.path.join(self.path, "dist"))
+        self.write_source("dist/package-0.tar.gz", "stale")
+        build = "python -c \"open('dist/package-1.tar.gz', 'w').write('fresh')\""
+
+        dists = Packages.build("package", self.path, build)
+
+        self.assertEqual([os.path.basename(dist) for dist in dists], ["package-1.tar.gz"])
+
+    def test_dist_placeholder(self):
+        build = "python -c \"import sys; open(sys.argv[1] + '/package-1.whl', 'w')\" {dist}"
+
+        dists = Packages.build("package", self.path, build)
+
+        self.assertEqual([os.path.basename(dist) for dist in dists], ["package-1.whl"])
+        self.assertFalse(os.path.exists(os.path.join(self.path, "dist")))
+
+    def test_failed_build(self):
+        self.assertIsNone(Packages.build("package", self.path, "python -c \"raise SystemExit(1)\""))
+
+
+class TestUpdateApps(PackagesTestCase):
+    def setUp(self):
+        super(TestUpdateApps, self).setUp()
+        self.write_stack(apps={"one": {"packages": ["package"]}, "two": {"packages": ["package"]}, "three": {}})
+        self.write_compose(
+            {app: {"image": app, "container_name": app} for app in ("one", "two", "three")}
+        )
+        self.dists = Packages.build(
+            "package", self.path, "python -c \"import sys; open(sys.argv[1] + '/package-1.whl', 'w')\" {dist}"
+        )
+
+    def test_reinstalls_in_dependent_apps(self):
+        containers = {"one": FakeContainer(), "two": FakeContainer(), "three": FakeContainer()}
+
+        results = Packages.update_apps("package", self.dists, FakeDockerClient(containers))
+
+        self.assertEqual(results, {"one": True, "two": True})
+        self.assertEqual(containers["three"].commands, [])
+        for app in ("one", "two"):
+            self.assertEqual(containers[app].archives[0][0], "/tmp")
+            self.assertEqual(
+                containers[app].commands,
+                [(["pip", "install", "--force-reinstall", "--no-deps", "/tmp/package-1.whl"], None)],
+            )
+
+    def test_reports_failures(self):
+        containers = {"one": FakeContainer(status="exited"), "two": FakeContainer(exit_code=1)}
+
+        results = Packages.update_apps("package", self.dists, FakeDockerClient(containers))
+
+        self.assertEqual(results, {"one": False, "two": False})
+        self.assertEqual(containers["one"].commands, [])
+
+
+class TestPublish(PackagesTestCase):
+    def test_publishes_to_index_directory(self):
+        self.write_stack(**{"package-index": {"directory": "index"}})
+        dists = Packages.build(
+            "package", self.path, "python -c \"import sys; open(sys.argv[1] + '/package-1.tar.gz', 'w')\" {dist}"
+        )
+
+        Packages.publish(dists)
+
+        self.assertEqual(os.listdir(os.path.join(self.root, "index")), ["package-1.tar.gz"])
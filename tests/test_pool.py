@@ -0,0 +1,94 @@
+"""Tests for the session pool browsers are leased from."""
+
+
+import threading
+import time
+from unittest import TestCase
+
+from dbmisvc_stack.pool import PoolTimeout, SessionPool
+
+
+class FakeSession(object):
+    def __init__(self):
+        self.alive = True
+        self.resets = 0
+        self.closed = False
+
+
+class TestSessionPool(TestCase):
+    def make_pool(self, **kwargs):
+        self.sessions = []
+
+        def factory():
+            self.sessions.append(FakeSession())
+            return self.sessions[-1]
+
+        def reset(session):
+            session.resets += 1
+
+        def close(session):
+            session.closed = True
+
+        return SessionPool(factory, reset=reset, alive=lambda session: session.alive, close=close, **kwargs)
+
+    def test_reuses_and_resets_sessions(self):
+        pool = self.make_pool(size=2)
+        for _ in range(3):
+            with pool.lease():
+                pass
+
+        self.assertEqual(len(self.sessions), 1)
+        self.assertEqual(self.sessions[0].resets, 3)
+        self.assertEqual(pool.stats()["leases"], 3)
+
+    def test_recycles_after_max_uses(self):
+        pool = self.make_pool(max_uses=2)
+        for _ in range(5):
+            with pool.lease():
+                pass
+
+        self.assertEqual(len(self.sessions), 3)
+        self.assertEqual([session.closed for session in self.sessions], [True, True, False])
+
+    def test_replaces_crashed_sessions(self):
+        pool = self.make_pool()
+        with self.assertRaises(ValueError):
+            with pool.lease() as session:
+                session.alive = False
+                raise ValueError()
+
+        with pool.lease() as session:
+            self.assertIs(session, self.sessions[1])
+
+        # Sessions that die while idle are replaced when leased
+        session.alive = False
+        with pool.lease() as session:
+            self.assertIs(session, self.sessions[2])
+
+        self.assertTrue(self.sessions[0].closed)
+        self.assertEqual(pool.stats()["recycled"], 2)
+
+    def test_waits_for_a_release(self):
+        pool = self.make_pool(size=1)
+        session = pool.acquire()
+
+        with self.assertRaises(PoolTimeout):
+            pool.acquire(timeout=0.05)
+
+        threading.Timer(0.1, pool.release, [session]).start()
+        start = time.monotonic()
+        self.assertIs(pool.acquire(timeout=5), session)
+        self.assertGreaterEqual(time.monotonic() - start, 0.05)
+        self.assertGreaterEqual(pool.stats()["max_wait"], 0.05)
+        self.assertEqual(len(self.sessions), 1)
+
+    def test_close(self):
+        pool = self.make_pool(size=2)
+        first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.close()
+        pool.release(second)
+
+        self.assertTrue(first.closed and second.closed)
+        with self.assertRaises(RuntimeError):
+            pool.acquire()
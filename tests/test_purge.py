@@ -0,0 +1,97 @@
+"""Tests for purging app databases."""
+
+
+from dbmisvc_stack.app import App
+from tests.helpers import FakeContainer, FakeDockerClient, StackTestCase
+
+
+class PurgeTestCase(StackTestCase):
+    def setUp(self):
+        super(PurgeTestCase, self).setUp()
+        self.db = FakeContainer()
+        self.client = FakeDockerClient({"db": self.db})
+
+    def write_database(self, database, environment):
+        self.write_stack(
+            **{"database-container": {"name": "db", "database": database}, "apps": {"one": {"database": "one"}}}
+        )
+        self.write_compose({"db": {"image": database, "container_name": "db", "environment": environment}})
+
+
+class TestPurgeData(PurgeTestCase):
+    def test_postgres(self):
+        self.write_database("postgres", {"POSTGRES_USER": "stack"})
+
+        App.purge_data(self.client, "one")
+
+        [(command, _)] = self.db.commands
+        self.assertEqual(command[:8], ["psql", "-v", "ON_ERROR_STOP=1", "-tA", "-U", "stack", "-d", "postgres"])
+        self.assertEqual(
+            command[8:][1::2],
+            [
+                "SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname = 'one' AND pid <> pg_backend_pid()",
+                'DROP DATABASE IF EXISTS "one"',
+                'CREATE DATABASE "one"',
+            ],
+        )
+
+    def test_mysql(self):
+        self.write_database("mysql", {"MYSQL_ROOT_PASSWORD": "secret"})
+
+        App.purge_data(self.client, "one")
+
+        self.assertEqual(
+            self.db.commands,
+            [
+                (
+                    ["mysql", "-uroot", "-e", "DROP DATABASE IF EXISTS `one`; CREATE DATABASE `one`; FLUSH PRIVILEGES;"],
+                    {"MYSQL_PWD": "secret"},
+                )
+            ],
+        )
+
+    def test_mariadb(self):
+        self.write_database("mariadb", {"MYSQL_ROOT_PASSWORD": "secret"})
+
+        App.purge_data(self.client, "one")
+
+        self.assertEqual(len(self.db.commands), 1)
+
+
+class TestPurgeAllData(PurgeTestCase):
+    def setUp(self):
+        super(TestPurgeAllData, self).setUp()
+        self.write_stack(
+            **{
+                "database-container": {"name": "db", "database": "postgres"},
+                "apps": {"one": {"database": "one"}, "two": {"database": "two"}, "web": {}},
+            }
+        )
+        self.write_compose({"db": {"image": "postgres", "container_name": "db"}})
+
+    def test_recreates_all_databases_at_once(self):
+        results = App.purge_all_data(self.client)
+
+        self.assertEqual(results, {"one": "purged", "two": "purged"})
+        [(command, _)] = self.db.commands
+        self.assertEqual(
+            command[8:][1::2],
+            [
+                "SELECT pg_terminate_backend(pid) FROM pg_stat_activity WHERE datname IN ('one', 'two') "
+                "AND pid <> pg_backend_pid()",
+                'DROP DATABASE IF EXISTS "one"',
+                'CREATE DATABASE "one"',
+                'DROP DATABASE IF EXISTS "two"',
+                'CREATE DATABASE "two"',
+            ],
+        )
+
+    def test_reports_each_database_when_the_batch_fails(self):
+        self.db.exit_code = 1
+
+        with self.assertLogs("stack", level="INFO") as logs:
+            results = App.purge_all_data(self.client)
+
+        self.assertEqual(results, {"one": "failed", "two": "failed"})
+        self.assertEqual(len(self.db.commands), 3)
+        self.assertIn("(one) one: failed", "\n".join(logs.output))
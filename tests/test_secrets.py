@@ -0,0 +1,236 @@
+"""Tests for fetching secrets, against a local stand-in for Secrets Manager."""
+
+
+import base64
+import json
+import os
+import socketserver
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from unittest import mock
+
+import botocore.session
+
+from dbmisvc_stack.commands.secrets import Secrets
+from tests.helpers import StackTestCase
+
+# BatchGetSecretValue is only known to recent releases of botocore
+BATCH_SUPPORTED = "BatchGetSecretValue" in botocore.session.get_session().get_service_model("secretsmanager").operation_names
+
+
+class SecretsManagerHandler(BaseHTTPRequestHandler):
+    """Answers the Secrets Manager JSON API from a dict of secrets."""
+
+    secrets = {}
+    requests = []
+    batch = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def respond(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/x-amz-json-1.1")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def value(self, secret_id):
+        secret, version = self.secrets[secret_id]
+        value = {
+            "ARN": "arn:aws:secretsmanager:us-east-1:123456789012:secret:{}".format(secret_id),
+            "Name": secret_id,
+            "VersionId": version,
+        }
+
+        # Binary values are base64 encoded on the wire
+        if isinstance(secret, bytes):
+            value["SecretBinary"] = base64.b64encode(secret).decode("utf-8")
+        else:
+            value["SecretString"] = secret
+
+        return value
+
+    def do_POST(self):
+        action = self.headers["X-Amz-Target"].split(".")[-1]
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        self.requests.append(action)
+
+        if action == "GetSecretValue":
+            if body["SecretId"] not in self.secrets:
+                self.respond(400, {"__type": "ResourceNotFoundException", "message": "Not found"})
+            else:
+                self.respond(200, self.value(body["SecretId"]))
+
+        elif action == "BatchGetSecretValue" and self.batch:
+            self.respond(
+                200,
+                {
+                    "SecretValues": [self.value(id) for id in body["SecretIdList"] if id in self.secrets],
+                    "Errors": [
+                        {"SecretId": id, "ErrorCode": "ResourceNotFoundException", "Message": "Not found"}
+                        for id in body["SecretIdList"]
+                        if id not in self.secrets
+                    ],
+                },
+            )
+
+        else:
+            self.respond(400, {"__type": "AccessDeniedException", "message": "Denied"})
+
+
+class SecretsManagerServer(socketserver.ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class SecretsTestCase(StackTestCase):
+    def setUp(self):
+        super(SecretsTestCase, self).setUp()
+
+        self.handler = type("Handler", (SecretsManagerHandler,), {"secrets": {}, "requests": []})
+        server = SecretsManagerServer(("127.0.0.1", 0), self.handler)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        patcher = mock.patch.dict(
+            os.environ, {"AWS_ACCESS_KEY_ID": "test", "AWS_SECRET_ACCESS_KEY": "test", "AWS_SESSION_TOKEN": "test"}
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.write_stack(
+            secrets={
+                "region": "us-east-1",
+                "endpoint-url": "http://127.0.0.1:{}".format(server.server_port),
+                "name": "stack",
+                "names": ["shared"],
+            },
+            apps={"one": {"secrets": ["one"]}, "two": {"secrets": ["shared"]}},
+        )
+
+    def set_secret(self, secret_id, values, version):
+        self.handler.secrets[secret_id] = (json.dumps(values), version)
+
+
+class TestSecrets(SecretsTestCase):
+    def setUp(self):
+        super(TestSecrets, self).setUp()
+        self.set_secret("stack", {"debug": "false", "name": "stack"}, "v1")
+        self.set_secret("shared", {"debug": "true"}, "v1")
+        self.set_secret("one", {"one_key": "one"}, "v1")
+
+    def test_secret_ids(self):
+        self.assertEqual(Secrets.get_secret_ids(), ["stack", "shared", "one"])
+
+    @unittest.skipUnless(BATCH_SUPPORTED, "botocore does not support BatchGetSecretValue")
+    def test_fetches_in_a_batch_and_merges_in_order(self):
+        secret_ids = Secrets.get_secret_ids()
+        values = Secrets.get_secrets(secret_ids)
+
+        self.assertEqual(self.handler.requests, ["BatchGetSecretValue"])
+        self.assertEqual(
+            Secrets.merge(secret_ids, values),
+            {"debug": "true", "name": "stack", "one_key": "one"},
+        )
+
+    def test_falls_back_to_concurrent_requests(self):
+        self.handler.batch = False
+
+        values = Secrets.get_secrets(Secrets.get_secret_ids())
+
+        self.assertEqual(sorted(values), ["one", "shared", "stack"])
+        self.assertEqual(self.handler.requests.count("GetSecretValue"), 3)
+
+    def test_caches_within_ttl(self):
+        Secrets.get_secrets(["stack", "one"])
+        fetched = len(self.handler.requests)
+        self.assertEqual(os.stat(Secrets.get_cache_path()).st_mode & 0o777, 0o600)
+        self.assertTrue(Secrets.get_cache_path().startswith(os.path.join(self.tmp, ".cache", "dbmisvc-stack")))
+        self.assertFalse(os.path.exists(os.path.join(self.root, ".stack", "secrets.json")))
+
+        values = Secrets.get_secrets(["stack", "one"])
+        self.assertEqual(len(self.handler.requests), fetched)
+        self.assertEqual(json.loads(values["one"]["string"]), {"one_key": "one"})
+
+        # Secrets that were not cached are fetched on their own
+        Secrets.get_secrets(["stack", "shared"])
+        self.assertEqual(len(self.handler.requests), fetched + 1)
+
+    def test_refresh_picks_up_new_versions(self):
+        Secrets.get_secrets(["one"])
+        self.set_secret("one", {"one_key": "changed"}, "v2")
+
+        self.assertEqual(json.loads(Secrets.get_secrets(["one"])["one"]["string"]), {"one_key": "one"})
+        self.assertEqual(json.loads(Secrets.get_secrets(["one"], refresh=True)["one"]["string"]), {"one_key": "changed"})
+
+    def test_missing_secrets_are_left_out(self):
+        self.assertEqual(sorted(Secrets.get_secrets(["one", "missing"])), ["one"])
+
+
+class TestEnv(SecretsTestCase):
+    def setUp(self):
+        super(TestEnv, self).setUp()
+        self.set_secret("stack", {"debug": "false", "token": "abc"}, "v1")
+        self.set_secret("shared", {"shared": "yes"}, "v1")
+        self.set_secret("one", {"one_key": "one"}, "v1")
+        self.write_compose(
+            {
+                "one": {"image": "one", "env_file": ".env"},
+                "two": {"image": "two", "environment": ["DEBUG=${DEBUG}"]},
+                "three": {"image": "three", "environment": ["DEBUG_LEVEL=1"]},
+            }
+        )
+        self.path = os.path.join(self.root, ".env")
+
+    def run_secrets(self, **options):
+        options = dict({"--force": False, "--refresh": True}, **options)
+        with self.assertLogs("stack", level="INFO") as logs:
+            Secrets(options).run()
+
+        return "\n".join(logs.output)
+
+    def test_unchanged_file_is_not_rewritten(self):
+        self.run_secrets()
+        with open(self.path) as f:
+            self.assertIn("TOKEN=abc\n", f.read())
+        os.utime(self.path, (0, 0))
+
+        output = self.run_secrets(**{"--force": True})
+
+        self.assertIn("up to date", output)
+        self.assertEqual(os.stat(self.path).st_mtime, 0)
+
+    def test_reports_changed_keys_and_services(self):
+        self.run_secrets()
+        self.set_secret("stack", {"debug": "true", "token": "abc", "added": "new"}, "v2")
+        self.set_secret("shared", {}, "v2")
+
+        output = self.run_secrets(**{"--force": True})
+
+        self.assertIn("Added: ADDED", output)
+        self.assertIn("Removed: SHARED", output)
+        self.assertIn("Changed: DEBUG", output)
+        self.assertIn("Services with changed environments: one, two", output)
+        self.assertNotIn("true", output)
+
+    def test_requires_force_to_overwrite(self):
+        with open(self.path, "w") as f:
+            f.write("DEBUG=local\n")
+
+        with self.assertRaises(SystemExit):
+            self.run_secrets()
+
+        with open(self.path) as f:
+            self.assertEqual(f.read(), "DEBUG=local\n")
+
+    def test_binary_secret_is_decoded(self):
+        self.handler.secrets["binary"] = (base64.b64encode(b"DEBUG=binary\n"), "v1")
+
+        values = Secrets.get_secrets(["binary"])
+
+        self.assertEqual(Secrets.render(["binary"], values), b"DEBUG=binary\n")
@@ -0,0 +1,124 @@
+"""Tests for database snapshots."""
+
+
+import os
+from contextlib import ExitStack
+from unittest import mock
+
+from dbmisvc_stack.app import App, Stack
+from dbmisvc_stack.commands.reup import Reup
+from tests.helpers import FakeContainer, FakeDockerClient, StackTestCase
+
+
+class SnapshotTestCase(StackTestCase):
+    database = "postgres"
+
+    def setUp(self):
+        super(SnapshotTestCase, self).setUp()
+        self.write_stack(
+            **{
+                "database-container": {"name": "db", "database": self.database},
+                "apps": {"one": {"database": "one", "database-snapshot": {"migrate": "manage.py migrate"}}},
+            }
+        )
+        self.write_compose(
+            {
+                "db": {"image": self.database, "container_name": "db", "environment": ["MYSQL_ROOT_PASSWORD=secret"]},
+                "one": {"image": "one", "container_name": "one"},
+            }
+        )
+        self.write_app_file("one/migrations/0001_initial.py", "initial")
+        self.write_app_file("one/views.py", "views")
+
+    def write_app_file(self, name, content):
+        path = os.path.join(self.root, "apps", "one", name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+
+class TestHashMigrations(SnapshotTestCase):
+    def test_changes_with_migrations_only(self):
+        before = App.hash_migrations("one")
+        self.write_app_file("one/views.py", "changed")
+        self.assertEqual(App.hash_migrations("one"), before)
+
+        self.write_app_file("one/migrations/0002_change.py", "change")
+        self.assertNotEqual(App.hash_migrations("one"), before)
+
+
+class TestPostgresSnapshots(SnapshotTestCase):
+    def test_snapshot_and_restore(self):
+        db = FakeContainer(outputs={2: b"1\n"})
+        client = FakeDockerClient({"db": db, "one": FakeContainer()})
+
+        self.assertFalse(App.restore_data(client, "one"))
+        self.assertTrue(App.migrate_and_snapshot(client, "one"))
+        self.assertIn('CREATE DATABASE "one__stack_snapshot" TEMPLATE "one"', db.commands[0][0])
+
+        self.assertTrue(App.restore_data(client, "one"))
+        self.assertIn('CREATE DATABASE "one" TEMPLATE "one__stack_snapshot"', db.commands[2][0])
+
+    def test_waits_for_healthy_container(self):
+        app = FakeContainer(health="starting")
+        client = FakeDockerClient({"db": FakeContainer(outputs={2: b"1\n"}), "one": app})
+
+        self.assertIsNone(App.wait_healthy(client, "one", timeout=0.2, interval=0.05))
+        with mock.patch.object(App, "wait_healthy", return_value=None):
+            self.assertFalse(App.migrate_and_snapshot(client, "one"))
+
+        self.assertEqual(app.commands, [])
+
+        app.health = "healthy"
+        self.assertIs(App.wait_healthy(client, "one", timeout=0.2, interval=0.05), app)
+        self.assertTrue(App.migrate_and_snapshot(client, "one"))
+        self.assertEqual(app.commands, [("manage.py migrate", None)])
+
+    def test_migrations_invalidate_snapshot(self):
+        db = FakeContainer(outputs={2: b"1\n"})
+        client = FakeDockerClient({"db": db, "one": FakeContainer()})
+        App.snapshot_data(client, "one")
+
+        self.write_app_file("one/migrations/0002_change.py", "change")
+
+        self.assertFalse(App.restore_data(client, "one"))
+        self.assertEqual(len(db.commands), 1)
+
+
+class TestMySQLSnapshots(SnapshotTestCase):
+    database = "mysql"
+
+    def test_snapshot_and_restore(self):
+        db = FakeContainer()
+        client = FakeDockerClient({"db": db})
+
+        self.assertTrue(App.snapshot_data(client, "one"))
+        self.assertTrue(App.restore_data(client, "one"))
+
+        (dump, environment), (restore, _) = db.commands
+        self.assertEqual(environment, {"MYSQL_PWD": "secret"})
+        self.assertIn("mysqldump -uroot --single-transaction", dump[2])
+        self.assertIn("one__stack_snapshot.sql", restore[2])
+        self.assertNotIn("secret", dump[2] + restore[2])
+
+
+class TestReup(SnapshotTestCase):
+    def reup(self, detached):
+        options = {"--clean": False, "<app>": None, "--purge": True, "-d": detached}
+        with ExitStack() as stack:
+            stack.enter_context(mock.patch.object(Stack, "get_docker_client"))
+            stack.enter_context(mock.patch.object(Stack, "run"))
+            stack.enter_context(mock.patch.object(Reup, "yes_no", return_value=True))
+            stack.enter_context(
+                mock.patch.object(App, "purge_all_data", return_value={"one": "purged", "two": "restored"})
+            )
+            migrate_and_snapshot = stack.enter_context(mock.patch.object(App, "migrate_and_snapshot"))
+            Reup(options).run()
+
+        return [call[0][1] for call in migrate_and_snapshot.call_args_list]
+
+    def test_snapshots_purged_apps(self):
+        self.assertEqual(self.reup(detached=True), ["one"])
+
+    def test_attached_stack_is_not_snapshot(self):
+        self.assertEqual(self.reup(detached=False), [])
@@ -0,0 +1,140 @@
+"""Tests for streaming database dumps through the exec socket."""
+
+
+import gzip
+import os
+import socket
+import struct
+import threading
+
+from dbmisvc_stack.app import App
+from tests.helpers import FakeContainer, FakeDockerClient, StackTestCase
+
+
+class FakeExecAPI(object):
+    """
+    Stands in for the exec endpoints of the Docker API, answering each exec
+    over a socket pair with a handler run on the far end.
+    """
+
+    def __init__(self, handler):
+        self.handler = handler
+        self.execs = []
+        self.threads = []
+
+    def exec_create(self, container, cmd, stdin=False, stdout=True, stderr=True, environment=None):
+        self.execs.append({"cmd": cmd, "stdin": stdin, "environment": environment})
+        return {"Id": str(len(self.execs))}
+
+    def exec_start(self, exec_id, socket=False):
+        ours, theirs = socket_pair()
+        thread = threading.Thread(target=self.serve, args=(exec_id, theirs))
+        thread.start()
+        self.threads.append(thread)
+        return ours
+
+    def serve(self, exec_id, sock):
+        execution = self.execs[int(exec_id) - 1]
+        try:
+            stdin = b""
+            if execution["stdin"]:
+                for chunk in iter(lambda: sock.recv(65536), b""):
+                    stdin += chunk
+
+            stdout, stderr, execution["exit_code"] = self.handler(execution["cmd"], stdin)
+            for stream, data in ((1, stdout), (2, stderr)):
+                if data:
+                    sock.sendall(struct.pack(">BxxxL", stream, len(data)) + data)
+
+        finally:
+            sock.close()
+
+    def exec_inspect(self, exec_id):
+        for thread in self.threads:
+            thread.join()
+
+        return {"ExitCode": self.execs[int(exec_id) - 1]["exit_code"]}
+
+
+def socket_pair():
+    return socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+
+
+class StreamTestCase(StackTestCase):
+    database = "mysql"
+
+    def setUp(self):
+        super(StreamTestCase, self).setUp()
+        self.write_stack(
+            **{"database-container": {"name": "db", "database": self.database}, "apps": {"one": {"database": "one"}}}
+        )
+        self.write_compose(
+            {"db": {"image": self.database, "container_name": "db", "environment": {"MYSQL_ROOT_PASSWORD": "secret"}}}
+        )
+
+    def client(self, handler):
+        db = FakeContainer()
+        db.id = "db-id"
+        client = FakeDockerClient({"db": db})
+        client.api = FakeExecAPI(handler)
+        return client
+
+
+class TestDump(StreamTestCase):
+    def test_streams_dump_to_file(self):
+        dump = gzip.compress(b"CREATE TABLE one (id int);\n" * 10000)
+        client = self.client(lambda cmd, stdin: (dump, b"", 0))
+        path = os.path.join(self.root, "one.sql.gz")
+
+        self.assertTrue(App.dump_database(client, "one", path))
+
+        with open(path, "rb") as f:
+            self.assertEqual(f.read(), dump)
+        [execution] = client.api.execs
+        self.assertEqual(execution["environment"], {"MYSQL_PWD": "secret"})
+        self.assertIn("mysqldump", execution["cmd"][2])
+
+    def test_failed_dump_leaves_no_file(self):
+        client = self.client(lambda cmd, stdin: (b"partial", b"Access denied", 2))
+        path = os.path.join(self.root, "one.sql.gz")
+
+        self.assertFalse(App.dump_database(client, "one", path))
+
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(os.path.exists(path + ".tmp"))
+
+
+class TestRestore(StreamTestCase):
+    def test_streams_file_to_stdin(self):
+        received = []
+
+        def handler(cmd, stdin):
+            received.append(stdin)
+            return b"", b"", 0
+
+        client = self.client(handler)
+        path = os.path.join(self.root, "one.sql.gz")
+        dump = os.urandom(3 << 20)
+        with open(path, "wb") as f:
+            f.write(dump)
+
+        self.assertTrue(App.load_database(client, "one", path, jobs=4))
+
+        self.assertEqual(received, [dump])
+        self.assertEqual(client.api.execs[0]["cmd"], ["sh", "-c", "gunzip -c | mysql -uroot one"])
+
+
+class TestPostgresRestore(StreamTestCase):
+    database = "postgres"
+
+    def test_parallel_restore_goes_through_a_file(self):
+        client = self.client(lambda cmd, stdin: (b"", b"", 0))
+        path = os.path.join(self.root, "one.dump")
+        with open(path, "wb") as f:
+            f.write(b"PGDMP")
+
+        self.assertTrue(App.load_database(client, "one", path, jobs=4))
+
+        script = client.api.execs[0]["cmd"][2]
+        self.assertIn("cat > /tmp/one__stack_snapshot.dump", script)
+        self.assertIn("--jobs=4 /tmp/one__stack_snapshot.dump", script)
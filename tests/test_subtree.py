@@ -0,0 +1,314 @@
+"""Tests for managing app subtrees."""
+
+
+import os
+from unittest import mock
+
+from dbmisvc_stack.app import App, Stack
+from dbmisvc_stack.commands.checkout import Checkout
+from dbmisvc_stack.commands.init import Init
+from dbmisvc_stack.commands.push import Push
+from dbmisvc_stack.commands.update import Update
+from dbmisvc_stack.subtree import SubtreeSplit
+from tests.helpers import StackTestCase
+
+
+class SubtreeTestCase(StackTestCase):
+    APPS = ["one", "two", "three"]
+
+    def setUp(self):
+        super(SubtreeTestCase, self).setUp()
+
+        # Create an upstream repository per app
+        self.remotes = {app: self.make_upstream(app, {"README": "{} v1\n".format(app)}) for app in self.APPS}
+        self.write_stack(apps={app: {"repository": url, "branch": "main"} for app, url in self.remotes.items()})
+        self.write_compose({app: {"build": "./overrides/{}".format(app)} for app in self.APPS})
+        self.init_stack_repo()
+
+    def read(self, app, path="README"):
+        with open(os.path.join(self.root, "apps", app, path)) as f:
+            return f.read()
+
+
+class TestFetch(SubtreeTestCase):
+    def test_fetch_all(self):
+        self.assertEqual(App.fetch_all(self.APPS, jobs=3), self.APPS)
+
+        for app in self.APPS:
+            self.assertEqual(
+                self.git("rev-parse", App.get_fetch_ref(app)),
+                self.git("rev-parse", "main", cwd=self.remotes[app]),
+            )
+
+    def test_fetch_requires_git_version(self):
+        Stack._git_version = (2, 20)
+        try:
+            self.assertFalse(Stack.check_git_version())
+            self.assertEqual(App.fetch_all(self.APPS), [])
+
+        finally:
+            Stack._git_version = None
+
+        self.assertTrue(Stack.check_git_version())
+
+    def test_fetch_all_skips_failures(self):
+        self.write_stack(apps={"one": {"repository": os.path.join(self.tmp, "missing.git"), "branch": "main"}})
+
+        self.assertEqual(App.fetch_all(["one"]), [])
+
+
+class TestInit(SubtreeTestCase):
+    def test_init_all(self):
+        Init({"<app>": None, "--jobs": "2"}).run()
+
+        for app in self.APPS:
+            self.assertEqual(self.read(app), "{} v1\n".format(app))
+
+        self.assertEqual(self.git("status", "--porcelain"), "")
+
+
+class TestUpdate(SubtreeTestCase):
+    def test_update_all(self):
+        Init({"<app>": None, "--jobs": None}).run()
+        self.commit_upstream("two", {"README": "two v2\n"}, push=True)
+
+        Update({"<app>": None, "--jobs": None}).run()
+
+        self.assertEqual(self.read("one"), "one v1\n")
+        self.assertEqual(self.read("two"), "two v2\n")
+        self.assertEqual(self.git("status", "--porcelain"), "")
+
+
+class TestChangedApps(SubtreeTestCase):
+    def setUp(self):
+        super(TestChangedApps, self).setUp()
+        Init({"<app>": None, "--jobs": None}).run()
+
+    def test_subtree_split(self):
+        for app in self.APPS:
+            self.assertEqual(App.get_subtree_split(app), self.git("rev-parse", "main", cwd=self.remotes[app]))
+
+    def test_remote_head(self):
+        head = self.commit_upstream("one", {"README": "one v2\n"}, push=True)
+
+        self.assertEqual(App.get_remote_head("one"), head)
+
+    def test_changed_apps(self):
+        self.commit_upstream("three", {"README": "three v2\n"}, push=True)
+
+        self.assertEqual(App.get_changed_apps(self.APPS), ["three"])
+
+    def test_update_skips_unchanged(self):
+        self.commit_upstream("one", {"README": "one v2\n"}, push=True)
+        head = self.git("rev-parse", "HEAD")
+
+        Update({"<app>": None, "--jobs": None, "--dry-run": True}).run()
+        self.assertEqual(self.git("rev-parse", "HEAD"), head)
+
+        Update({"<app>": None, "--jobs": None}).run()
+        self.assertEqual(self.read("one"), "one v2\n")
+        changed = self.git("diff", "--name-only", head, "HEAD", "--", "apps").splitlines()
+        self.assertEqual(changed, ["apps/one/README"])
+
+        # Nothing left to do
+        head = self.git("rev-parse", "HEAD")
+        Update({"<app>": None, "--jobs": None}).run()
+        self.assertEqual(self.git("rev-parse", "HEAD"), head)
+
+
+class TestMirror(SubtreeTestCase):
+    def setUp(self):
+        super(TestMirror, self).setUp()
+        self.write_stack(
+            **{
+                "mirrors-directory": os.path.join(self.tmp, "mirrors"),
+                "apps": {app: {"repository": url, "branch": "main"} for app, url in self.remotes.items()},
+            }
+        )
+        self.git("commit", "--quiet", "-am", "Enable mirrors")
+
+    def test_fetch_creates_and_refreshes_mirror(self):
+        self.assertTrue(App.fetch("one"))
+        self.assertTrue(os.path.exists(App.get_mirror_dir("one")))
+
+        head = self.commit_upstream("one", {"README": "one v2\n"}, push=True)
+        self.assertTrue(App.fetch("one"))
+        self.assertEqual(self.git("rev-parse", App.get_fetch_ref("one")), head)
+
+    def test_checkout_without_network(self):
+        Init({"<app>": None, "--jobs": None}).run()
+
+        # Push a branch, warm the mirror and then take the remote away
+        self.git("checkout", "--quiet", "-b", "feature", cwd=os.path.join(self.tmp, "work", "one"))
+        self.commit_upstream("one", {"README": "one feature\n"}, push=True)
+        self.assertTrue(App.update_mirror("one"))
+        os.rename(self.remotes["one"], self.remotes["one"] + ".offline")
+
+        Checkout({"<app>": "one", "<branch>": "feature", "-b": False, "--offline": False}).run()
+
+        self.assertEqual(self.read("one"), "one feature\n")
+        self.assertEqual(self.git("status", "--porcelain"), "")
+
+
+class TestSplit(SubtreeTestCase):
+    def setUp(self):
+        super(TestSplit, self).setUp()
+        Init({"<app>": None, "--jobs": None}).run()
+
+    def commit_stack(self, app, name, content):
+        with open(os.path.join(self.root, "apps", app, name), "w") as f:
+            f.write(content)
+
+        self.git("add", "-A")
+        self.git("commit", "--quiet", "-m", "Change {} in {}".format(name, app))
+
+    def test_matches_git_subtree_split(self):
+        for i in range(3):
+            self.commit_stack("one", "file{}".format(i), "{}\n".format(i))
+            self.commit_stack("two", "file{}".format(i), "{}\n".format(i))
+
+        expected = self.git("subtree", "split", "-q", "--prefix=apps/one", "HEAD")
+        self.assertEqual(SubtreeSplit("apps/one").split("HEAD"), expected)
+
+    def test_incremental_split_stays_flat(self):
+        processed = []
+        for batch in range(4):
+
+            # History keeps growing, but only the last batch should be processed
+            for i in range(5):
+                self.commit_stack("one", "file{}".format(i), "{}\n".format(batch))
+
+            splitter = SubtreeSplit("apps/one")
+            split = splitter.split("HEAD")
+            processed.append(splitter.processed)
+
+            self.assertEqual(split, self.git("subtree", "split", "-q", "--prefix=apps/one", "HEAD"))
+
+        self.assertEqual(processed[1:], [5, 5, 5])
+
+        # Nothing new to process
+        splitter = SubtreeSplit("apps/one")
+        splitter.split("HEAD")
+        self.assertEqual(splitter.processed, 0)
+
+    def test_push(self):
+        self.commit_stack("one", "pushed", "pushed\n")
+
+        Push({"<app>": "one", "<branch>": "feature", "--rejoin": False}).run()
+
+        self.assertEqual(
+            self.git("show", "feature:pushed", cwd=self.remotes["one"]),
+            "pushed",
+        )
+        self.assertEqual(
+            self.git("rev-parse", "feature^", cwd=self.remotes["one"]),
+            self.git("rev-parse", "main", cwd=self.remotes["one"]),
+        )
+
+    def test_rejoin(self):
+        self.commit_stack("one", "rejoined", "rejoined\n")
+
+        split = App.split_subtree("one", rejoin=True)
+
+        self.assertEqual(self.git("rev-parse", "HEAD^2"), split)
+        self.assertEqual(self.git("status", "--porcelain"), "")
+
+        # A fresh cache starts from the rejoin
+        os.remove(SubtreeSplit("apps/one").cache_path)
+        self.commit_stack("one", "after", "after\n")
+        splitter = SubtreeSplit("apps/one")
+        self.assertEqual(splitter.split("HEAD"), self.git("subtree", "split", "-q", "--prefix=apps/one", "HEAD"))
+        self.assertEqual(splitter.processed, 2)
+
+    def test_checkout_new_branch(self):
+        self.commit_stack("one", "branched", "branched\n")
+
+        Checkout({"<app>": "one", "<branch>": "split-one", "-b": True, "--rejoin": False, "--offline": False}).run()
+
+        self.assertEqual(self.git("show", "split-one:branched"), "branched")
+
+    def test_rejected_branch_is_not_rejoined(self):
+        self.commit_stack("one", "branched", "branched\n")
+        self.git("branch", "diverged", self.git("commit-tree", "HEAD^{tree}", "-m", "Unrelated"))
+        head = self.git("rev-parse", "HEAD")
+
+        Checkout({"<app>": "one", "<branch>": "diverged", "-b": True, "--rejoin": True, "--offline": False}).run()
+
+        self.assertEqual(self.git("rev-parse", "HEAD"), head)
+
+        Checkout({"<app>": "one", "<branch>": "split-one", "-b": True, "--rejoin": True, "--offline": False}).run()
+
+        self.assertEqual(self.git("rev-parse", "HEAD^2"), self.git("rev-parse", "split-one"))
+
+
+class TestReplace(SubtreeTestCase):
+    def setUp(self):
+        super(TestReplace, self).setUp()
+        Init({"<app>": None, "--jobs": None}).run()
+
+    def test_checkout_replaces_in_single_commit(self):
+        work = os.path.join(self.tmp, "work", "one")
+        self.commit_upstream("one", {"same": "same\n"}, push=True)
+        self.git("checkout", "--quiet", "-b", "feature", cwd=work)
+        self.commit_upstream("one", {"README": "one feature\n"}, push=True)
+        Update({"<app>": "one", "--jobs": None}).run()
+
+        # Identical files should be left alone on disk
+        same = os.stat(os.path.join(self.root, "apps", "one", "same"))
+        head = self.git("rev-parse", "HEAD")
+
+        Checkout({"<app>": "one", "<branch>": "feature", "-b": False, "--offline": False}).run()
+
+        self.assertEqual(self.git("rev-list", "--first-parent", "--count", "{}..HEAD".format(head)), "1")
+        self.assertEqual(self.read("one"), "one feature\n")
+        self.assertEqual(self.git("status", "--porcelain"), "")
+        self.assertEqual(App.get_subtree_split("one"), self.git("rev-parse", "feature", cwd=work))
+
+        after = os.stat(os.path.join(self.root, "apps", "one", "same"))
+        self.assertEqual((same.st_ino, same.st_mtime_ns), (after.st_ino, after.st_mtime_ns))
+
+    def test_failed_replace_skips_hook(self):
+        with open(os.path.join(self.root, "hooks", "post-checkout.py"), "w") as f:
+            f.write("open('hooked', 'w').close()\n")
+
+        with mock.patch.object(App, "replace_subtree", return_value=False):
+            Checkout({"<app>": "one", "<branch>": "main", "-b": False, "--offline": False}).run()
+            with self.assertRaises(SystemExit):
+                Update({"<app>": "one", "--jobs": None, "--force": True}).run()
+
+        self.assertFalse(os.path.exists(os.path.join(self.root, "hooked")))
+
+    def test_failed_head_update_restores_working_copy(self):
+        self.commit_upstream("one", {"README": "one v2\n"}, push=True)
+        self.assertTrue(App.fetch("one"))
+        head = self.git("rev-parse", "HEAD")
+
+        run = Stack.run
+        with mock.patch.object(
+            Stack, "run", side_effect=lambda args, **kwargs: 1 if "update-ref" in args else run(args, **kwargs)
+        ):
+            self.assertFalse(App.replace_subtree("one", "main"))
+
+        self.assertEqual(self.git("rev-parse", "HEAD"), head)
+        self.assertEqual(self.read("one"), "one v1\n")
+        self.assertEqual(self.git("status", "--porcelain"), "")
+
+    def test_update_continues_after_failure(self):
+        for app in self.APPS:
+            self.commit_upstream(app, {"README": "{} v2\n".format(app)}, push=True)
+
+        replace_subtree = App.replace_subtree
+        with mock.patch.object(
+            App, "replace_subtree", side_effect=lambda app, branch: app != "one" and replace_subtree(app, branch)
+        ), self.assertRaises(SystemExit):
+            Update({"<app>": None, "--jobs": None}).run()
+
+        self.assertEqual(self.read("one"), "one v1\n")
+        self.assertEqual((self.read("two"), self.read("three")), ("two v2\n", "three v2\n"))
+
+    def test_split_after_replace(self):
+        self.commit_upstream("two", {"README": "two v2\n"}, push=True)
+        Update({"<app>": "two", "--jobs": None}).run()
+
+        expected = self.git("subtree", "split", "-q", "--prefix=apps/two", "HEAD")
+        self.assertEqual(SubtreeSplit("apps/two").split("HEAD"), expected)
@@ -0,0 +1,234 @@
+"""Tests for running the stack's tests in shards."""
+
+
+import glob
+import os
+import subprocess
+import time
+import xml.etree.ElementTree as ElementTree
+from unittest import mock
+
+from dbmisvc_stack import testing
+from dbmisvc_stack.app import App
+from dbmisvc_stack.commands import test as test_command
+from tests.helpers import FakeContainer, FakeDockerClient, StackTestCase
+
+
+class TestPartition(StackTestCase):
+    def test_balanced_by_duration(self):
+        timings = {"a.py": 10, "b.py": 6, "c.py": 5, "d.py": 1}
+
+        self.assertEqual(testing.partition(list(timings), timings, 2), [["a.py", "d.py"], ["b.py", "c.py"]])
+
+    def test_unknown_modules_count_as_average(self):
+        shards = testing.partition(["a.py", "b.py", "new.py"], {"a.py": 4, "b.py": 2}, 2)
+
+        self.assertEqual(shards, [["a.py"], ["new.py", "b.py"]])
+
+    def test_no_empty_shards(self):
+        self.assertEqual(testing.partition(["a.py"], {}, 8), [["a.py"]])
+
+    def test_discover(self):
+        for path in ("tests/test_a.py", "tests/helpers.py", "apps/web/test_web.py", "b_test.py", ".venv/test_x.py"):
+            os.makedirs(os.path.dirname(os.path.join(self.root, path)) or self.root, exist_ok=True)
+            open(os.path.join(self.root, path), "w").close()
+
+        modules = testing.discover(self.root, self.root, exclude=[os.path.join(self.root, "apps")])
+        self.assertEqual(modules, ["b_test.py", os.path.join("tests", "test_a.py")])
+
+    def test_get_module(self):
+        modules = testing.get_dotted_modules(["tests/test_a.py", "tests/sub/test_b.py", "other/test_b.py"])
+
+        def module(classname):
+            return testing.get_module(ElementTree.Element("testcase", classname=classname), modules)
+
+        self.assertEqual(module("tests.test_a.TestA"), "tests/test_a.py")
+        self.assertEqual(module("test_a.TestA"), "tests/test_a.py")
+        self.assertEqual(module("sub.test_b.TestB"), "tests/sub/test_b.py")
+        self.assertIsNone(module("test_b.TestB"))
+
+
+class TestRunTests(StackTestCase):
+    def write(self, path, content):
+        os.makedirs(os.path.dirname(os.path.join(self.root, path)), exist_ok=True)
+        with open(os.path.join(self.root, path), "w") as f:
+            f.write(content)
+
+    def test_merge_reports(self):
+        self.write(
+            "nose.xml",
+            '<testsuite name="nosetests" tests="2" errors="0" failures="1" skip="1">'
+            '<testcase classname="test_a.TestA" name="test_one" time="0.5"/>'
+            '<testcase classname="test_a.TestA" name="test_two" time="1.5"><failure/></testcase>'
+            "</testsuite>",
+        )
+        self.write(
+            "pytest.xml",
+            '<testsuites><testsuite name="pytest" tests="1" errors="1" failures="0" skipped="0">'
+            '<testcase classname="test_b.TestB" name="test_three" time="2"/></testsuite></testsuites>',
+        )
+
+        testcases = testing.merge_reports(["nose.xml", "pytest.xml", "missing.xml"], "junit.xml")
+        root = ElementTree.parse("junit.xml").getroot()
+
+        self.assertEqual([testcase.get("name") for testcase in testcases], ["test_one", "test_two", "test_three"])
+        self.assertEqual(
+            {key: root.get(key) for key in ("tests", "failures", "errors", "skipped", "time")},
+            {"tests": "3", "failures": "1", "errors": "1", "skipped": "1", "time": "4.000"},
+        )
+
+    def test_run_tests(self):
+        self.write("tests/test_pass.py", "def test_pass():\n    pass\n")
+        self.write("tests/test_fail.py", "def test_fail():\n    assert False\n\n\ndef test_pass():\n    pass\n")
+        modules = testing.discover(self.root, self.root)
+
+        with self.assertLogs("stack", level="INFO") as logs:
+            passed = testing.run_tests(
+                modules, testing.RUNNERS["pytest"], "shards", "timings.json", 4, root=self.root, report="junit.xml"
+            )
+
+        self.assertFalse(passed)
+        self.assertIn("INFO:stack:(test) Running 2 module(s) in 2 shard(s)...", logs.output)
+        self.assertEqual(ElementTree.parse("junit.xml").getroot().get("tests"), "3")
+        self.assertEqual(
+            sorted(testing.load_timings("timings.json")),
+            [os.path.join("tests", "test_fail.py"), os.path.join("tests", "test_pass.py")],
+        )
+
+
+class TestCheckReady(StackTestCase):
+    def test_check_ready(self):
+        self.write_compose(
+            {
+                "web": {"image": "web", "container_name": "web"},
+                "api": {"image": "registry/api:1.0", "container_name": "api"},
+                "worker": {"image": "worker", "container_name": "worker"},
+                "cache": {"container_name": "cache"},
+            }
+        )
+        docker_client = FakeDockerClient(
+            {"web": FakeContainer(), "api": FakeContainer(status="exited"), "worker": FakeContainer()},
+            images=["web:latest", "registry/api:1.0"],
+        )
+
+        problems = App.check_ready(docker_client, ["web", "api", "worker", "cache"])
+        self.assertEqual(sorted(problems), ["api", "cache", "worker"])
+        self.assertIn("not running", problems["api"])
+        self.assertIn("image does not exist", problems["worker"])
+
+    def test_check_ready_normalizes_images(self):
+        digest = "sha256:" + "0" * 64
+        self.write_compose(
+            {
+                "db": {"image": "docker.io/library/postgres:13", "container_name": "db"},
+                "cache": {"image": "registry-1.docker.io/library/redis", "container_name": "cache"},
+                "web": {"image": "index.docker.io/org/web:1.0", "container_name": "web"},
+                "api": {"image": "org/api@{}".format(digest), "container_name": "api"},
+                "worker": {"image": "registry.example.com/library/worker", "container_name": "worker"},
+            }
+        )
+        docker_client = FakeDockerClient(
+            {app: FakeContainer() for app in ("db", "cache", "web", "api", "worker")},
+            images=["postgres:13", "redis:latest", "org/web:1.0", "docker.io/org/api@{}".format(digest), "worker"],
+        )
+
+        problems = App.check_ready(docker_client, ["db", "cache", "web", "api", "worker"])
+        self.assertEqual(sorted(problems), ["worker"])
+
+    def test_normalize_image(self):
+        self.assertEqual(App.normalize_image("postgres"), "postgres:latest")
+        self.assertEqual(App.normalize_image("library/postgres:13"), "postgres:13")
+        self.assertEqual(App.normalize_image("docker.io/library/postgres:13"), "postgres:13")
+        self.assertEqual(App.normalize_image("localhost:5000/app"), "localhost:5000/app:latest")
+        self.assertEqual(App.normalize_image("postgres@sha256:abc"), "postgres@sha256:abc")
+        self.assertEqual(App.normalize_image("docker.io/org/app:1.0@sha256:abc"), "org/app@sha256:abc")
+
+
+class LocalExecAPI(object):
+    """Runs exec'd commands on this machine, as if it were the container."""
+
+    def __init__(self):
+        self.processes = {}
+
+    def exec_create(self, container, cmd, stdout=True, stderr=True):
+        self.processes[container + str(len(self.processes))] = cmd
+        return {"Id": container + str(len(self.processes) - 1)}
+
+    def exec_start(self, exec_id, stream=False):
+        process = subprocess.Popen(self.processes[exec_id], stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        self.processes[exec_id] = process
+        for line in process.stdout:
+            yield line
+
+        process.wait()
+
+    def exec_inspect(self, exec_id):
+        return {"ExitCode": self.processes[exec_id].returncode}
+
+
+class LocalContainer(FakeContainer):
+    def __init__(self, name):
+        super(LocalContainer, self).__init__(name=name)
+        self.id = name
+
+    def exec_run(self, cmd, environment=None):
+        return subprocess.call(cmd), b""
+
+
+class TestAppTests(StackTestCase):
+    def setUp(self):
+        super(TestAppTests, self).setUp()
+        self.pid_file = App.TEST_PID_FILE
+        App.TEST_PID_FILE = os.path.join(self.tmp, "{app}-{run}.pid")
+
+        self.write_compose({app: {"image": app, "container_name": app} for app in ("web", "api", "worker")})
+        self.docker_client = FakeDockerClient({app: LocalContainer(app) for app in ("web", "api", "worker")})
+        self.docker_client.api = LocalExecAPI()
+
+    def tearDown(self):
+        App.TEST_PID_FILE = self.pid_file
+        super(TestAppTests, self).tearDown()
+
+    def run_apps(self, tests, fail_fast=False):
+        self.write_stack(apps={app: {"test": command} for app, command in tests.items()})
+        command = test_command.Test({"--fail-fast": fail_fast, "--jobs": None})
+        with self.assertLogs("stack", level="INFO") as logs:
+            results = command.run_apps(self.docker_client, [app for app in App.get_apps() if App.get_test_command(app)])
+
+        return {result.app: result for result in results}, logs.output
+
+    def test_output_and_exit_codes(self):
+        results, output = self.run_apps({"web": "echo one; echo two", "api": "echo failed >&2; exit 3"})
+
+        self.assertEqual((results["web"].exit_code, results["api"].exit_code), (0, 3))
+        self.assertNotIn("worker", results)
+        self.assertIn("INFO:stack:(web) one", output)
+        self.assertIn("INFO:stack:(web) two", output)
+        self.assertIn("INFO:stack:(api) failed", output)
+
+    def test_fail_fast(self):
+        start = time.monotonic()
+        results, output = self.run_apps({"web": "sleep 30", "api": "sleep 0.5; exit 1"}, fail_fast=True)
+
+        self.assertLess(time.monotonic() - start, 10)
+        self.assertEqual(results["api"].exit_code, 1)
+        self.assertFalse(results["api"].cancelled)
+        self.assertTrue(results["web"].cancelled)
+        self.assertIn("ERROR:stack:(api) Tests failed, stopping the others...", output)
+
+    def test_pid_files_are_removed(self):
+        self.run_apps({"web": "sleep 30", "api": "sleep 0.5; exit 1", "worker": "true"}, fail_fast=True)
+
+        self.assertEqual(glob.glob(os.path.join(self.tmp, "*.pid*")), [])
+
+    def test_stop_only_kills_its_run(self):
+        process = subprocess.Popen(["sleep", "30"])
+        self.addCleanup(process.wait)
+        self.addCleanup(process.kill)
+        with open(App.TEST_PID_FILE.format(app="web", run="earlier"), "w") as f:
+            f.write(str(process.pid))
+
+        with mock.patch.object(App, "TEST_PID_TIMEOUT", 1):
+            App.stop_tests(self.docker_client, "web", "current")
+
+        self.assertIsNone(process.poll())
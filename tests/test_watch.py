@@ -0,0 +1,75 @@
+"""Tests for watching package sources."""
+
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from dbmisvc_stack.watch import InotifyWatcher, PollingWatcher, wait_debounced
+
+
+class WatcherTests(object):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+        os.makedirs(os.path.join(self.path, "package"))
+        self.write("package/__init__.py", "VERSION = 1\n")
+
+        self.watcher = self.make_watcher([self.path], ignore=lambda name: name in ("dist", "build"))
+        self.addCleanup(self.watcher.close)
+
+    def make_watcher(self, paths, ignore):
+        raise NotImplementedError
+
+    def write(self, name, content):
+        path = os.path.join(self.path, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w") as f:
+            f.write(content)
+
+    def test_detects_changes(self):
+        self.write("package/__init__.py", "VERSION = 20\n")
+
+        self.assertEqual(self.watcher.wait(5), {self.path})
+
+    def test_detects_new_directories(self):
+        os.makedirs(os.path.join(self.path, "package", "sub"))
+        self.watcher.wait(5)
+        self.write("package/sub/module.py", "")
+
+        self.assertEqual(self.watcher.wait(5), {self.path})
+
+    def test_ignores_build_outputs(self):
+        self.write("dist/package-1.tar.gz", "archive")
+
+        self.assertEqual(self.watcher.wait(1), set())
+
+    def test_debounces_bursts(self):
+        def edit():
+            for version in range(3):
+                self.write("package/__init__.py", "VERSION = {}\n".format(version))
+
+        timer = threading.Timer(0.1, edit)
+        timer.start()
+        self.addCleanup(timer.join)
+
+        changed, _ = wait_debounced(self.watcher, quiet=1, timeout=5)
+        self.assertEqual(changed, {self.path})
+        self.assertEqual(self.watcher.wait(0.5), set())
+
+
+class TestPollingWatcher(WatcherTests, unittest.TestCase):
+    def make_watcher(self, paths, ignore):
+        watcher = PollingWatcher(paths, ignore)
+        watcher.INTERVAL = 0.1
+        return watcher
+
+
+class TestInotifyWatcher(WatcherTests, unittest.TestCase):
+    def make_watcher(self, paths, ignore):
+        try:
+            return InotifyWatcher(paths, ignore)
+        except OSError:
+            self.skipTest("inotify is not available")